@@ -5,7 +5,7 @@ from celery.schedules import crontab
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "BarberFlow.settings")
 app = Celery("BarberFlow")
 app.config_from_object("django.conf:settings", namespace="CELERY")
-app.autodiscover_tasks(['scheduling'])  # fuerza descubrimiento de tareas
+app.autodiscover_tasks(['scheduling', 'analytics', 'dashboard'])  # fuerza descubrimiento de tareas
 
 @app.task(bind=True)
 def debug_task(self):
@@ -13,15 +13,29 @@ def debug_task(self):
 
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
-    from scheduling.tasks import enviar_recordatorios, marcar_no_show_citas
+    from scheduling.tasks import enviar_emails_pendientes, enviar_recordatorios, marcar_no_show_citas
     # Cada 5 minutos: recordatorios 2h antes
     sender.add_periodic_task(300.0, enviar_recordatorios.s(), name="recordatorios_2h")
     # Cada 10 minutos: marcar no show (gracia 15 min)
     sender.add_periodic_task(600.0, marcar_no_show_citas.s(), name="marcar_no_show")
+    # Cada minuto: drenar la bandeja de salida de emails (reintentos pendientes)
+    sender.add_periodic_task(60.0, enviar_emails_pendientes.s(), name="drenar_emails")
     app.conf.beat_schedule = {
     # ...existing tasks...
     'recordatorios-24h': {
         'task': 'scheduling.tasks.enviar_recordatorios_24h',
         'schedule': crontab(minute='*/30'),  # Cada 30 min
     },
+    'reconciliar-resumen-diario': {
+        'task': 'analytics.tasks.reconciliar_resumen_diario',
+        'schedule': crontab(hour=3, minute=30),  # Cada noche
+    },
+    'reencolar-exportaciones': {
+        'task': 'dashboard.tasks.reencolar_exportaciones',
+        'schedule': crontab(minute='*/5'),  # Cada 5 min
+    },
+    'limpiar-exportaciones': {
+        'task': 'dashboard.tasks.limpiar_exportaciones',
+        'schedule': crontab(hour=4, minute=0),  # Cada noche
+    },
 }
\ No newline at end of file
@@ -47,6 +47,7 @@ INSTALLED_APPS = [
     'dashboard.apps.DashboardConfig',
     'licensing.apps.LicensingConfig',
     'scheduling.apps.SchedulingConfig',
+    'benchmarks.apps.BenchmarksConfig',
     'django_celery_results',
     'channels',
 ]
@@ -140,6 +141,9 @@ STATICFILES_DIRS = [
     BASE_DIR / "BarberFlow" / "static",
 ]
 STATIC_ROOT = BASE_DIR / "staticfiles"
+
+# Archivos de exportaciones en segundo plano (no se sirven como estáticos)
+EXPORTACIONES_ROOT = BASE_DIR / "exportaciones"
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Celery Configuration
@@ -149,7 +153,7 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
-CELERY_IMPORTS = ("scheduling.tasks",)
+CELERY_IMPORTS = ("scheduling.tasks", "analytics.tasks", "dashboard.tasks")
 
 # Redis Cache Settings
 CACHES = {
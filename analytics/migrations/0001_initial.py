@@ -0,0 +1,75 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def cargar_historico(apps, schema_editor):
+    """Llena el resumen con todas las citas existentes"""
+    Cita = apps.get_model('scheduling', 'Cita')
+    ResumenDiarioCitas = apps.get_model('analytics', 'ResumenDiarioCitas')
+    filas = Cita.objects.annotate(dia=TruncDate('fecha_hora')).values(
+        'dia', 'barbero_id', 'barbero__nosotros_id', 'sucursal_id', 'servicio_id', 'estado'
+    ).annotate(
+        total=Count('id'),
+        suma_precio=Sum('precio'),
+        suma_minutos=Sum('servicio__duracion_minutos'),
+    ).order_by()
+    ResumenDiarioCitas.objects.bulk_create(
+        (
+            ResumenDiarioCitas(
+                nosotros_id=fila['barbero__nosotros_id'],
+                sucursal_id=fila['sucursal_id'],
+                barbero_id=fila['barbero_id'],
+                servicio_id=fila['servicio_id'],
+                fecha=fila['dia'],
+                estado=fila['estado'],
+                cantidad=fila['total'],
+                ingresos=fila['suma_precio'] or 0,
+                minutos=fila['suma_minutos'] or 0,
+            )
+            for fila in filas.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('scheduling', '0011_cita_fecha_hora_fin'),
+        ('core', '0012_saldopuntos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenDiarioCitas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('estado', models.CharField(max_length=20)),
+                ('cantidad', models.PositiveIntegerField(default=0)),
+                ('ingresos', models.DecimalField(decimal_places=2, default=0, help_text='Suma de Cita.precio', max_digits=12)),
+                ('minutos', models.PositiveIntegerField(default=0, help_text='Suma de la duración de los servicios')),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+                ('barbero', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_diarios', to='core.barbero')),
+                ('nosotros', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_diarios', to='core.nosotros')),
+                ('servicio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_diarios', to='core.servicio')),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_diarios', to='core.sucursal')),
+            ],
+            options={
+                'verbose_name': 'Resumen diario de citas',
+                'verbose_name_plural': 'Resúmenes diarios de citas',
+                'indexes': [models.Index(fields=['nosotros', 'fecha'], name='analytics_r_nosotro_743b6c_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='resumendiariocitas',
+            constraint=models.UniqueConstraint(fields=('fecha', 'barbero', 'sucursal', 'servicio', 'estado'), name='resumen_diario_citas_unico'),
+        ),
+        migrations.RunPython(cargar_historico, migrations.RunPython.noop),
+    ]
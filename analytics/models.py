@@ -1,3 +1,37 @@
 from django.db import models
 
-# Create your models here.
+from core.models import Barbero, Nosotros, Servicio, Sucursal
+
+
+class ResumenDiarioCitas(models.Model):
+    """
+    Hechos diarios de citas por (barbería, sucursal, barbero, servicio,
+    estado). La fecha es la local de fecha_hora. Se mantiene desde las
+    señales de Cita y con la reconciliación nocturna (ver rollup.py).
+    """
+    nosotros = models.ForeignKey(Nosotros, on_delete=models.CASCADE, related_name="resumenes_diarios")
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.CASCADE, related_name="resumenes_diarios")
+    barbero = models.ForeignKey(Barbero, on_delete=models.CASCADE, related_name="resumenes_diarios")
+    servicio = models.ForeignKey(Servicio, on_delete=models.CASCADE, related_name="resumenes_diarios")
+    fecha = models.DateField()
+    estado = models.CharField(max_length=20)
+    cantidad = models.PositiveIntegerField(default=0)
+    ingresos = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Suma de Cita.precio")
+    minutos = models.PositiveIntegerField(default=0, help_text="Suma de la duración de los servicios")
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Resumen diario de citas"
+        verbose_name_plural = "Resúmenes diarios de citas"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["fecha", "barbero", "sucursal", "servicio", "estado"],
+                name="resumen_diario_citas_unico",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["nosotros", "fecha"]),
+        ]
+
+    def __str__(self):
+        return f"{self.fecha} {self.barbero_id}/{self.servicio_id} {self.estado}: {self.cantidad}"
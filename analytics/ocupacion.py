@@ -0,0 +1,237 @@
+"""
+Ocupación real por barbero y día.
+
+Minutos disponibles: franjas del horario semanal del barbero, o las del
+día excepcional de su sucursal cuando existe (igual que la agenda).
+Minutos reservados: intervalos [fecha_hora, fecha_hora_fin) de las citas
+que ocupan la silla, unidos por barbero (dos citas que se pisan cuentan
+una vez) y recortados a las franjas disponibles, así la ocupación nunca
+pasa del 100 %. Una cita que cruza la medianoche suma en ambos días.
+
+El cálculo es por conjuntos: barberos, horarios, días excepcionales y
+citas del rango se leen en cuatro consultas. El resultado de cada día
+del tenant queda en caché; rollup.recalcular borra los días que toca. Un
+cambio de horario o de día excepcional puede tocar cualquier día, así que
+sube la versión de caché del tenant (ver signals.py) y deja huérfanas
+todas sus entradas.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from core.models import Barbero, DiaExcepcional, HorarioDisponibilidad
+from scheduling.disponibilidad import franjas_excepcion, rango_dia, unir_intervalos
+from scheduling.ocupacion import dias_intervalo
+from scheduling.models import Cita
+
+# Las citas canceladas liberan la silla; un no-show la ocupó igualmente
+ESTADOS_OCUPAN = (
+    Cita.Estado.PENDIENTE,
+    Cita.Estado.CONFIRMADA,
+    Cita.Estado.EN_PROCESO,
+    Cita.Estado.COMPLETADA,
+    Cita.Estado.NO_SHOW,
+)
+HORAS_DIA = 24
+# Días pasados casi no cambian; hoy y los futuros se refrescan antes
+CACHE_PASADO_SEG = 24 * 60 * 60
+CACHE_VIGENTE_SEG = 10 * 60
+
+
+def _clave_version(nosotros_id):
+    return f"ocupacion:version:{nosotros_id}"
+
+
+def _clave(nosotros_id, fecha, version):
+    return f"ocupacion:{nosotros_id}:v{version}:{fecha.isoformat()}"
+
+
+def _minutos(hora):
+    return hora.hour * 60 + hora.minute
+
+
+def _dia_vacio():
+    return {'disponibles': 0, 'reservados': 0, 'horas': [[0, 0] for _ in range(HORAS_DIA)]}
+
+
+def _sumar_por_hora(horas, indice, desde, hasta):
+    """Reparte los minutos [desde, hasta) entre las horas del día"""
+    while desde < hasta:
+        hora = desde // 60
+        corte = min(hasta, (hora + 1) * 60)
+        horas[hora][indice] += corte - desde
+        desde = corte
+
+
+def _tramo_del_dia(inicio, fin, fecha):
+    """Minutos [desde, hasta) de `fecha` cubiertos por [inicio, fin), en hora local"""
+    inicio = timezone.localtime(inicio)
+    fin = timezone.localtime(fin)
+    desde = 0 if inicio.date() < fecha else _minutos(inicio)
+    hasta = HORAS_DIA * 60 if fin.date() > fecha else _minutos(fin)
+    return desde, hasta
+
+
+def _fechas(desde, hasta):
+    return [desde + timedelta(days=i) for i in range((hasta - desde).days + 1)]
+
+
+def calcular(nosotros_id, desde, hasta):
+    """
+    Ocupación de cada día de [desde, hasta] para el tenant, sin caché.
+
+    Devuelve {fecha: {'disponibles', 'reservados', 'horas'}} donde
+    'horas' son 24 pares [disponibles, reservados] en minutos.
+    """
+    dias = {fecha: _dia_vacio() for fecha in _fechas(desde, hasta)}
+    barberos = dict(
+        Barbero.objects.filter(nosotros_id=nosotros_id, activo=True).values_list('id', 'sucursal_principal_id')
+    )
+    if not barberos or not dias:
+        return dias
+
+    franjas_semana = defaultdict(list)
+    horarios = HorarioDisponibilidad.objects.filter(
+        barbero_id__in=list(barberos),
+        activo=True
+    ).values_list('barbero_id', 'dia_semana', 'hora_inicio', 'hora_fin')
+    for barbero_id, dia_semana, hora_inicio, hora_fin in horarios:
+        franjas_semana[(barbero_id, dia_semana)].append((_minutos(hora_inicio), _minutos(hora_fin)))
+
+    excepciones = {
+        (excepcion.sucursal_id, excepcion.fecha): [
+            (_minutos(inicio), _minutos(fin)) for inicio, fin in franjas_excepcion(excepcion)
+        ]
+        for excepcion in DiaExcepcional.objects.filter(
+            sucursal_id__in=set(barberos.values()),
+            fecha__gte=desde,
+            fecha__lte=hasta
+        )
+    }
+
+    franjas = {}
+    for barbero_id, sucursal_id in barberos.items():
+        for fecha, dia in dias.items():
+            tramos = excepciones.get((sucursal_id, fecha))
+            if tramos is None:
+                tramos = franjas_semana.get((barbero_id, fecha.weekday()), [])
+            tramos = unir_intervalos(sorted(tramos))
+            franjas[(barbero_id, fecha)] = tramos
+            for inicio, fin in tramos:
+                dia['disponibles'] += max(fin - inicio, 0)
+                _sumar_por_hora(dia['horas'], 0, inicio, fin)
+
+    inicio_rango, _ = rango_dia(desde)
+    _, fin_rango = rango_dia(hasta)
+    intervalos = defaultdict(list)
+    citas = Cita.objects.filter(
+        barbero_id__in=list(barberos),
+        fecha_hora__lt=fin_rango,
+        fecha_hora_fin__gt=inicio_rango,
+        estado__in=ESTADOS_OCUPAN
+    ).order_by('fecha_hora').values_list('barbero_id', 'fecha_hora', 'fecha_hora_fin')
+    for barbero_id, fecha_hora, fecha_hora_fin in citas:
+        intervalos[barbero_id].append((fecha_hora, fecha_hora_fin))
+
+    for barbero_id, ocupados in intervalos.items():
+        for inicio_cita, fin_cita in unir_intervalos(ocupados):
+            for fecha in dias_intervalo(inicio_cita, fin_cita):
+                dia = dias.get(fecha)
+                if dia is None:
+                    continue
+                inicio, fin = _tramo_del_dia(inicio_cita, fin_cita, fecha)
+                for franja_inicio, franja_fin in franjas[(barbero_id, fecha)]:
+                    desde_min, hasta_min = max(inicio, franja_inicio), min(fin, franja_fin)
+                    if hasta_min > desde_min:
+                        dia['reservados'] += hasta_min - desde_min
+                        _sumar_por_hora(dia['horas'], 1, desde_min, hasta_min)
+    return dias
+
+
+def ocupacion_dias(nosotros_id, desde, hasta):
+    """
+    Como `calcular`, pero leyendo de caché los días ya calculados.
+    Los que faltan se calculan juntos en un único pase.
+    """
+    fechas = _fechas(desde, hasta)
+    version = cache.get(_clave_version(nosotros_id), 1)
+    claves = {_clave(nosotros_id, fecha, version): fecha for fecha in fechas}
+    en_cache = cache.get_many(list(claves))
+    dias = {claves[clave]: valor for clave, valor in en_cache.items()}
+
+    faltantes = [fecha for fecha in fechas if fecha not in dias]
+    if faltantes:
+        calculados = calcular(nosotros_id, min(faltantes), max(faltantes))
+        hoy = timezone.localdate()
+        pasados, vigentes = {}, {}
+        for fecha in faltantes:
+            dias[fecha] = calculados[fecha]
+            destino = pasados if fecha < hoy else vigentes
+            destino[_clave(nosotros_id, fecha, version)] = calculados[fecha]
+        if pasados:
+            cache.set_many(pasados, CACHE_PASADO_SEG)
+        if vigentes:
+            cache.set_many(vigentes, CACHE_VIGENTE_SEG)
+    return dict(sorted(dias.items()))
+
+
+def porcentaje(reservados, disponibles):
+    return int(reservados * 100 / disponibles) if disponibles else 0
+
+
+def ocupacion_total(dias):
+    """Ocupación total del rango: (minutos disponibles, reservados, %)"""
+    disponibles = sum(dia['disponibles'] for dia in dias.values())
+    reservados = sum(dia['reservados'] for dia in dias.values())
+    return disponibles, reservados, porcentaje(reservados, disponibles)
+
+
+def mapa_calor(dias):
+    """
+    Ocupación por día de la semana × hora para un heatmap.
+
+    Devuelve {'horas': [h, ...], 'filas': [(nombre_dia, [% o None, ...])]}
+    con solo las horas en que alguien trabajó; None marca una celda sin
+    minutos disponibles.
+    """
+    acumulado = defaultdict(lambda: [[0, 0] for _ in range(HORAS_DIA)])
+    for fecha, dia in dias.items():
+        semana = acumulado[fecha.weekday()]
+        for hora, (disponibles, reservados) in enumerate(dia['horas']):
+            semana[hora][0] += disponibles
+            semana[hora][1] += reservados
+
+    horas = [
+        hora for hora in range(HORAS_DIA)
+        if any(semana[hora][0] for semana in acumulado.values())
+    ]
+    filas = [
+        (
+            HorarioDisponibilidad.DiaSemana(dia_semana).label,
+            [
+                porcentaje(acumulado[dia_semana][hora][1], acumulado[dia_semana][hora][0])
+                if acumulado[dia_semana][hora][0] else None
+                for hora in horas
+            ]
+        )
+        for dia_semana in range(7)
+    ]
+    return {'horas': horas, 'filas': filas}
+
+
+def invalidar(nosotros_ids, fechas):
+    nosotros_ids = set(nosotros_ids)
+    versiones = cache.get_many([_clave_version(nosotros_id) for nosotros_id in nosotros_ids])
+    cache.delete_many([
+        _clave(nosotros_id, fecha, versiones.get(_clave_version(nosotros_id), 1))
+        for nosotros_id in nosotros_ids for fecha in set(fechas)
+    ])
+
+
+def invalidar_tenant(nosotros_id):
+    """Nueva versión de caché para el tenant: sus días cacheados dejan de leerse"""
+    clave = _clave_version(nosotros_id)
+    if not cache.add(clave, 2, None):
+        cache.incr(clave)
@@ -0,0 +1,189 @@
+"""
+Mantenimiento de ResumenDiarioCitas.
+
+La unidad de recálculo es (barbero, fecha): cuando cambia una cita se
+vuelve a agregar ese día del barbero desde scheduling_cita y se hace
+upsert de sus filas, borrando las combinaciones que ya no existen. El
+recálculo corre en Celery (recalcular_resumen_diario), a lo más uno
+pendiente por día. El resultado es idempotente, así que reintentar o
+reconciliar nunca duplica; reconciliar_resumen_diario cubre cualquier
+tarea perdida.
+"""
+import logging
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from core.models import Barbero
+from scheduling import efectos
+from scheduling.disponibilidad import rango_dia
+from scheduling.models import Cita
+from . import ocupacion
+from .models import ResumenDiarioCitas
+
+logger = logging.getLogger(__name__)
+
+CAMPOS_CLAVE = ['fecha', 'barbero', 'sucursal', 'servicio', 'estado']
+
+# Espera antes de recalcular un día: agrupa las ráfagas de cambios
+ESPERA_SEG = 30
+
+
+def dia_kpi(barbero_id, fecha_hora):
+    if barbero_id is None or fecha_hora is None:
+        return None
+    return (barbero_id, timezone.localtime(fecha_hora).date())
+
+
+def _agregar(citas):
+    """Filas ResumenDiarioCitas (sin guardar) agregadas desde un queryset de Cita"""
+    filas = citas.annotate(dia=TruncDate('fecha_hora')).values(
+        'dia', 'barbero_id', 'barbero__nosotros_id', 'sucursal_id', 'servicio_id', 'estado'
+    ).annotate(
+        total=Count('id'),
+        suma_precio=Sum('precio'),
+        suma_minutos=Sum('servicio__duracion_minutos'),
+    ).order_by()
+    return [
+        ResumenDiarioCitas(
+            nosotros_id=fila['barbero__nosotros_id'],
+            sucursal_id=fila['sucursal_id'],
+            barbero_id=fila['barbero_id'],
+            servicio_id=fila['servicio_id'],
+            fecha=fila['dia'],
+            estado=fila['estado'],
+            cantidad=fila['total'],
+            ingresos=fila['suma_precio'] or 0,
+            minutos=fila['suma_minutos'] or 0,
+        )
+        for fila in filas
+    ]
+
+
+def _clave(fila):
+    return (fila.fecha, fila.barbero_id, fila.sucursal_id, fila.servicio_id, fila.estado)
+
+
+def recalcular(pares):
+    """Recalcula los días (barbero_id, fecha) indicados"""
+    pares = {par for par in pares if par}
+    if not pares:
+        return
+    barbero_ids = {barbero_id for barbero_id, _ in pares}
+    fechas = {fecha for _, fecha in pares}
+    inicio, _ = rango_dia(min(fechas))
+    _, fin = rango_dia(max(fechas))
+
+    filas = [
+        fila for fila in _agregar(Cita.objects.filter(
+            barbero_id__in=barbero_ids,
+            fecha_hora__gte=inicio,
+            fecha_hora__lt=fin
+        ))
+        if (fila.barbero_id, fila.fecha) in pares
+    ]
+    vigentes = {_clave(fila) for fila in filas}
+
+    with transaction.atomic():
+        existentes = ResumenDiarioCitas.objects.filter(barbero_id__in=barbero_ids, fecha__in=fechas)
+        obsoletas = [
+            fila.id for fila in existentes.only(*CAMPOS_CLAVE)
+            if (fila.barbero_id, fila.fecha) in pares and _clave(fila) not in vigentes
+        ]
+        if obsoletas:
+            ResumenDiarioCitas.objects.filter(id__in=obsoletas).delete()
+        ResumenDiarioCitas.objects.bulk_create(
+            filas,
+            update_conflicts=True,
+            unique_fields=CAMPOS_CLAVE,
+            update_fields=['nosotros', 'cantidad', 'ingresos', 'minutos', 'actualizado_en'],
+        )
+    # Una cita que cruza la medianoche también ocupa el día siguiente
+    ocupacion.invalidar(
+        Barbero.objects.filter(id__in=barbero_ids).values_list('nosotros_id', flat=True),
+        fechas | {fecha + timedelta(days=1) for fecha in fechas}
+    )
+
+
+def _clave_pendiente(par):
+    barbero_id, fecha = par
+    return f"resumen_pendiente:{barbero_id}:{fecha.isoformat()}"
+
+
+def recalcular_tras_commit(pares):
+    """
+    Programa el recálculo de los días tras el COMMIT. Todos los cambios de
+    la transacción se juntan en una sola llamada a programar_recalculo.
+    """
+    pares = {par for par in pares if par}
+    if pares:
+        efectos.acumular_tras_commit(programar_recalculo, pares)
+
+
+def programar_recalculo(pares):
+    """
+    Encola recalcular_resumen_diario para los días que no tienen ya un
+    recálculo pendiente. La marca por (barbero, fecha) dura ESPERA_SEG, y
+    la tarea corre al cabo de ese plazo: las ráfagas de cambios sobre el
+    mismo día se resuelven con un solo recálculo fuera de la petición.
+
+    Un fallo del broker no debe afectar a la reserva que lo disparó: se
+    registra, se quitan las marcas y lo corrige la reconciliación.
+    """
+    from .tasks import recalcular_resumen_diario
+
+    nuevos = []
+    try:
+        nuevos = sorted(par for par in pares if cache.add(_clave_pendiente(par), 1, ESPERA_SEG * 2))
+        if nuevos:
+            recalcular_resumen_diario.apply_async(
+                args=[[(barbero_id, fecha.isoformat()) for barbero_id, fecha in nuevos]],
+                countdown=ESPERA_SEG,
+            )
+    except Exception:
+        logger.warning("No se pudo programar el recálculo del resumen diario %s", sorted(pares), exc_info=True)
+        try:
+            cache.delete_many([_clave_pendiente(par) for par in nuevos])
+        except Exception:
+            # Las marcas expiran solas en 2 × ESPERA_SEG
+            pass
+
+
+def recalcular_pendientes(pares):
+    """
+    Cuerpo de la tarea: quita las marcas antes de leer las citas, así un
+    cambio que llegue durante el recálculo programa otro.
+    """
+    pares = {par for par in pares if par}
+    cache.delete_many([_clave_pendiente(par) for par in pares])
+    recalcular(pares)
+
+
+def reconciliar(desde, hasta, nosotros=None):
+    """
+    Reconstruye todas las filas de [desde, hasta] desde scheduling_cita.
+    Devuelve cuántas filas quedaron.
+    """
+    inicio, _ = rango_dia(desde)
+    _, fin = rango_dia(hasta)
+    citas = Cita.objects.filter(fecha_hora__gte=inicio, fecha_hora__lt=fin)
+    resumenes = ResumenDiarioCitas.objects.filter(fecha__gte=desde, fecha__lte=hasta)
+    if nosotros is not None:
+        citas = citas.filter(barbero__nosotros=nosotros)
+        resumenes = resumenes.filter(nosotros=nosotros)
+
+    filas = _agregar(citas)
+    with transaction.atomic():
+        resumenes.delete()
+        ResumenDiarioCitas.objects.bulk_create(filas, batch_size=1000)
+    return len(filas)
+
+
+def reconciliar_recientes(dias=7):
+    """Reconcilia los últimos `dias` días y los próximos 60 (citas futuras)"""
+    hoy = timezone.localdate()
+    return reconciliar(hoy - timedelta(days=dias), hoy + timedelta(days=60))
@@ -0,0 +1,53 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from core.models import Barbero, DiaExcepcional, HorarioDisponibilidad, Sucursal
+from scheduling.models import Cita
+from scheduling.signals import citas_actualizadas_en_bloque
+from . import ocupacion, rollup
+
+
+@receiver(post_init, sender=Cita)
+def recordar_dia_kpi(sender, instance, **kwargs):
+    """Barbero/fecha originales: al reprogramar también cambia el día anterior"""
+    instance._dia_kpi_previo = rollup.dia_kpi(
+        instance.__dict__.get('barbero_id'), instance.__dict__.get('fecha_hora')
+    )
+
+
+@receiver(post_save, sender=Cita)
+@receiver(post_delete, sender=Cita)
+def actualizar_resumen_cita(sender, instance, **kwargs):
+    actual = rollup.dia_kpi(instance.barbero_id, instance.fecha_hora)
+    rollup.recalcular_tras_commit({actual, getattr(instance, '_dia_kpi_previo', None)})
+    instance._dia_kpi_previo = actual
+
+
+@receiver(citas_actualizadas_en_bloque, sender=Cita)
+def actualizar_resumen_en_bloque(sender, ids, **kwargs):
+    rollup.recalcular_tras_commit(
+        rollup.dia_kpi(barbero_id, fecha_hora)
+        for barbero_id, fecha_hora in Cita.objects.filter(id__in=ids).values_list('barbero_id', 'fecha_hora')
+    )
+
+
+def _invalidar_ocupacion_tras_commit(nosotros_id):
+    if nosotros_id is not None:
+        transaction.on_commit(lambda: ocupacion.invalidar_tenant(nosotros_id))
+
+
+@receiver(post_save, sender=HorarioDisponibilidad)
+@receiver(post_delete, sender=HorarioDisponibilidad)
+def invalidar_ocupacion_horario(sender, instance, **kwargs):
+    _invalidar_ocupacion_tras_commit(
+        Barbero.objects.filter(id=instance.barbero_id).values_list('nosotros_id', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=DiaExcepcional)
+@receiver(post_delete, sender=DiaExcepcional)
+def invalidar_ocupacion_excepcion(sender, instance, **kwargs):
+    _invalidar_ocupacion_tras_commit(
+        Sucursal.objects.filter(id=instance.sucursal_id).values_list('barberia__nosotros_id', flat=True).first()
+    )
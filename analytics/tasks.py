@@ -0,0 +1,21 @@
+from datetime import date
+
+from celery import shared_task
+
+from . import rollup
+
+
+@shared_task
+def reconciliar_resumen_diario(dias=7):
+    """Corrige cualquier deriva del resumen diario (cambios fuera de señales)"""
+    filas = rollup.reconciliar_recientes(dias)
+    return f"resumen_diario_filas={filas}"
+
+
+@shared_task
+def recalcular_resumen_diario(pares):
+    """Recalcula los días [(barbero_id, 'AAAA-MM-DD'), ...] programados tras cambios de citas"""
+    rollup.recalcular_pendientes(
+        (barbero_id, date.fromisoformat(fecha)) for barbero_id, fecha in pares
+    )
+    return f"resumen_diario_dias={len(pares)}"
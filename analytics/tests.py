@@ -1,3 +1,211 @@
-from django.test import TestCase
+from datetime import datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from analytics import ocupacion, rollup, tasks
+from analytics.models import ResumenDiarioCitas
+from core.models import (
+    Barberia, Barbero, DiaExcepcional, HorarioDisponibilidad, Nosotros, Servicio, Sucursal, User,
+)
+from scheduling.models import Cita
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AnalyticsBaseTestCase(TestCase):
+    """
+    Tenant con un barbero, un servicio de 30 minutos y un cliente. La tarea
+    de recálculo corre en línea en vez de ir al broker.
+    """
+
+    def setUp(self):
+        cache.clear()
+        parche = mock.patch.object(
+            tasks.recalcular_resumen_diario, 'apply_async',
+            side_effect=lambda args, countdown: tasks.recalcular_resumen_diario(*args),
+        )
+        self.encolar = parche.start()
+        self.addCleanup(parche.stop)
+        self.nosotros = Nosotros.objects.create(nombre='N')
+        barberia = Barberia.objects.create(nosotros=self.nosotros, nombre='B')
+        self.sucursal = Sucursal.objects.create(barberia=barberia, nombre='S')
+        self.servicio = Servicio.objects.create(barberia=barberia, nombre='Corte', precio=100, duracion_minutos=30)
+        user = User.objects.create_user(email='b@test.com', password='x', nombre='Barbero', rol=User.Roles.BARBERO)
+        self.barbero = Barbero.objects.create(nosotros=self.nosotros, user=user, nombre='Barbero', sucursal_principal=self.sucursal)
+        self.cliente = User.objects.create_user(email='c@test.com', password='x', nombre='C')
+        self.ayer = timezone.now() - timedelta(days=1)
+
+    def _cita(self, estado=Cita.Estado.CONFIRMADA, fecha_hora=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Cita.objects.create(
+                cliente=self.cliente, barbero=self.barbero, sucursal=self.sucursal, servicio=self.servicio,
+                fecha_hora=fecha_hora or self.ayer, precio=self.servicio.precio, estado=estado,
+            )
+
+
+class ResumenDiarioCitasTest(AnalyticsBaseTestCase):
+    """El resumen diario sigue a las citas y coincide con la reconciliación"""
+
+    def _filas(self):
+        return sorted(
+            ResumenDiarioCitas.objects.values_list('fecha', 'estado', 'cantidad', 'ingresos', 'minutos')
+        )
+
+    def test_cambios_de_cita_actualizan_el_resumen(self):
+        cita = self._cita()
+        self._cita(Cita.Estado.COMPLETADA)
+        dia = timezone.localtime(self.ayer).date()
+        self.assertEqual(self._filas(), [
+            (dia, Cita.Estado.COMPLETADA, 1, 100, 30),
+            (dia, Cita.Estado.CONFIRMADA, 1, 100, 30),
+        ])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.estado = Cita.Estado.COMPLETADA
+            cita.save()
+        self.assertEqual(self._filas(), [(dia, Cita.Estado.COMPLETADA, 2, 200, 60)])
+
+        # Reprogramar mueve la cita de día
+        nueva = self.ayer + timedelta(days=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.fecha_hora = nueva
+            cita.save()
+        self.assertEqual(self._filas(), [
+            (dia, Cita.Estado.COMPLETADA, 1, 100, 30),
+            (timezone.localtime(nueva).date(), Cita.Estado.COMPLETADA, 1, 100, 30),
+        ])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.delete()
+        self.assertEqual(self._filas(), [(dia, Cita.Estado.COMPLETADA, 1, 100, 30)])
+
+    def test_no_show_en_bloque_y_reconciliacion(self):
+        from scheduling.tasks import marcar_no_show_citas
+        for _ in range(3):
+            self._cita()
+        with self.captureOnCommitCallbacks(execute=True):
+            marcar_no_show_citas()
+        incremental = self._filas()
+        self.assertEqual([(estado, cantidad) for _, estado, cantidad, _, _ in incremental], [(Cita.Estado.NO_SHOW, 3)])
+
+        ResumenDiarioCitas.objects.all().delete()
+        rollup.reconciliar_recientes()
+        self.assertEqual(self._filas(), incremental)
+
+    def test_recalculo_agrupado_por_dia(self):
+        self.encolar.side_effect = None
+        cita = self._cita()
+        dia = timezone.localtime(self.ayer).date()
+        self.encolar.assert_called_once_with(args=[[(self.barbero.id, dia.isoformat())]], countdown=rollup.ESPERA_SEG)
+
+        # Con el recálculo del día pendiente, otro cambio no encola nada
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.estado = Cita.Estado.COMPLETADA
+            cita.save()
+        self.assertEqual(self.encolar.call_count, 1)
+
+        # La tarea quita la marca y ve el último estado
+        tasks.recalcular_resumen_diario([(self.barbero.id, dia.isoformat())])
+        self.assertEqual(self._filas(), [(dia, Cita.Estado.COMPLETADA, 1, 100, 30)])
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.delete()
+        self.assertEqual(self.encolar.call_count, 2)
+
+    def test_broker_caido_no_rompe_la_reserva(self):
+        self.encolar.side_effect = ConnectionError('broker caído')
+        with self.assertLogs('analytics.rollup', 'WARNING'):
+            self._cita()
+        self.assertEqual(self._filas(), [])
+        # Sin marca pendiente: el próximo cambio vuelve a intentarlo
+        self.encolar.side_effect = lambda args, countdown: tasks.recalcular_resumen_diario(*args)
+        self._cita()
+        self.assertEqual(len(self._filas()), 1)
+        rollup.reconciliar_recientes()
+        self.assertEqual([fila[2] for fila in self._filas()], [2])
+
+
+class OcupacionTest(AnalyticsBaseTestCase):
+    """Ocupación desde horarios, días excepcionales y duración de las citas"""
+
+    def setUp(self):
+        super().setUp()
+        hoy = timezone.localdate()
+        self.lunes = hoy - timedelta(days=hoy.weekday() + 7)
+        self.martes = self.lunes + timedelta(days=1)
+        for dia in (HorarioDisponibilidad.DiaSemana.LUNES, HorarioDisponibilidad.DiaSemana.MARTES):
+            HorarioDisponibilidad.objects.create(
+                barbero=self.barbero, dia_semana=dia, hora_inicio=time(9), hora_fin=time(13)
+            )
+        DiaExcepcional.objects.create(
+            sucursal=self.sucursal, fecha=self.martes, tipo=DiaExcepcional.TipoExcepcion.CERRADO
+        )
+
+    def _a_las(self, fecha, hora, minuto=0):
+        return timezone.make_aware(datetime.combine(fecha, time(hora, minuto)))
+
+    def test_minutos_disponibles_y_reservados(self):
+        self._cita(fecha_hora=self._a_las(self.lunes, 10, 30))
+        # Termina 15 minutos después del cierre: solo cuentan 15
+        self._cita(Cita.Estado.COMPLETADA, fecha_hora=self._a_las(self.lunes, 12, 45))
+        self._cita(Cita.Estado.CANCELADA_CLIENTE, fecha_hora=self._a_las(self.lunes, 9))
+        # El martes la sucursal cierra
+        self._cita(fecha_hora=self._a_las(self.martes, 10))
+
+        with self.assertNumQueries(4):
+            dias = ocupacion.ocupacion_dias(self.nosotros.id, self.lunes, self.martes)
+        self.assertEqual((dias[self.lunes]['disponibles'], dias[self.lunes]['reservados']), (240, 45))
+        self.assertEqual((dias[self.martes]['disponibles'], dias[self.martes]['reservados']), (0, 0))
+        self.assertEqual(ocupacion.ocupacion_total(dias), (240, 45, 18))
+
+        mapa = ocupacion.mapa_calor(dias)
+        self.assertEqual(mapa['horas'], [9, 10, 11, 12])
+        self.assertEqual(mapa['filas'][0], ('Lunes', [0, 50, 0, 25]))
+        self.assertEqual(mapa['filas'][1], ('Martes', [None, None, None, None]))
+
+        with self.assertNumQueries(0):
+            ocupacion.ocupacion_dias(self.nosotros.id, self.lunes, self.martes)
+
+    def test_citas_solapadas_y_cruce_de_medianoche(self):
+        domingo = self.lunes - timedelta(days=1)
+        HorarioDisponibilidad.objects.create(
+            barbero=self.barbero, dia_semana=HorarioDisponibilidad.DiaSemana.DOMINGO,
+            hora_inicio=time(23), hora_fin=time(23, 59)
+        )
+        HorarioDisponibilidad.objects.create(
+            barbero=self.barbero, dia_semana=HorarioDisponibilidad.DiaSemana.LUNES,
+            hora_inicio=time(0), hora_fin=time(1)
+        )
+        # Se pisan entre 10:15 y 10:30: cuentan 45 minutos, no 60
+        self._cita(fecha_hora=self._a_las(self.lunes, 10))
+        self._cita(fecha_hora=self._a_las(self.lunes, 10, 15))
+        # Una hora desde las 23:30 del domingo: 29 minutos ese día y 30 el lunes
+        self.servicio.duracion_minutos = 60
+        self.servicio.save()
+        self._cita(fecha_hora=self._a_las(domingo, 23, 30))
+
+        dias = ocupacion.calcular(self.nosotros.id, domingo, self.lunes)
+        self.assertEqual(dias[domingo]['reservados'], 29)
+        self.assertEqual(dias[self.lunes]['reservados'], 75)
+        self.assertEqual(dias[self.lunes]['horas'][0], [60, 30])
+        self.assertEqual(dias[self.lunes]['horas'][10], [60, 45])
+
+    def test_cambio_de_horario_o_excepcion_invalida_la_cache(self):
+        ocupacion.ocupacion_dias(self.nosotros.id, self.lunes, self.martes)
+        with self.captureOnCommitCallbacks(execute=True):
+            HorarioDisponibilidad.objects.filter(dia_semana=HorarioDisponibilidad.DiaSemana.LUNES).update(hora_fin=time(11))
+            HorarioDisponibilidad.objects.get(dia_semana=HorarioDisponibilidad.DiaSemana.LUNES).save()
+        dias = ocupacion.ocupacion_dias(self.nosotros.id, self.lunes, self.martes)
+        self.assertEqual(dias[self.lunes]['disponibles'], 120)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            DiaExcepcional.objects.get(fecha=self.martes).delete()
+        dias = ocupacion.ocupacion_dias(self.nosotros.id, self.lunes, self.martes)
+        self.assertEqual(dias[self.martes]['disponibles'], 240)
+
+    def test_nueva_cita_invalida_el_dia(self):
+        ocupacion.ocupacion_dias(self.nosotros.id, self.lunes, self.lunes)
+        self._cita(fecha_hora=self._a_las(self.lunes, 9))
+        dias = ocupacion.ocupacion_dias(self.nosotros.id, self.lunes, self.lunes)
+        self.assertEqual(dias[self.lunes]['reservados'], 30)
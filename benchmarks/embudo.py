@@ -0,0 +1,285 @@
+"""
+Benchmark del embudo de reserva (comando benchmark_reserva).
+
+Recorre con el cliente HTTP de pruebas de Django, middleware y
+plantillas incluidos, los cinco pasos de la reserva sobre un tenant ya
+sembrado (ver core/sinteticos.py):
+
+    seleccionar_barberia → seleccionar_sucursal → seleccionar_servicio
+    → seleccionar_barbero_fecha → confirmar_reserva
+
+Cada iteración usa otra sucursal, servicio y día, y reserva el primer
+horario libre. Por paso se mide la latencia (p50/p95/p99), las consultas
+SQL y, en una pasada aparte para no alterar los tiempos, las filas que
+recorre la base según el plan de cada SELECT:
+
+- PostgreSQL: filas leídas por los nodos Scan (EXPLAIN ANALYZE)
+- SQLite: no informa filas leídas; se suman las filas de las tablas que
+  el plan recorre completas (SCAN), que es lo que delata un índice que
+  falta
+
+El resultado es un dict serializable a JSON para comparar entre commits.
+"""
+import json
+import math
+import re
+import subprocess
+import time
+from collections import defaultdict
+from datetime import timedelta
+from statistics import mean, median_low
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core import sinteticos
+from core.models import Barbero, Nosotros, Servicio, Sucursal, User
+from scheduling import disponibilidad
+from scheduling.models import Cita
+
+PASOS = (
+    'seleccionar_barberia',
+    'seleccionar_sucursal',
+    'seleccionar_servicio',
+    'seleccionar_barbero_fecha',
+    'confirmar_reserva',
+)
+DIAS_ADELANTE = 7
+
+TABLA_Y_ALIAS = re.compile(r'(?:FROM|JOIN) "(\w+)"(?: (\w+))?')
+ESCANEO_SQLITE = re.compile(r'^SCAN (\w+)')
+
+
+class EmbudoFallido(Exception):
+    """Un paso no respondió como lo haría con un cliente real"""
+
+
+class Consultas:
+    """execute_wrapper que cuenta las consultas y, si se pide, guarda los SELECT"""
+
+    def __init__(self, guardar=False):
+        self.total = 0
+        self.guardar = guardar
+        self.selects = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.total += 1
+        if self.guardar and not many and sql.lstrip().upper().startswith('SELECT'):
+            self.selects.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def percentil(valores, p):
+    """Percentil por rango más cercano"""
+    ordenados = sorted(valores)
+    return ordenados[max(math.ceil(p / 100 * len(ordenados)) - 1, 0)]
+
+
+def tenant_sintetico():
+    """Último tenant generado por generar_datos_sinteticos, o None"""
+    return Nosotros.objects.filter(nombre__startswith=f'{sinteticos.NOMBRE_TENANT} ').order_by('-id').first()
+
+
+def cliente_para(nosotros):
+    """Un cliente sintético (o cualquiera) que reserva en el benchmark"""
+    clientes = User.objects.filter(rol=User.Roles.CLIENTE, is_active=True).order_by('id')
+    return clientes.filter(email__endswith=f'@{sinteticos.DOMINIO}').first() or clientes.first()
+
+
+def escenario(nosotros):
+    """(sucursal, servicio) del tenant que se van alternando, en orden estable"""
+    sucursales = Sucursal.objects.filter(
+        barberia__nosotros=nosotros,
+        barberia__activa=True,
+        activo=True,
+        id__in=Barbero.objects.filter(activo=True).values('sucursal_principal_id')
+    ).select_related('barberia').order_by('id')
+    servicios = defaultdict(list)
+    for servicio in Servicio.objects.filter(barberia__nosotros=nosotros, activo=True).order_by('id'):
+        servicios[servicio.barberia_id].append(servicio)
+    casos = []
+    for sucursal in sucursales:
+        for servicio in servicios[sucursal.barberia_id]:
+            casos.append((sucursal, servicio))
+    return casos
+
+
+def _filas_postgresql(selects):
+    filas, completas = 0, set()
+    with connection.cursor() as cursor:
+        for sql, params in selects:
+            cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            pendientes = [plan[0]['Plan']]
+            while pendientes:
+                nodo = pendientes.pop()
+                pendientes.extend(nodo.get('Plans', []))
+                if 'Relation Name' not in nodo:
+                    continue
+                leidas = nodo.get('Actual Rows', 0) + nodo.get('Rows Removed by Filter', 0)
+                filas += leidas * nodo.get('Actual Loops', 1)
+                if nodo['Node Type'] == 'Seq Scan':
+                    completas.add(nodo['Relation Name'])
+    return filas, completas
+
+
+def _filas_sqlite(selects, tamanos):
+    filas, completas = 0, set()
+    with connection.cursor() as cursor:
+        for sql, params in selects:
+            tablas = {}
+            for tabla, alias in TABLA_Y_ALIAS.findall(sql):
+                tablas[tabla] = tabla
+                if alias and alias not in ('ON', 'WHERE', 'LEFT', 'INNER', 'GROUP', 'ORDER', 'LIMIT'):
+                    tablas[alias] = tabla
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            for *_, detalle in cursor.fetchall():
+                escaneo = ESCANEO_SQLITE.match(detalle)
+                if not escaneo or escaneo.group(1) not in tablas:
+                    continue
+                tabla = tablas[escaneo.group(1)]
+                if tabla not in tamanos:
+                    cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(tabla)}')
+                    tamanos[tabla] = cursor.fetchone()[0]
+                filas += tamanos[tabla]
+                completas.add(tabla)
+    return filas, completas
+
+
+def filas_escaneadas(selects, tamanos):
+    """(filas recorridas, tablas leídas completas) de los SELECT, o (None, ∅) en otros motores"""
+    if connection.vendor == 'postgresql':
+        return _filas_postgresql(selects)
+    if connection.vendor == 'sqlite':
+        return _filas_sqlite(selects, tamanos)
+    return None, set()
+
+
+def _pedir(http, paso, metodo, url, esperado, consultas, datos=None):
+    inicio = time.perf_counter()
+    with connection.execute_wrapper(consultas):
+        respuesta = getattr(http, metodo)(url, datos or {})
+        respuesta.content
+    segundos = time.perf_counter() - inicio
+    if respuesta.status_code != esperado:
+        raise EmbudoFallido(f'{paso}: HTTP {respuesta.status_code} en {url}')
+    return respuesta, segundos
+
+
+def recorrer(http, usuario, sucursal, servicio, fecha, guardar=False):
+    """Un recorrido completo. Devuelve {paso: (segundos, Consultas)}"""
+    medicion = {}
+
+    def pedir(paso, url, metodo='get', esperado=200, datos=None):
+        consultas = Consultas(guardar)
+        respuesta, segundos = _pedir(http, paso, metodo, url, esperado, consultas, datos)
+        medicion[paso] = (segundos, consultas)
+        return respuesta
+
+    pedir('seleccionar_barberia', reverse('scheduling:seleccionar_barberia'))
+    pedir('seleccionar_sucursal', reverse('scheduling:seleccionar_sucursal', args=[sucursal.barberia_id]))
+    pedir('seleccionar_servicio', reverse('scheduling:seleccionar_servicio', args=[sucursal.id]))
+    pedir(
+        'seleccionar_barbero_fecha',
+        reverse('scheduling:seleccionar_barbero_fecha', args=[sucursal.id, servicio.id]) + f'?fecha={fecha.isoformat()}'
+    )
+
+    # El cliente elige un horario de la página; aquí, el primero libre
+    slots = disponibilidad.buscar_proximos_slots(servicio, sucursal, desde=fecha.isoformat(), limite=1, usuario=usuario)
+    if not slots:
+        raise EmbudoFallido(f'Sin horarios libres en {sucursal} desde {fecha}')
+    slot = slots[0]
+    respuesta = pedir(
+        'confirmar_reserva',
+        reverse('scheduling:confirmar_reserva', args=[sucursal.id, servicio.id, slot['barbero'].id]),
+        metodo='post',
+        esperado=302,
+        datos={'fecha_hora': timezone.localtime(slot['fecha_hora']).strftime('%Y-%m-%dT%H:%M:%S')},
+    )
+    if respuesta.url != reverse('scheduling:mis_citas'):
+        raise EmbudoFallido(f'confirmar_reserva: no se reservó {slot["fecha_hora"]} (redirige a {respuesta.url})')
+    return medicion
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ejecutar(nosotros, usuario, iteraciones=50, calentamiento=5, conservar=False):
+    """
+    Corre `calentamiento` recorridos sin medir, `iteraciones` medidos y
+    uno más para los planes de consulta. Salvo `conservar`, al final
+    borra las citas reservadas. Devuelve el resultado para el JSON.
+    """
+    casos = escenario(nosotros)
+    if not casos:
+        raise EmbudoFallido(f'{nosotros} no tiene sucursales con barberos y servicios activos')
+
+    inicio = timezone.now()
+    hoy = timezone.localdate()
+    tiempos = defaultdict(list)
+    consultas = defaultdict(list)
+    planes = {}
+    tamanos = {}
+
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        http = Client()
+        http.force_login(usuario)
+        total = calentamiento + iteraciones + 1
+        for i in range(total):
+            sucursal, servicio = casos[i % len(casos)]
+            fecha = hoy + timedelta(days=1 + i % DIAS_ADELANTE)
+            analisis = i == total - 1
+            medicion = recorrer(http, usuario, sucursal, servicio, fecha, guardar=analisis)
+            if analisis:
+                for paso, (_, registro) in medicion.items():
+                    planes[paso] = filas_escaneadas(registro.selects, tamanos)
+            elif i >= calentamiento:
+                for paso, (segundos, registro) in medicion.items():
+                    tiempos[paso].append(segundos * 1000)
+                    consultas[paso].append(registro.total)
+
+    reservadas = Cita.objects.filter(cliente=usuario, creada_en__gte=inicio)
+    reservas = reservadas.count()
+    if not conservar:
+        reservadas.delete()
+
+    pasos = {}
+    for paso in PASOS:
+        filas, completas = planes[paso]
+        pasos[paso] = {
+            'p50_ms': round(percentil(tiempos[paso], 50), 2),
+            'p95_ms': round(percentil(tiempos[paso], 95), 2),
+            'p99_ms': round(percentil(tiempos[paso], 99), 2),
+            'media_ms': round(mean(tiempos[paso]), 2),
+            'consultas': median_low(consultas[paso]),
+            'consultas_max': max(consultas[paso]),
+            'filas_escaneadas': filas,
+            'escaneos_completos': sorted(completas),
+        }
+
+    return {
+        'commit': _commit(),
+        'fecha': inicio.isoformat(),
+        'base_de_datos': connection.vendor,
+        'iteraciones': iteraciones,
+        'calentamiento': calentamiento,
+        'datos': {
+            'nosotros_id': nosotros.id,
+            'casos': len(casos),
+            'citas': Cita.objects.count(),
+            'reservas': reservas,
+        },
+        'pasos': pasos,
+    }
@@ -0,0 +1,86 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks import embudo
+from core import sinteticos
+from core.models import Nosotros
+
+
+class Command(BaseCommand):
+    help = 'Mide latencia, consultas y filas escaneadas de cada paso del embudo de reserva'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iteraciones', type=int, default=50, help='Recorridos medidos')
+        parser.add_argument('--calentamiento', type=int, default=5, help='Recorridos previos sin medir')
+        parser.add_argument(
+            '--nosotros',
+            type=int,
+            help='Id del tenant (por defecto, el último de generar_datos_sinteticos)',
+        )
+        parser.add_argument(
+            '--sembrar',
+            action='store_true',
+            help='Genera antes un tenant sintético (3 sucursales, 6 barberos, 6 meses)',
+        )
+        parser.add_argument('--semilla', type=int, default=1, help='Semilla de --sembrar')
+        parser.add_argument(
+            '--salida',
+            default='benchmark_reserva.json',
+            help='Archivo JSON con el resultado ("-" para la salida estándar)',
+        )
+        parser.add_argument(
+            '--conservar',
+            action='store_true',
+            help='Deja las citas reservadas por el benchmark (por defecto se borran)',
+        )
+
+    def handle(self, *args, **options):
+        if options['iteraciones'] < 1:
+            raise CommandError('--iteraciones debe ser al menos 1')
+
+        if options['sembrar']:
+            resultado = sinteticos.generar(
+                sucursales=3, barberos=6, clientes=500, citas_por_dia=10, meses=6, semilla=options['semilla']
+            )
+            self.stdout.write(f'Datos sintéticos: {resultado.citas} citas ({resultado.prefijo})')
+
+        if options['nosotros']:
+            nosotros = Nosotros.objects.filter(id=options['nosotros']).first()
+        else:
+            nosotros = embudo.tenant_sintetico()
+        if nosotros is None:
+            raise CommandError('No hay tenant que medir: usa --nosotros, --sembrar o generar_datos_sinteticos')
+        usuario = embudo.cliente_para(nosotros)
+        if usuario is None:
+            raise CommandError('No hay clientes que puedan reservar')
+
+        try:
+            resultado = embudo.ejecutar(
+                nosotros,
+                usuario,
+                iteraciones=options['iteraciones'],
+                calentamiento=options['calentamiento'],
+                conservar=options['conservar'],
+            )
+        except embudo.EmbudoFallido as e:
+            raise CommandError(str(e))
+
+        contenido = json.dumps(resultado, indent=2, ensure_ascii=False)
+        if options['salida'] == '-':
+            self.stdout.write(contenido)
+            return
+        with open(options['salida'], 'w', encoding='utf-8') as archivo:
+            archivo.write(contenido + '\n')
+
+        self.stdout.write(
+            f'{nosotros.nombre}: {resultado["datos"]["citas"]} citas, '
+            f'{resultado["iteraciones"]} recorridos ({resultado["base_de_datos"]})'
+        )
+        for paso, datos in resultado['pasos'].items():
+            self.stdout.write(
+                f'  • {paso}: p50 {datos["p50_ms"]} ms, p95 {datos["p95_ms"]} ms, p99 {datos["p99_ms"]} ms, '
+                f'{datos["consultas"]} consultas, {datos["filas_escaneadas"]} filas escaneadas'
+                + (f' (completas: {", ".join(datos["escaneos_completos"])})' if datos['escaneos_completos'] else '')
+            )
+        self.stdout.write(self.style.SUCCESS(f'Resultado en {options["salida"]}'))
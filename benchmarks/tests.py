@@ -0,0 +1,55 @@
+import json
+from io import StringIO
+from tempfile import NamedTemporaryFile
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core import sinteticos
+from scheduling.models import Cita
+from . import embudo
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BenchmarkReservaTest(TestCase):
+    """El embudo se recorre entero y el resultado trae las métricas de cada paso"""
+
+    @classmethod
+    def setUpTestData(cls):
+        sinteticos.generar(sucursales=2, barberos=2, clientes=10, citas_por_dia=4, meses=1, dias_futuros=10, prefijo='b')
+        cls.nosotros = embudo.tenant_sintetico()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_percentil_por_rango_mas_cercano(self):
+        valores = list(range(1, 101))
+        self.assertEqual(embudo.percentil(valores, 50), 50)
+        self.assertEqual(embudo.percentil(valores, 99), 99)
+        self.assertEqual(embudo.percentil([7], 95), 7)
+
+    def test_recorre_los_cinco_pasos_y_borra_las_reservas(self):
+        citas = Cita.objects.count()
+        resultado = embudo.ejecutar(self.nosotros, embudo.cliente_para(self.nosotros), iteraciones=3, calentamiento=1)
+
+        self.assertEqual(list(resultado['pasos']), list(embudo.PASOS))
+        self.assertEqual(resultado['datos']['reservas'], 5)
+        self.assertEqual(Cita.objects.count(), citas)
+        for datos in resultado['pasos'].values():
+            self.assertLessEqual(datos['p50_ms'], datos['p95_ms'])
+            self.assertLessEqual(datos['p95_ms'], datos['p99_ms'])
+            self.assertGreater(datos['consultas'], 0)
+            self.assertIsInstance(datos['filas_escaneadas'], int)
+        self.assertIn('core_barberia', resultado['pasos']['seleccionar_barberia']['escaneos_completos'])
+
+    def test_comando_escribe_json(self):
+        with NamedTemporaryFile(suffix='.json') as archivo:
+            call_command(
+                'benchmark_reserva', iteraciones=2, calentamiento=0, conservar=True, salida=archivo.name,
+                stdout=StringIO(),
+            )
+            with open(archivo.name, encoding='utf-8') as leido:
+                resultado = json.load(leido)
+        self.assertEqual(resultado['datos']['nosotros_id'], self.nosotros.id)
+        self.assertEqual(Cita.objects.filter(creada_en__gte=resultado['fecha']).count(), 3)
@@ -0,0 +1,223 @@
+"""
+Bandeja de salida de emails (EmailSaliente).
+
+Quien cambia el estado de una cita encola el email con `encolar` dentro
+de la misma transacción; si la transacción se revierte, el email tampoco
+existe. Tras el COMMIT se programa el drenado, que envía los pendientes
+por lotes reutilizando una sola conexión SMTP, reintenta los fallidos con
+espera exponencial y registra los envíos en NotificacionEmail en bloque.
+
+Cada lote se reclama en una transacción corta (ENVIANDO, con
+proximo_intento como vencimiento del reclamo), se envía sin transacción
+abierta y el resultado se guarda en otra transacción corta. Si el worker
+muere a mitad de camino, al vencer PLAZO_ENVIO_SEG el lote vuelve a
+estar disponible para el drenado.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailSaliente, NotificacionEmail
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 100
+MAX_INTENTOS = 5
+ESPERA_BASE_SEG = 60
+
+# Tiempo que un lote reclamado queda reservado para quien lo envía
+PLAZO_ENVIO_SEG = 10 * 60
+
+
+def nuevo_email(destinatario, tipo, asunto, cuerpo, cita=None, cuerpo_html='', remitente=''):
+    """EmailSaliente sin guardar, listo para pasar a `encolar`"""
+    return EmailSaliente(
+        destinatario=destinatario,
+        para=destinatario.email,
+        cita=cita,
+        tipo=tipo,
+        asunto=asunto[:200],
+        cuerpo=cuerpo,
+        cuerpo_html=cuerpo_html,
+        remitente=remitente or '',
+    )
+
+
+def encolar(emails, programar=True, reclamados=False):
+    """
+    Guarda los emails en un solo INSERT y programa el drenado tras el
+    COMMIT. Con programar=False el llamador se encarga de drenar.
+
+    Con reclamados=True las filas nacen ENVIANDO, reservadas por
+    PLAZO_ENVIO_SEG para el llamador, que las envía con `enviar` y guarda
+    el resultado con `registrar`; el drenado no las toca mientras tanto.
+    """
+    emails = [e for e in emails if e.para]
+    if not emails:
+        return []
+    if reclamados:
+        vence = timezone.now() + timedelta(seconds=PLAZO_ENVIO_SEG)
+        for email in emails:
+            email.estado = EmailSaliente.Estado.ENVIANDO
+            email.proximo_intento = vence
+    creados = EmailSaliente.objects.bulk_create(emails)
+    if programar:
+        transaction.on_commit(_programar_drenado)
+    return creados
+
+
+def encolar_email(destinatario, tipo, asunto, cuerpo, **kwargs):
+    return encolar([nuevo_email(destinatario, tipo, asunto, cuerpo, **kwargs)])
+
+
+def _programar_drenado():
+    from scheduling.tasks import enviar_emails_pendientes
+    try:
+        enviar_emails_pendientes.delay()
+    except Exception:
+        # El drenado periódico los recogerá igualmente
+        logger.warning("No se pudo programar el envío de emails pendientes", exc_info=True)
+
+
+def _mensaje(email, conexion):
+    mensaje = EmailMultiAlternatives(
+        subject=email.asunto,
+        body=email.cuerpo,
+        from_email=email.remitente or settings.DEFAULT_FROM_EMAIL,
+        to=[email.para],
+        connection=conexion,
+    )
+    if email.cuerpo_html:
+        mensaje.attach_alternative(email.cuerpo_html, 'text/html')
+    return mensaje
+
+
+def _registro(email, exitoso, error=''):
+    return NotificacionEmail(
+        destinatario_id=email.destinatario_id,
+        cita_id=email.cita_id,
+        tipo=email.tipo,
+        asunto=email.asunto,
+        exitoso=exitoso,
+        error=error,
+    )
+
+
+def enviar(emails):
+    """
+    Envía los emails por una única conexión SMTP, sin tocar la base de
+    datos (se puede llamar desde un hilo). Devuelve (enviados, fallidos)
+    con fallidos como lista de (email, error).
+    """
+    enviados, fallidos = [], []
+    conexion = get_connection(fail_silently=False)
+    try:
+        conexion.open()
+        for email in emails:
+            try:
+                conexion.send_messages([_mensaje(email, conexion)])
+                enviados.append(email)
+            except Exception as e:
+                fallidos.append((email, str(e)))
+    except Exception as e:
+        # Sin conexión: lo no enviado queda para el siguiente intento
+        fallidos = [(email, str(e)) for email in emails if email not in enviados]
+    finally:
+        try:
+            conexion.close()
+        except Exception:
+            pass
+    return enviados, fallidos
+
+
+def registrar(enviados, fallidos):
+    """
+    Guarda el resultado de `enviar` en una transacción corta: estado y
+    reintento de cada EmailSaliente (un bulk_update) y el registro
+    NotificacionEmail de lo enviado o definitivamente fallido (un
+    bulk_create).
+    """
+    ahora = timezone.now()
+    for email in enviados:
+        email.estado = EmailSaliente.Estado.ENVIADO
+        email.enviado_en = ahora
+        email.intentos += 1
+        email.ultimo_error = ''
+    registros = [_registro(email, True) for email in enviados]
+    for email, error in fallidos:
+        email.intentos += 1
+        email.ultimo_error = error
+        if email.intentos >= MAX_INTENTOS:
+            email.estado = EmailSaliente.Estado.FALLIDO
+            registros.append(_registro(email, False, error))
+        else:
+            espera = ESPERA_BASE_SEG * 2 ** (email.intentos - 1)
+            email.estado = EmailSaliente.Estado.PENDIENTE
+            email.proximo_intento = ahora + timedelta(seconds=espera)
+
+    with transaction.atomic():
+        EmailSaliente.objects.bulk_update(
+            enviados + [email for email, _ in fallidos],
+            ['estado', 'enviado_en', 'intentos', 'ultimo_error', 'proximo_intento'],
+        )
+        NotificacionEmail.objects.bulk_create(registros)
+
+
+def reclamar(tamano=TAMANO_LOTE):
+    """
+    Reclama hasta `tamano` emails listos para enviar: pendientes o con
+    un reclamo vencido. Las filas se toman con SKIP LOCKED y se marcan
+    ENVIANDO hasta PLAZO_ENVIO_SEG en una transacción corta, así dos
+    workers no envían el mismo email y nadie tiene locks durante el SMTP.
+    """
+    ahora = timezone.now()
+    vence = ahora + timedelta(seconds=PLAZO_ENVIO_SEG)
+    with transaction.atomic():
+        emails = list(
+            EmailSaliente.objects.select_for_update(skip_locked=True).filter(
+                estado__in=[EmailSaliente.Estado.PENDIENTE, EmailSaliente.Estado.ENVIANDO],
+                proximo_intento__lte=ahora,
+            ).order_by('id')[:tamano]
+        )
+        if emails:
+            EmailSaliente.objects.filter(id__in=[e.id for e in emails]).update(
+                estado=EmailSaliente.Estado.ENVIANDO,
+                proximo_intento=vence,
+            )
+    for email in emails:
+        email.estado = EmailSaliente.Estado.ENVIANDO
+        email.proximo_intento = vence
+    return emails
+
+
+def enviar_lote(tamano=TAMANO_LOTE):
+    """
+    Envía un lote de emails pendientes por una única conexión:
+    reclamar (commit), enviar sin transacción y registrar (commit).
+    Devuelve (enviados, fallidos).
+    """
+    emails = reclamar(tamano)
+    if not emails:
+        return 0, 0
+    enviados, fallidos = enviar(emails)
+    registrar(enviados, fallidos)
+
+    if fallidos:
+        logger.warning("Emails con error en el lote: %s de %s", len(fallidos), len(emails))
+    return len(enviados), len(fallidos)
+
+
+def drenar(max_lotes=50, tamano=TAMANO_LOTE):
+    """Envía lotes hasta vaciar la bandeja o agotar `max_lotes`"""
+    total_enviados = total_fallidos = 0
+    for _ in range(max_lotes):
+        enviados, fallidos = enviar_lote(tamano)
+        total_enviados += enviados
+        total_fallidos += fallidos
+        if enviados + fallidos < tamano:
+            break
+    return total_enviados, total_fallidos
@@ -0,0 +1,71 @@
+"""
+HU42: Resumen de puntos de fidelidad por cliente.
+
+El resumen se arma con tres consultas sin importar cuántas barberías
+tenga el cliente (saldos, barberías por id__in y programas activos por
+id__in) y queda en caché por usuario. La entrada se borra tras el COMMIT
+de cada nuevo HistorialPuntos, y las de todos los clientes con saldo en
+la barbería cuando su ProgramaFidelidad se guarda o se borra (ver
+core/signals.py).
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Barberia, ProgramaFidelidad, SaldoPuntos
+
+RESUMEN_TTL_SEG = 10 * 60
+
+
+def _clave(usuario_id):
+    return f"fidelidad:resumen:{usuario_id}"
+
+
+def resumen_puntos(usuario):
+    """
+    Barberías donde el usuario tiene puntos, de mayor a menor saldo.
+
+    Cada elemento es {'barberia', 'puntos', 'valor', 'programa_activo'};
+    sin programa activo el valor monetario es 0.
+    """
+    clave = _clave(usuario.id)
+    resumen = cache.get(clave)
+    if resumen is not None:
+        return resumen
+
+    saldos = dict(
+        SaldoPuntos.objects.filter(cliente=usuario, puntos__gt=0).values_list('barberia_id', 'puntos')
+    )
+    barberias = Barberia.objects.in_bulk(list(saldos))
+    pesos = dict(
+        ProgramaFidelidad.objects.filter(
+            barberia_id__in=list(saldos),
+            activo=True
+        ).values_list('barberia_id', 'pesos_por_punto')
+    )
+    resumen = sorted(
+        (
+            {
+                'barberia': barberias[barberia_id],
+                'puntos': puntos,
+                'valor': float(puntos) * float(pesos.get(barberia_id, 0)),
+                'programa_activo': barberia_id in pesos,
+            }
+            for barberia_id, puntos in saldos.items()
+            if barberia_id in barberias
+        ),
+        key=lambda item: -item['puntos']
+    )
+    cache.set(clave, resumen, RESUMEN_TTL_SEG)
+    return resumen
+
+
+def invalidar_resumen(usuario_id):
+    transaction.on_commit(lambda: cache.delete(_clave(usuario_id)))
+
+
+def invalidar_resumen_barberia(barberia_id):
+    """Tras cambiar el programa de una barbería, borra el resumen de quienes tienen saldo en ella"""
+    def borrar():
+        clientes = SaldoPuntos.objects.filter(barberia_id=barberia_id).values_list('cliente_id', flat=True)
+        cache.delete_many([_clave(cliente_id) for cliente_id in clientes])
+    transaction.on_commit(borrar)
@@ -1,12 +1,18 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import islice
+
 from django.core.management.base import BaseCommand
-from django.core.mail import send_mail
+from django.db.models import Exists, OuterRef
 from django.template.loader import render_to_string
-from django.utils.html import strip_tags
 from django.conf import settings
 from scheduling.models import Cita
-from core.models import NotificacionEmail
+from core import correos
+from core.models import EmailSaliente, NotificacionEmail
 from django.utils import timezone
 
+
 class Command(BaseCommand):
     help = 'HU1: Envía recordatorios de citas por email (ejecutar diariamente)'
 
@@ -16,89 +22,141 @@ class Command(BaseCommand):
             action='store_true',
             help='Simula el envío sin enviar emails realmente',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Citas por lote (lectura, INSERT en la bandeja y conexión SMTP)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Conexiones SMTP en paralelo, una por lote',
+        )
 
-    def handle(self, *args, **options):
-        dry_run = options['dry_run']
-        
-        # Buscar citas que necesitan recordatorio
-        citas = Cita.objects.filter(
-            estado__in=[Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA]
-        ).select_related('cliente', 'barbero', 'servicio', 'sucursal')
-        
-        enviados = 0
-        errores = 0
-        
-        for cita in citas:
-            if not cita.debe_enviar_recordatorio():
-                continue
-            
-            try:
-                # Preparar contexto del email
-                context = cita.obtener_datos_email_recordatorio()
-                
-                # Renderizar templates
-                html_message = render_to_string(
-                    'emails/recordatorio_cita.html',
-                    context
-                )
-                plain_message = render_to_string(
-                    'emails/recordatorio_cita.txt',
-                    context
-                )
-                
-                if not dry_run:
-                    # Enviar email
-                    send_mail(
-                        subject=f'Recordatorio: Tu cita en BarberFlow mañana a las {context["hora"]}',
-                        message=plain_message,
-                        from_email=settings.DEFAULT_FROM_EMAIL,
-                        recipient_list=[cita.cliente.email],
-                        html_message=html_message,
-                        fail_silently=False,
-                    )
-                    
-                    # Registrar envío exitoso
-                    NotificacionEmail.objects.create(
-                        destinatario=cita.cliente,
-                        cita=cita,
-                        tipo=NotificacionEmail.TipoNotificacion.RECORDATORIO_CITA,
-                        asunto=f'Recordatorio: Tu cita mañana',
-                        exitoso=True
-                    )
-                
-                enviados += 1
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f'✓ Recordatorio enviado: {cita.cliente.email} (Cita #{cita.id})'
-                    )
+    def citas_pendientes(self, ahora):
+        """
+        Citas entre 23 y 25 horas más adelante sin recordatorio exitoso ni
+        encolado. El descarte se hace en SQL (NOT EXISTS) y no por fila.
+        """
+        recordatorio = NotificacionEmail.TipoNotificacion.RECORDATORIO_CITA
+        enviado = NotificacionEmail.objects.filter(
+            cita=OuterRef('pk'),
+            tipo=recordatorio,
+            exitoso=True,
+        )
+        encolado = EmailSaliente.objects.filter(
+            cita=OuterRef('pk'),
+            tipo=recordatorio,
+            estado__in=[EmailSaliente.Estado.PENDIENTE, EmailSaliente.Estado.ENVIANDO],
+        )
+        return Cita.objects.filter(
+            estado__in=[Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA],
+            fecha_hora__gte=ahora + timedelta(hours=23),
+            fecha_hora__lte=ahora + timedelta(hours=25),
+        ).exclude(
+            Exists(enviado)
+        ).exclude(
+            Exists(encolado)
+        ).select_related('cliente', 'barbero', 'servicio', 'sucursal').order_by('fecha_hora', 'id')
+
+    def preparar(self, cita):
+        context = cita.obtener_datos_email_recordatorio()
+        return correos.nuevo_email(
+            cita.cliente,
+            NotificacionEmail.TipoNotificacion.RECORDATORIO_CITA,
+            f'Recordatorio: Tu cita en BarberFlow mañana a las {context["hora"]}',
+            render_to_string('emails/recordatorio_cita.txt', context),
+            cita=cita,
+            cuerpo_html=render_to_string('emails/recordatorio_cita.html', context),
+            remitente=settings.DEFAULT_FROM_EMAIL,
+        )
+
+    def registrar(self, futuro, tiempos):
+        """Guarda el resultado de un lote enviado en un hilo"""
+        inicio = time.monotonic()
+        enviados, fallidos = futuro.result()
+        tiempos['envio'] += time.monotonic() - inicio
+        inicio = time.monotonic()
+        correos.registrar(enviados, fallidos)
+        tiempos['registro'] += time.monotonic() - inicio
+        for email in enviados:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'✓ Recordatorio enviado: {email.para} (Cita #{email.cita_id})'
                 )
-                
-            except Exception as e:
-                errores += 1
-                
-                if not dry_run:
-                    # Registrar error
-                    NotificacionEmail.objects.create(
-                        destinatario=cita.cliente,
-                        cita=cita,
-                        tipo=NotificacionEmail.TipoNotificacion.RECORDATORIO_CITA,
-                        asunto=f'Recordatorio: Tu cita mañana',
-                        exitoso=False,
-                        error=str(e)
-                    )
-                
-                self.stdout.write(
-                    self.style.ERROR(
-                        f'✗ Error enviando a {cita.cliente.email}: {str(e)}'
-                    )
+            )
+        for email, error in fallidos:
+            self.stdout.write(
+                self.style.ERROR(
+                    f'✗ Error enviando a {email.para}: {error}'
                 )
-        
+            )
+        return len(enviados), len(fallidos)
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = max(options['batch_size'], 1)
+        concurrency = max(options['concurrency'], 1)
+
+        inicio_total = time.monotonic()
+        tiempos = {'consulta': 0.0, 'render': 0.0, 'envio': 0.0, 'registro': 0.0}
+        citas = self.citas_pendientes(timezone.now()).iterator(chunk_size=batch_size)
+
+        procesadas = enviados = errores = lotes = 0
+        en_vuelo = []
+        with ThreadPoolExecutor(max_workers=concurrency) as hilos:
+            while True:
+                inicio = time.monotonic()
+                lote = list(islice(citas, batch_size))
+                tiempos['consulta'] += time.monotonic() - inicio
+                if not lote:
+                    break
+                lotes += 1
+                procesadas += len(lote)
+
+                inicio = time.monotonic()
+                emails = [self.preparar(cita) for cita in lote]
+                tiempos['render'] += time.monotonic() - inicio
+                if dry_run:
+                    for email in emails:
+                        self.stdout.write(f'· {email.para} (Cita #{email.cita_id})')
+                    continue
+
+                # Las filas nacen ENVIANDO (reclamadas por este comando) para
+                # que el drenado periódico no envíe las mismas en paralelo; si
+                # el comando muere, las retoma al vencer el reclamo
+                inicio = time.monotonic()
+                emails = correos.encolar(emails, programar=False, reclamados=True)
+                tiempos['registro'] += time.monotonic() - inicio
+                en_vuelo.append(hilos.submit(correos.enviar, emails))
+
+                # Como mucho `concurrency` lotes enviándose a la vez
+                while len(en_vuelo) >= concurrency:
+                    ok, error = self.registrar(en_vuelo.pop(0), tiempos)
+                    enviados += ok
+                    errores += error
+
+            for futuro in en_vuelo:
+                ok, error = self.registrar(futuro, tiempos)
+                enviados += ok
+                errores += error
+
+        total = time.monotonic() - inicio_total
+        por_segundo = procesadas / total if total else 0
+
         # Resumen
         modo = "[DRY RUN] " if dry_run else ""
         self.stdout.write(
             self.style.SUCCESS(
                 f'\n{modo}Resumen:\n'
+                f'  • Citas en ventana: {procesadas} ({lotes} lotes de hasta {batch_size})\n'
                 f'  • Emails enviados: {enviados}\n'
-                f'  • Errores: {errores}'
+                f'  • Errores: {errores}\n'
+                f'  • Tiempo: {total:.2f}s '
+                f'(consulta {tiempos["consulta"]:.2f}s, render {tiempos["render"]:.2f}s, '
+                f'envío {tiempos["envio"]:.2f}s, registro {tiempos["registro"]:.2f}s)\n'
+                f'  • Throughput: {por_segundo:.1f} citas/s con {concurrency} conexiones'
             )
-        )
\ No newline at end of file
+        )
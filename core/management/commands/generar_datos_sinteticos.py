@@ -0,0 +1,77 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import sinteticos
+
+
+class Command(BaseCommand):
+    help = 'Genera tenants sintéticos con citas en volumen (bulk_create por lotes, determinista por semilla)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenants', type=int, default=1, help='Tenants (Nosotros) a generar')
+        parser.add_argument('--sucursales', type=int, default=2, help='Sucursales por tenant')
+        parser.add_argument('--barberos', type=int, default=4, help='Barberos por tenant')
+        parser.add_argument('--clientes', type=int, default=200, help='Clientes compartidos por todos los tenants')
+        parser.add_argument(
+            '--citas-por-dia',
+            type=int,
+            default=8,
+            help='Citas por barbero y día laborable (se recorta a lo que cabe en el horario)',
+        )
+        parser.add_argument('--meses', type=int, default=3, help='Meses de historia hacia atrás (de 30 días)')
+        parser.add_argument('--dias-futuros', type=int, default=14, help='Días de agenda hacia adelante')
+        parser.add_argument('--semilla', type=int, default=1, help='Semilla del generador aleatorio')
+        parser.add_argument(
+            '--prefijo',
+            help='Prefijo de los correos y nombres de esta ejecución (por defecto, fecha y hora)',
+        )
+        parser.add_argument(
+            '--password',
+            help='Contraseña de todos los usuarios generados (por defecto no pueden iniciar sesión)',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000, help='Filas por INSERT')
+
+    def handle(self, *args, **options):
+        for opcion in ('tenants', 'barberos', 'sucursales', 'clientes', 'batch_size'):
+            if options[opcion] < 1:
+                raise CommandError(f'--{opcion.replace("_", "-")} debe ser al menos 1')
+
+        inicio = time.monotonic()
+
+        def avance(nosotros, citas):
+            self.stdout.write(f'  • {nosotros.nombre}: {citas} citas ({time.monotonic() - inicio:.1f}s)')
+
+        resultado = sinteticos.generar(
+            tenants=options['tenants'],
+            sucursales=options['sucursales'],
+            barberos=options['barberos'],
+            clientes=options['clientes'],
+            citas_por_dia=options['citas_por_dia'],
+            meses=options['meses'],
+            dias_futuros=options['dias_futuros'],
+            semilla=options['semilla'],
+            prefijo=options['prefijo'],
+            password=options['password'],
+            batch_size=options['batch_size'],
+            avance=avance,
+        )
+        segundos = time.monotonic() - inicio
+        por_segundo = resultado.citas / segundos if segundos else 0
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\nResumen ({resultado.prefijo}):\n'
+                f'  • Tenants: {len(resultado.nosotros_ids)}\n'
+                f'  • Usuarios: {resultado.usuarios}\n'
+                f'  • Citas: {resultado.citas} ({por_segundo:.0f} citas/s)\n'
+                f'  • Valoraciones: {resultado.valoraciones}\n'
+                f'  • Tiempo: {segundos:.1f}s'
+            )
+        )
+        if options['password']:
+            self.stdout.write(
+                f'Ejemplos de acceso: {sinteticos.correo(resultado.prefijo, "admin0")}, '
+                f'{sinteticos.correo(resultado.prefijo, "barbero0-0")}, '
+                f'{sinteticos.correo(resultado.prefijo, "cliente0")}'
+            )
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.correos import encolar_email
+from core.models import NotificacionEmail
+from scheduling import reservas
+from scheduling.models import Cita
+
+MOTIVO = 'Se solapaba con la cita #{} del mismo barbero'
+
+
+class Command(BaseCommand):
+    help = (
+        'Lista las citas pendientes/confirmadas que se solapan con otra anterior del mismo barbero; '
+        'con --aplicar las cancela y avisa al cliente (requisito de la restricción cita_sin_solapamiento)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--aplicar',
+            action='store_true',
+            help='Cancela la cita más nueva de cada solapamiento y encola el aviso al cliente',
+        )
+
+    def handle(self, *args, **options):
+        solapadas = reservas.citas_solapadas()
+        if not solapadas:
+            self.stdout.write(self.style.SUCCESS('No hay citas solapadas'))
+            return
+
+        conservada_de = dict(solapadas)
+        citas = Cita.objects.filter(id__in=conservada_de).select_related('cliente', 'barbero').order_by('id')
+        for cita in citas:
+            self.stdout.write(
+                f'  • Cita #{cita.id} ({cita.barbero.nombre}, {timezone.localtime(cita.fecha_hora):%d/%m/%Y %H:%M}) '
+                f'se solapa con #{conservada_de[cita.id]}'
+            )
+        if not options['aplicar']:
+            self.stdout.write(f'{len(solapadas)} citas solapadas; usa --aplicar para cancelarlas y avisar a los clientes')
+            return
+
+        ahora = timezone.now()
+        with transaction.atomic():
+            for cita in citas:
+                cita.estado = Cita.Estado.CANCELADA_ADMIN
+                cita.cancelado_en = ahora
+                cita.motivo_cancelacion = MOTIVO.format(conservada_de[cita.id])
+                cita.save(update_fields=['estado', 'cancelado_en', 'motivo_cancelacion'])
+                encolar_email(
+                    cita.cliente,
+                    NotificacionEmail.TipoNotificacion.CANCELACION_CITA,
+                    'Tu cita ha sido cancelada',
+                    f'Hola {cita.cliente.nombre},\n\n'
+                    f'Tu cita del {timezone.localtime(cita.fecha_hora):%d/%m/%Y %H:%M} con {cita.barbero.nombre} '
+                    f'se cruzaba con otra reserva del mismo horario y tuvimos que cancelarla. '
+                    f'Puedes reservar un nuevo horario cuando quieras.\n\n'
+                    f'— BarberFlow',
+                    cita=cita,
+                )
+        self.stdout.write(self.style.SUCCESS(f'{len(solapadas)} citas canceladas y clientes avisados'))
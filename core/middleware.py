@@ -5,40 +5,11 @@ from django.utils.deprecation import MiddlewareMixin
 from django.urls import resolve
 
 from django.contrib.auth import get_user_model
-from core.models import Nosotros, Barbero, Licencia
+from core.tenancy import resolver_tenant
 
 User = get_user_model()
 
 
-def get_nosotros_for_user(user):
-    """
-    Resuelve la 'barbería/Nosotros' asociada al usuario.
-
-    - BARBERO: usa barbero.nosotros (ya existe en el modelo Barbero)
-    - ADMIN_BARBERIA: intenta inferirla por el nombre (bootstrap crea
-      'Admin {nos.nombre}') y, si no, toma la primera.
-    - Otros roles: None
-    """
-    if not user.is_authenticated:
-        return None
-
-    # Caso barbero (ya estaba bien modelado)
-    if user.rol == User.Roles.BARBERO and hasattr(user, "barbero"):
-        return user.barbero.nosotros
-
-    # Caso admin de barbería
-    if user.rol == User.Roles.ADMIN_BARBERIA:
-        qs = Nosotros.objects.all()
-        # Heurística: en bootstrap el admin se crea como "Admin {nos.nombre}"
-        for nos in qs:
-            if nos.nombre in user.nombre:
-                return nos
-        # Si no matchea por nombre, al menos devolvemos el primero
-        return qs.first()
-
-    return None
-
-
 class PlanRequiredMiddleware(MiddlewareMixin):
     """
     HU30: Middleware que bloquea el acceso a paneles y gestión
@@ -52,6 +23,7 @@ class PlanRequiredMiddleware(MiddlewareMixin):
       * /static/, /media/
       * /bootstrap (para inicializar datos)
     - Solo protege URLs de panel/gestión (prefijos definidos).
+    - Deja el tenant resuelto en request.tenant (ContextoTenant o None).
     """
 
     PROTECTED_PREFIXES = (
@@ -70,6 +42,7 @@ class PlanRequiredMiddleware(MiddlewareMixin):
     )
 
     def process_request(self, request):
+        request.tenant = None
         path = request.path
 
         # 1) Rutas excluidas
@@ -86,13 +59,15 @@ class PlanRequiredMiddleware(MiddlewareMixin):
         if user.rol not in (User.Roles.ADMIN_BARBERIA, User.Roles.BARBERO):
             return None
 
-        # 3) Solo aplica a rutas 'de trabajo'
+        # 3) Resolver tenant (Nosotros) una vez por request, desde caché
+        tenant = resolver_tenant(user)
+        request.tenant = tenant
+
+        # 4) Solo aplica a rutas 'de trabajo'
         if not any(path.startswith(pref) for pref in self.PROTECTED_PREFIXES):
             return None
 
-        # 4) Resolver tenant (Nosotros)
-        nosotros = get_nosotros_for_user(user)
-        if not nosotros:
+        if not tenant:
             # Si no hay barbería asociada, dejamos pasar pero mostramos aviso suave
             messages.warning(
                 request,
@@ -102,8 +77,7 @@ class PlanRequiredMiddleware(MiddlewareMixin):
             return None
 
         # 5) Verificar licencia
-        licencia = getattr(nosotros, "licencia", None)
-        if not licencia:
+        if tenant.licencia_id is None:
             messages.error(
                 request,
                 "Tu barbería no tiene una licencia activa asignada. "
@@ -115,7 +89,7 @@ class PlanRequiredMiddleware(MiddlewareMixin):
             except Exception:
                 return redirect("home")
 
-        if not licencia.esta_activa():
+        if not tenant.licencia_vigente():
             messages.error(
                 request,
                 "La licencia de tu barbería está vencida o inactiva. "
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.14 on 2026-10-18 16:59
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_alter_user_barberia'),
+        ('scheduling', '0011_cita_fecha_hora_fin'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notificacionemail',
+            name='tipo',
+            field=models.CharField(choices=[('recordatorio_cita', 'Recordatorio de Cita'), ('confirmacion_cita', 'Confirmación de Cita'), ('cancelacion_cita', 'Cancelación de Cita'), ('cita_completada', 'Cita Completada'), ('reprogramacion_cita', 'Reprogramación de Cita'), ('lista_espera', 'Lista de Espera'), ('promocion', 'Promoción')], default='recordatorio_cita', max_length=30),
+        ),
+        migrations.CreateModel(
+            name='EmailSaliente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('para', models.EmailField(max_length=254)),
+                ('tipo', models.CharField(choices=[('recordatorio_cita', 'Recordatorio de Cita'), ('confirmacion_cita', 'Confirmación de Cita'), ('cancelacion_cita', 'Cancelación de Cita'), ('cita_completada', 'Cita Completada'), ('reprogramacion_cita', 'Reprogramación de Cita'), ('lista_espera', 'Lista de Espera'), ('promocion', 'Promoción')], max_length=30)),
+                ('asunto', models.CharField(max_length=200)),
+                ('cuerpo', models.TextField()),
+                ('cuerpo_html', models.TextField(blank=True)),
+                ('remitente', models.CharField(blank=True, help_text='Vacío = DEFAULT_FROM_EMAIL', max_length=254)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('ENVIANDO', 'Enviando'), ('ENVIADO', 'Enviado'), ('FALLIDO', 'Fallido')], default='PENDIENTE', max_length=10)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('proximo_intento', models.DateTimeField(default=django.utils.timezone.now, help_text='Próximo envío o, si está ENVIANDO, vencimiento del reclamo')),
+                ('ultimo_error', models.TextField(blank=True)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('enviado_en', models.DateTimeField(blank=True, null=True)),
+                ('cita', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='emails_salientes', to='scheduling.cita')),
+                ('destinatario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='emails_salientes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Email Saliente',
+                'verbose_name_plural': 'Emails Salientes',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['estado', 'proximo_intento'], name='core_emails_estado_e1a709_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def migrar_puntos_json(apps, schema_editor):
+    """
+    Copia User.puntos_fidelidad a SaldoPuntos. Si el historial no
+    explica el saldo del JSON se registra un AJUSTE por la diferencia,
+    así HistorialPuntos sigue sumando exactamente el saldo.
+    """
+    User = apps.get_model('core', 'User')
+    Barberia = apps.get_model('core', 'Barberia')
+    SaldoPuntos = apps.get_model('core', 'SaldoPuntos')
+    HistorialPuntos = apps.get_model('core', 'HistorialPuntos')
+
+    barberias = set(Barberia.objects.values_list('id', flat=True))
+    historial = {
+        (fila['cliente_id'], fila['barberia_id']): fila['total']
+        for fila in HistorialPuntos.objects.values('cliente_id', 'barberia_id').annotate(total=Sum('puntos'))
+    }
+    saldos, ajustes = [], []
+    usuarios = User.objects.exclude(puntos_fidelidad={}).values_list('id', 'puntos_fidelidad')
+    for usuario_id, puntos_json in usuarios.iterator():
+        if not isinstance(puntos_json, dict):
+            continue
+        for barberia_id, puntos in puntos_json.items():
+            barberia_id, puntos = int(barberia_id), max(int(puntos or 0), 0)
+            if barberia_id not in barberias:
+                continue
+            saldos.append(SaldoPuntos(cliente_id=usuario_id, barberia_id=barberia_id, puntos=puntos))
+            diferencia = puntos - (historial.get((usuario_id, barberia_id)) or 0)
+            if diferencia:
+                ajustes.append(HistorialPuntos(
+                    cliente_id=usuario_id,
+                    barberia_id=barberia_id,
+                    tipo='ajuste',
+                    puntos=diferencia,
+                    descripcion='Saldo migrado desde puntos_fidelidad',
+                ))
+    SaldoPuntos.objects.bulk_create(saldos, batch_size=1000)
+    HistorialPuntos.objects.bulk_create(ajustes, batch_size=1000)
+
+
+def restaurar_puntos_json(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    SaldoPuntos = apps.get_model('core', 'SaldoPuntos')
+    por_usuario = {}
+    for cliente_id, barberia_id, puntos in SaldoPuntos.objects.values_list('cliente_id', 'barberia_id', 'puntos'):
+        por_usuario.setdefault(cliente_id, {})[str(barberia_id)] = puntos
+    for usuario_id, puntos_json in por_usuario.items():
+        User.objects.filter(id=usuario_id).update(puntos_fidelidad=puntos_json)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_emailsaliente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoPuntos',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('puntos', models.IntegerField(default=0)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('barberia', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_puntos', to='core.barberia')),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_puntos', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Saldo de Puntos',
+                'verbose_name_plural': 'Saldos de Puntos',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='saldopuntos',
+            constraint=models.UniqueConstraint(fields=('cliente', 'barberia'), name='saldo_puntos_unico'),
+        ),
+        migrations.AddConstraint(
+            model_name='saldopuntos',
+            constraint=models.CheckConstraint(check=models.Q(('puntos__gte', 0)), name='saldo_puntos_no_negativo'),
+        ),
+        migrations.RunPython(migrar_puntos_json, restaurar_puntos_json),
+        migrations.RemoveField(
+            model_name='user',
+            name='puntos_fidelidad',
+        ),
+    ]
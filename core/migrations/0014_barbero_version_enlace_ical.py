@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_saldopuntos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='barbero',
+            name='version_enlace_ical',
+            field=models.PositiveIntegerField(default=1, help_text='Versión del enlace iCal de suscripción; al regenerarlo deja de valer el anterior'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.14 on 2026-10-18 19:05
+
+import logging
+from collections import defaultdict
+
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+
+def asignar_barberia(apps, schema_editor):
+    """
+    Los admins creados antes de User.barberia se resolvían por nombre
+    ("Admin {nosotros.nombre}", ver views_bootstrap). Se les asigna la
+    primera barbería de su tenant cuando el nombre coincide exactamente con
+    uno solo; el resto queda sin tenant y se registra para revisarlo.
+    """
+    User = apps.get_model('core', 'User')
+    Barberia = apps.get_model('core', 'Barberia')
+
+    tenants = defaultdict(set)
+    primera = {}
+    for barberia_id, nosotros_id, nombre in Barberia.objects.order_by('id').values_list(
+        'id', 'nosotros_id', 'nosotros__nombre'
+    ):
+        tenants[f'Admin {nombre}'].add(nosotros_id)
+        primera.setdefault(f'Admin {nombre}', barberia_id)
+    por_nombre = {nombre: primera[nombre] for nombre, ids in tenants.items() if len(ids) == 1}
+
+    for usuario_id, nombre in User.objects.filter(
+        rol='admin_barberia',
+        barberia__isnull=True
+    ).values_list('id', 'nombre'):
+        barberia_id = por_nombre.get(nombre)
+        if barberia_id is None:
+            logger.warning("Admin %s (%s) sin barbería: no coincide con un único tenant", usuario_id, nombre)
+            continue
+        User.objects.filter(id=usuario_id).update(barberia_id=barberia_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_barbero_version_enlace_ical'),
+    ]
+
+    operations = [
+        migrations.RunPython(asignar_barberia, migrations.RunPython.noop),
+    ]
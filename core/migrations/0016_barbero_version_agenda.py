@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_asignar_barberia_admins'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='barbero',
+            name='version_agenda',
+            field=models.PositiveIntegerField(default=1, help_text='Sube con cada cambio de horario o sucursal; marca los bitmaps OcupacionDia desfasados'),
+        ),
+    ]
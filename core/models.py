@@ -53,7 +53,6 @@ class User(AbstractBaseUser, PermissionsMixin):
     nombre = models.CharField(max_length=150)
     rol = models.CharField(max_length=20, choices=Roles.choices, default=Roles.CLIENTE, db_index=True)
     barberia = models.ForeignKey('core.Barberia', on_delete=models.SET_NULL, null=True, blank=True)
-    puntos_fidelidad = models.JSONField(default=dict, blank=True, help_text="{'barberia_id': puntos}")
     
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
@@ -69,84 +68,61 @@ class User(AbstractBaseUser, PermissionsMixin):
     
     def obtener_puntos(self, barberia_id):
         """HU42: Obtener puntos de fidelidad de una barbería"""
-        if not isinstance(self.puntos_fidelidad, dict):
-            self.puntos_fidelidad = {}
-            self.save(update_fields=['puntos_fidelidad'])
-        return self.puntos_fidelidad.get(str(barberia_id), 0)
+        saldo = SaldoPuntos.objects.filter(
+            cliente=self,
+            barberia_id=barberia_id
+        ).values_list('puntos', flat=True).first()
+        return saldo or 0
     
     def agregar_puntos(self, barberia_id, puntos, cita=None):
         """HU42: Agregar puntos al cliente por cita completada"""
-        barberia_id_str = str(barberia_id)
-        
-        if not isinstance(self.puntos_fidelidad, dict):
-            self.puntos_fidelidad = {}
-        
-        self.puntos_fidelidad[barberia_id_str] = self.puntos_fidelidad.get(barberia_id_str, 0) + puntos
-        self.save(update_fields=['puntos_fidelidad'])
+        from django.db import transaction
+        from django.db.models import F
         
-        # Registrar historial
-        HistorialPuntos.objects.create(
-            cliente=self,
-            barberia_id=barberia_id,
-            tipo=HistorialPuntos.TipoMovimiento.GANADOS,
-            puntos=puntos,
-            cita=cita,
-            descripcion=f"Ganados por cita #{cita.id}" if cita else "Puntos ganados"
-        )
-        
-        return self.puntos_fidelidad[barberia_id_str]
+        with transaction.atomic():
+            SaldoPuntos.objects.bulk_create(
+                [SaldoPuntos(cliente=self, barberia_id=barberia_id)],
+                ignore_conflicts=True
+            )
+            saldo = SaldoPuntos.objects.filter(cliente=self, barberia_id=barberia_id)
+            saldo.update(puntos=F('puntos') + puntos, actualizado=timezone.now())
+            
+            # Registrar historial
+            HistorialPuntos.objects.create(
+                cliente=self,
+                barberia_id=barberia_id,
+                tipo=HistorialPuntos.TipoMovimiento.GANADOS,
+                puntos=puntos,
+                cita=cita,
+                descripcion=f"Ganados por cita #{cita.id}" if cita else "Puntos ganados"
+            )
+            return saldo.values_list('puntos', flat=True).get()
     
     def canjear_puntos(self, barberia_id, puntos):
         """HU42: Canjear puntos por descuento"""
-        barberia_id_str = str(barberia_id)
-        
-        if not isinstance(self.puntos_fidelidad, dict):
-            self.puntos_fidelidad = {}
-        
-        saldo_actual = self.puntos_fidelidad.get(barberia_id_str, 0)
-        
-        if saldo_actual < puntos:
-            return False, "Puntos insuficientes"
-        
-        self.puntos_fidelidad[barberia_id_str] = saldo_actual - puntos
-        self.save(update_fields=['puntos_fidelidad'])
-        
-        # Registrar historial
-        HistorialPuntos.objects.create(
-            cliente=self,
-            barberia_id=barberia_id,
-            tipo=HistorialPuntos.TipoMovimiento.CANJEADOS,
-            puntos=-puntos,
-            descripcion="Canjeados en reserva"
-        )
+        from django.db import transaction
+        from django.db.models import F
         
-        return True, self.puntos_fidelidad[barberia_id_str]
+        with transaction.atomic():
+            # El saldo se valida y descuenta en el mismo UPDATE
+            saldo = SaldoPuntos.objects.filter(cliente=self, barberia_id=barberia_id)
+            if not saldo.filter(puntos__gte=puntos).update(puntos=F('puntos') - puntos, actualizado=timezone.now()):
+                return False, "Puntos insuficientes"
+            
+            # Registrar historial
+            HistorialPuntos.objects.create(
+                cliente=self,
+                barberia_id=barberia_id,
+                tipo=HistorialPuntos.TipoMovimiento.CANJEADOS,
+                puntos=-puntos,
+                descripcion="Canjeados en reserva"
+            )
+            return True, saldo.values_list('puntos', flat=True).get()
     
     def obtener_todas_las_barberias_con_puntos(self):
         """Obtener lista de barberías donde el usuario tiene puntos"""
-        if not isinstance(self.puntos_fidelidad, dict):
-            return []
-        
-        resultado = []
-        for barberia_id, puntos in self.puntos_fidelidad.items():
-            if puntos > 0:
-                try:
-                    barberia = Barberia.objects.get(id=int(barberia_id))
-                    try:
-                        programa = ProgramaFidelidad.objects.get(barberia=barberia, activo=True)
-                        valor_monetario = puntos * float(programa.pesos_por_punto)
-                    except ProgramaFidelidad.DoesNotExist:
-                        valor_monetario = 0
-                    
-                    resultado.append({
-                        'barberia': barberia,
-                        'puntos': puntos,
-                        'valor': valor_monetario
-                    })
-                except Barberia.DoesNotExist:
-                    pass
-        
-        return resultado
+        from .fidelidad import resumen_puntos
+        return resumen_puntos(self)
 
 
 phone_validator = RegexValidator(
@@ -212,6 +188,12 @@ class Barbero(models.Model):
     nombre = models.CharField(max_length=120)
     sucursal_principal = models.ForeignKey(Sucursal, on_delete=models.SET_NULL, null=True, blank=True)
     activo = models.BooleanField(default=True)
+    version_enlace_ical = models.PositiveIntegerField(
+        default=1, help_text="Versión del enlace iCal de suscripción; al regenerarlo deja de valer el anterior"
+    )
+    version_agenda = models.PositiveIntegerField(
+        default=1, help_text="Sube con cada cambio de horario o sucursal; marca los bitmaps OcupacionDia desfasados"
+    )
     creado = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -361,6 +343,28 @@ class HistorialPuntos(models.Model):
     def __str__(self):
         return f"{self.cliente.nombre} - {self.puntos}pts ({self.get_tipo_display()})"
 
+class SaldoPuntos(models.Model):
+    """
+    HU42: Saldo de puntos por (cliente, barbería). Se modifica solo con
+    UPDATE ... SET puntos = puntos ± n; HistorialPuntos es el libro de
+    movimientos del que sale este saldo.
+    """
+    cliente = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="saldos_puntos")
+    barberia = models.ForeignKey(Barberia, on_delete=models.CASCADE, related_name="saldos_puntos")
+    puntos = models.IntegerField(default=0)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Saldo de Puntos"
+        verbose_name_plural = "Saldos de Puntos"
+        constraints = [
+            models.UniqueConstraint(fields=["cliente", "barberia"], name="saldo_puntos_unico"),
+            models.CheckConstraint(check=models.Q(puntos__gte=0), name="saldo_puntos_no_negativo"),
+        ]
+
+    def __str__(self):
+        return f"{self.cliente.nombre} - {self.barberia.nombre}: {self.puntos}pts"
+
 # =========================
 # PLANES / LICENCIAS
 # =========================
@@ -419,6 +423,8 @@ class NotificacionEmail(models.Model):
         CONFIRMACION_CITA = "confirmacion_cita", "Confirmación de Cita"
         CANCELACION_CITA = "cancelacion_cita", "Cancelación de Cita"
         CITA_COMPLETADA = "cita_completada", "Cita Completada"
+        REPROGRAMACION_CITA = "reprogramacion_cita", "Reprogramación de Cita"
+        LISTA_ESPERA = "lista_espera", "Lista de Espera"
         PROMOCION = "promocion", "Promoción"
     
     destinatario = models.ForeignKey(
@@ -454,6 +460,56 @@ class NotificacionEmail(models.Model):
     
     def __str__(self):
         return f"{self.get_tipo_display()} → {self.destinatario.email}"
+
+
+class EmailSaliente(models.Model):
+    """
+    Bandeja de salida transaccional: el email se guarda en la misma
+    transacción que el cambio de estado y lo envía después
+    scheduling.tasks.enviar_emails_pendientes (ver core/correos.py).
+    """
+
+    class Estado(models.TextChoices):
+        PENDIENTE = "PENDIENTE", "Pendiente"
+        ENVIANDO = "ENVIANDO", "Enviando"
+        ENVIADO = "ENVIADO", "Enviado"
+        FALLIDO = "FALLIDO", "Fallido"
+
+    destinatario = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="emails_salientes"
+    )
+    para = models.EmailField()
+    cita = models.ForeignKey(
+        "scheduling.Cita",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="emails_salientes"
+    )
+    tipo = models.CharField(max_length=30, choices=NotificacionEmail.TipoNotificacion.choices)
+    asunto = models.CharField(max_length=200)
+    cuerpo = models.TextField()
+    cuerpo_html = models.TextField(blank=True)
+    remitente = models.CharField(max_length=254, blank=True, help_text="Vacío = DEFAULT_FROM_EMAIL")
+    estado = models.CharField(max_length=10, choices=Estado.choices, default=Estado.PENDIENTE)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now, help_text="Próximo envío o, si está ENVIANDO, vencimiento del reclamo")
+    ultimo_error = models.TextField(blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    enviado_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+        verbose_name = "Email Saliente"
+        verbose_name_plural = "Emails Salientes"
+        indexes = [
+            models.Index(fields=["estado", "proximo_intento"]),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} → {self.para} ({self.estado})"
 class LogActividad(models.Model):
     class TipoAccion(models.TextChoices):
         CREAR_BARBERIA = "crear_barberia", "Crear Barbería"
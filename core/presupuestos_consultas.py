@@ -0,0 +1,121 @@
+"""
+Presupuesto de consultas SQL por URL (lo verifica core/tests_consultas.py).
+
+Hay una entrada por cada ruta de dashboard/urls.py, scheduling/urls.py y
+licensing/urls.py, con la ruta completa como clave. Cada entrada dice
+quién la visita (rol), con qué método y datos, y cuántas consultas puede
+hacer como máximo sobre el tenant sembrado por el test, con la caché
+vacía salvo el tenant ya resuelto, contando lo que corre tras el COMMIT
+(on_commit). `estado` es el código HTTP esperado: 200 para GET y 302
+para POST salvo que la entrada diga otro. Los parámetros de la ruta se llenan
+con los objetos sembrados según su nombre (cita_id → cita_pendiente,
+etc.) salvo que la entrada indique otro. Una ruta cuyo GET y POST hacen
+trabajo distinto lleva una lista con una entrada por método.
+
+Si una vista hace menos consultas después de un cambio, baja aquí su
+presupuesto para que la mejora quede protegida.
+"""
+
+ADMIN = 'admin'
+BARBERO = 'barbero'
+CLIENTE = 'cliente'
+SUPERADMIN = 'superadmin'
+ANONIMO = None
+
+
+def presupuesto(rol, consultas, metodo='get', datos=None, estado=None, **objetos):
+    return {
+        'rol': rol,
+        'consultas': consultas,
+        'metodo': metodo,
+        'datos': datos or {},
+        'estado': estado or (302 if metodo == 'post' else 200),
+        'objetos': objetos,
+    }
+
+
+PRESUPUESTOS = {
+    # dashboard/urls.py
+    '/panel/licencias/': presupuesto(SUPERADMIN, 2),
+    '/panel/admin/': presupuesto(ADMIN, 10),
+    '/panel/barbero/': presupuesto(BARBERO, 7),
+    '/panel/cliente/': presupuesto(CLIENTE, 8),
+    '/panel/exportar/citas/': presupuesto(ADMIN, 4),
+    '/panel/exportar/ingresos/': presupuesto(ADMIN, 4),
+    '/panel/exportaciones/': presupuesto(ADMIN, 3),
+    # Savepoint del INSERT: la restricción por huella puede rechazarlo
+    '/panel/exportaciones/solicitar/<str:tipo>/': presupuesto(ADMIN, 9, 'post'),
+    '/panel/exportaciones/<int:trabajo_id>/estado/': presupuesto(ADMIN, 3),
+    '/panel/exportaciones/<int:trabajo_id>/descargar/': presupuesto(ADMIN, 3),
+    '/panel/metricas/barberos/': presupuesto(ADMIN, 5),
+    '/panel/cita/<int:cita_id>/completar/': presupuesto(BARBERO, 5, 'post'),
+    '/panel/cita/<int:cita_id>/no-show/': presupuesto(BARBERO, 7, 'post'),
+    '/panel/estadisticas/ingresos/': presupuesto(ADMIN, 4),
+    '/panel/admin/citas/': presupuesto(ADMIN, 4),
+    '/panel/cita/<int:cita_id>/reagendar/': presupuesto(ADMIN, 4),
+    '/panel/cita/<int:cita_id>/cancelar/': presupuesto(ADMIN, 4),
+    '/panel/admin/sucursales/crear/': presupuesto(ADMIN, 5),
+    '/panel/admin/sucursales/<int:sucursal_id>/editar/': presupuesto(ADMIN, 3),
+    # Borra en cascada las ~380 citas sembradas de la sucursal. Las señales
+    # de Cita se juntan en un recálculo por transacción; solo el DELETE de
+    # Django va en lotes de 100 ids (4 aquí)
+    '/panel/admin/sucursales/<int:sucursal_id>/eliminar/': presupuesto(ADMIN, 17, 'post'),
+    '/panel/admin/barberos/crear/': presupuesto(ADMIN, 4),
+    '/panel/admin/barberos/<int:barbero_id>/toggle/': presupuesto(ADMIN, 5, 'post'),
+    '/panel/admin/invitaciones/nueva/': presupuesto(
+        ADMIN, 7, 'post', {'email': 'nuevo.barbero@test.com', 'sucursal_id': '{sucursal}'}
+    ),
+    '/panel/barbero/crear/': presupuesto(ADMIN, 4),
+    '/panel/exportar-agenda/': presupuesto(BARBERO, 5),
+    '/panel/agenda/<str:token>/agenda.ics': presupuesto(ANONIMO, 3, token='token_agenda'),
+    '/panel/agenda/regenerar-enlace/': presupuesto(BARBERO, 5, 'post'),
+    '/panel/admin/servicios/': presupuesto(ADMIN, 4),
+    '/panel/admin/servicios/crear/': presupuesto(ADMIN, 2),
+    '/panel/admin/servicios/<int:servicio_id>/editar/': presupuesto(ADMIN, 3),
+    '/panel/admin/servicios/<int:servicio_id>/eliminar/': presupuesto(ADMIN, 3),
+    '/panel/admin/servicios/<int:servicio_id>/toggle/': presupuesto(ADMIN, 4, 'post'),
+
+    # scheduling/urls.py (flujo de reserva y citas del cliente)
+    '/citas/': presupuesto(CLIENTE, 5),
+    '/citas/sucursal/<int:barberia_id>/': presupuesto(CLIENTE, 4),
+    '/citas/servicio/<int:sucursal_id>/': presupuesto(CLIENTE, 5),
+    '/citas/barbero/<int:sucursal_id>/<int:servicio_id>/': presupuesto(CLIENTE, 9),
+    '/citas/barbero/<int:sucursal_id>/<int:servicio_id>/disponibilidad.json': presupuesto(CLIENTE, 9),
+    # En frío: lee OcupacionDia y materializa la semana (4 consultas)
+    '/citas/proximos/<int:sucursal_id>/<int:servicio_id>/': presupuesto(CLIENTE, 10),
+    '/citas/retener/<int:sucursal_id>/<int:servicio_id>/<int:barbero_id>/': presupuesto(
+        CLIENTE, 5, 'post', {'fecha_hora': '{slot_libre}'}, estado=200
+    ),
+    '/citas/confirmar/<int:sucursal_id>/<int:servicio_id>/<int:barbero_id>/': presupuesto(
+        CLIENTE, 13, 'post', {'fecha_hora': '{slot_libre}'}
+    ),
+    '/citas/mis-citas/': presupuesto(CLIENTE, 3),
+    '/citas/cita/<int:cita_id>/cancelar/': presupuesto(CLIENTE, 5, 'post'),
+    '/citas/cita/<int:cita_id>/valorar/': presupuesto(CLIENTE, 6, cita_id='cita_completada'),
+    '/citas/barbero/<int:barbero_id>/valoraciones/': presupuesto(CLIENTE, 5),
+    '/citas/waitlist/<int:barbero_id>/<int:servicio_id>/unirse/': presupuesto(CLIENTE, 4),
+    '/citas/confirmar/<str:token>/': presupuesto(CLIENTE, 6, estado=302, token='token_confirmacion'),
+    '/citas/historial/': presupuesto(CLIENTE, 5),
+    '/citas/reprogramar/<int:cita_id>/': presupuesto(CLIENTE, 9),
+    '/citas/buscar/': presupuesto(CLIENTE, 5),
+    '/citas/puntos/<int:barberia_id>/canjear/': [
+        presupuesto(CLIENTE, 5),
+        presupuesto(CLIENTE, 12, 'post', {'puntos': '100'}),
+    ],
+    '/citas/cita/<int:cita_id>/atender/': presupuesto(BARBERO, 6),
+
+    # licensing/urls.py (su raíz coincide con /panel/licencias/ de dashboard)
+    '/panel/licencias/planes/crear/': presupuesto(
+        SUPERADMIN, 3, 'post',
+        {'nombre': 'empresarial', 'periodicidad': 'mensual', 'precio': '50000', 'max_barberos': '20', 'max_sucursales': '5'}
+    ),
+    '/panel/licencias/planes/<int:plan_id>/editar/': presupuesto(SUPERADMIN, 2),
+    '/panel/licencias/planes/<int:plan_id>/eliminar/': presupuesto(SUPERADMIN, 2),
+    '/panel/licencias/licencias/': presupuesto(SUPERADMIN, 2),
+    '/panel/licencias/barberias/': presupuesto(SUPERADMIN, 2),
+}
+
+# Rutas que no se pueden medir todavía, con el motivo
+SIN_MEDIR = {
+    '/panel/licencias/planes/': 'falta la plantilla licensing/planes_list.html',
+}
@@ -1,6 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .models import User, Cliente
+from .models import Barbero, Licencia, User, Cliente, HistorialPuntos, ProgramaFidelidad
+from .fidelidad import invalidar_resumen, invalidar_resumen_barberia
+from .tenancy import invalidar_tenant, invalidar_usuarios
 
 @receiver(post_save, sender=User)
 def crear_cliente_automatico(sender, instance, created, **kwargs):
@@ -9,4 +11,36 @@ def crear_cliente_automatico(sender, instance, created, **kwargs):
     """
     if created and instance.rol == User.Roles.CLIENTE:
         Cliente.objects.get_or_create(user=instance)
-        
\ No newline at end of file
+
+
+@receiver(post_save, sender=HistorialPuntos)
+def invalidar_resumen_puntos(sender, instance, created, **kwargs):
+    """HU42: Un movimiento nuevo cambia el saldo; se recalcula el resumen"""
+    if created:
+        invalidar_resumen(instance.cliente_id)
+
+
+@receiver(post_save, sender=ProgramaFidelidad)
+@receiver(post_delete, sender=ProgramaFidelidad)
+def invalidar_resumen_programa(sender, instance, **kwargs):
+    """HU42: el valor de los puntos depende del programa activo de la barbería"""
+    invalidar_resumen_barberia(instance.barberia_id)
+
+
+@receiver(post_save, sender=User)
+def invalidar_tenant_usuario(sender, instance, **kwargs):
+    """HU30: cambiar rol o barbería del usuario cambia su tenant"""
+    invalidar_usuarios([instance.id])
+
+
+@receiver(post_save, sender=Barbero)
+@receiver(post_delete, sender=Barbero)
+def invalidar_tenant_barbero(sender, instance, **kwargs):
+    invalidar_usuarios([instance.user_id])
+
+
+@receiver(post_save, sender=Licencia)
+@receiver(post_delete, sender=Licencia)
+def invalidar_tenant_licencia(sender, instance, **kwargs):
+    """HU30: renovar, suspender o borrar la licencia afecta a todo el tenant"""
+    invalidar_tenant(instance.nosotros_id)
@@ -0,0 +1,314 @@
+"""
+Datos sintéticos a escala (comando generar_datos_sinteticos y benchmarks).
+
+Todo se escribe por lotes sin pasar por save() ni por las señales: el
+tenant y sus catálogos con bulk_create, y citas, valoraciones y
+ResumenDiarioCitas con un INSERT directo (ver `_insertar`). Por eso cada
+Cita lleva su fecha_hora_fin calculada aquí y el resumen diario se
+acumula mientras se generan las citas, en vez de reagregarlas con
+rollup.reconciliar. OcupacionDia se materializa sola al consultarla.
+
+El contenido depende solo de la semilla, de los parámetros y del día en
+que se ejecuta. Los correos llevan un prefijo por ejecución para poder
+volver a generar datos sobre la misma base.
+"""
+import random
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+
+from analytics.models import ResumenDiarioCitas
+from scheduling.disponibilidad import INTERVALO_SLOT_MIN
+from scheduling.models import Cita, Valoracion
+from .models import (
+    Barberia, Barbero, HorarioDisponibilidad, Licencia, Nosotros, Plan, Servicio, Sucursal, User,
+)
+
+DOMINIO = 'sinteticos.test'
+NOMBRE_TENANT = 'Sintética'
+DIAS_POR_MES = 30
+HORA_APERTURA = 9
+HORA_CIERRE = 19
+DIAS_LABORALES = range(6)  # lunes a sábado; el domingo cierra
+SERVICIOS = (
+    ('Corte', 10000, 30),
+    ('Barba', 6000, 30),
+    ('Corte y barba', 15000, 60),
+    ('Degradado', 12000, 45),
+    ('Afeitado', 8000, 30),
+    ('Tinte', 20000, 60),
+)
+# Pesos acumulados de los estados de citas pasadas y futuras
+ESTADOS_PASADOS = (
+    (Cita.Estado.COMPLETADA, Cita.Estado.NO_SHOW, Cita.Estado.CANCELADA_CLIENTE, Cita.Estado.CANCELADA_ADMIN),
+    (80, 87, 97, 100),
+)
+ESTADOS_FUTUROS = (
+    (Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA),
+    (60, 100),
+)
+PROPORCION_VALORADAS = 0.3
+PUNTUACIONES = ((1, 2, 3, 4, 5), (2, 5, 15, 50, 100))
+
+
+@dataclass
+class Resultado:
+    prefijo: str
+    nosotros_ids: list = field(default_factory=list)
+    usuarios: int = 0
+    citas: int = 0
+    valoraciones: int = 0
+
+
+def correo(prefijo, nombre):
+    return f'{nombre}.{prefijo}@{DOMINIO}'
+
+
+def _en_lotes(objetos, batch_size):
+    objetos = iter(objetos)
+    while lote := list(islice(objetos, batch_size)):
+        yield lote
+
+
+def _usuarios(prefijo, nombres, rol, clave, batch_size):
+    """Crea los usuarios (parte local del correo, nombre) y los devuelve en orden"""
+    usuarios = [
+        User(email=correo(prefijo, local), nombre=nombre, rol=rol, password=clave)
+        for local, nombre in nombres
+    ]
+    return User.objects.bulk_create(usuarios, batch_size=batch_size)
+
+
+def _crear_tenants(prefijo, rng, tenants, sucursales, barberos, clave, desde, hasta, batch_size):
+    """Nosotros, licencia, barbería, admin, sucursales, servicios, barberos y horarios"""
+    plan, _ = Plan.objects.get_or_create(
+        nombre=Plan.TipoPlan.EMPRESARIAL,
+        defaults={'precio': Decimal('50000'), 'max_barberos': 1000, 'max_sucursales': 100},
+    )
+    nosotros = Nosotros.objects.bulk_create([
+        Nosotros(nombre=f'{NOMBRE_TENANT} {prefijo} {t}', plan=plan.nombre) for t in range(tenants)
+    ])
+    Licencia.objects.bulk_create([
+        Licencia(nosotros=n, plan=plan, fecha_inicio=desde, fecha_expiracion=hasta + timedelta(days=365))
+        for n in nosotros
+    ])
+    barberias = Barberia.objects.bulk_create([Barberia(nosotros=n, nombre=n.nombre) for n in nosotros])
+    admins = User.objects.bulk_create([
+        User(
+            email=correo(prefijo, f'admin{t}'), nombre=f'Admin {b.nombre}', rol=User.Roles.ADMIN_BARBERIA,
+            password=clave, barberia=b,
+        )
+        for t, b in enumerate(barberias)
+    ], batch_size=batch_size)
+
+    todas_sucursales = Sucursal.objects.bulk_create([
+        Sucursal(barberia=b, nombre=f'Sucursal {s}', direccion=f'Calle {rng.randrange(1, 9999)}')
+        for b in barberias for s in range(sucursales)
+    ], batch_size=batch_size)
+    todos_servicios = Servicio.objects.bulk_create([
+        Servicio(barberia=b, nombre=nombre, precio=Decimal(precio), duracion_minutos=minutos)
+        for b in barberias for nombre, precio, minutos in SERVICIOS
+    ], batch_size=batch_size)
+
+    usuarios_barberos = _usuarios(
+        prefijo,
+        [(f'barbero{t}-{i}', f'Barbero {t}-{i}') for t in range(tenants) for i in range(barberos)],
+        User.Roles.BARBERO, clave, batch_size,
+    )
+    todos_barberos = Barbero.objects.bulk_create([
+        Barbero(
+            nosotros=nosotros[t], user=usuarios_barberos[t * barberos + i], nombre=f'Barbero {t}-{i}',
+            sucursal_principal=todas_sucursales[t * sucursales + i % sucursales],
+        )
+        for t in range(tenants) for i in range(barberos)
+    ], batch_size=batch_size)
+    HorarioDisponibilidad.objects.bulk_create([
+        HorarioDisponibilidad(barbero=b, dia_semana=dia, hora_inicio=time(HORA_APERTURA), hora_fin=time(HORA_CIERRE))
+        for b in todos_barberos for dia in DIAS_LABORALES
+    ], batch_size=batch_size)
+
+    return [
+        {
+            'nosotros': nosotros[t],
+            'barberos': todos_barberos[t * barberos:(t + 1) * barberos],
+            'servicios': todos_servicios[t * len(SERVICIOS):(t + 1) * len(SERVICIOS)],
+        }
+        for t in range(tenants)
+    ], len(admins) + len(usuarios_barberos)
+
+
+def _agenda_dia(rng, servicios, citas_por_dia):
+    """(minuto de inicio, servicio) sin solapes entre la apertura y el cierre"""
+    minuto = HORA_APERTURA * 60
+    for _ in range(citas_por_dia):
+        minuto += INTERVALO_SLOT_MIN * rng.randrange(2)  # a veces queda un hueco
+        servicio = rng.choice(servicios)
+        if minuto + servicio.duracion_minutos > HORA_CIERRE * 60:
+            return
+        yield minuto, servicio
+        minuto += -(-servicio.duracion_minutos // INTERVALO_SLOT_MIN) * INTERVALO_SLOT_MIN
+
+
+def _insertar(modelo, campos, filas, batch_size):
+    """
+    INSERT por lotes con executemany. Cada fila trae ya preparados los
+    valores de `campos`; el resto de columnas llevan su default, preparado
+    una sola vez. bulk_create prepara cada campo de cada fila y en SQLite
+    parte el lote en INSERTs de pocas decenas de filas, y a millones de
+    filas eso es casi todo el tiempo. Devuelve cuántas filas escribió.
+    """
+    ahora = timezone.now()
+    columnas = [modelo._meta.get_field(campo).column for campo in campos]
+    fijos = []
+    for f in modelo._meta.concrete_fields:
+        if f.primary_key or f.attname in campos:
+            continue
+        valor = ahora if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False) else f.get_default()
+        columnas.append(f.column)
+        fijos.append(f.get_db_prep_save(valor, connection))
+    fijos = tuple(fijos)
+
+    qn = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        qn(modelo._meta.db_table), ', '.join(qn(c) for c in columnas), ', '.join(['%s'] * len(columnas))
+    )
+    total = 0
+    with connection.cursor() as cursor:
+        for lote in _en_lotes(filas, batch_size):
+            cursor.executemany(sql, [fila + fijos for fila in lote])
+            total += len(lote)
+    return total
+
+
+CAMPOS_CITA = (
+    'cliente_id', 'barbero_id', 'sucursal_id', 'servicio_id', 'fecha_hora', 'fecha_hora_fin', 'estado', 'precio',
+)
+
+
+def _citas(rng, tenant, cliente_ids, fechas, hoy, citas_por_dia, resumen):
+    """
+    Filas (CAMPOS_CITA) del tenant, día a día y barbero a barbero. De paso
+    acumula en `resumen` cantidad, ingresos y minutos por clave de
+    ResumenDiarioCitas.
+    """
+    preparar_fecha = Cita._meta.get_field('fecha_hora').get_db_prep_save
+    precio = Cita._meta.get_field('precio')
+    precios = {s.id: precio.get_db_prep_save(s.precio, connection) for s in tenant['servicios']}
+    for fecha in fechas:
+        if fecha.weekday() not in DIAS_LABORALES:
+            continue
+        inicio_dia = timezone.make_aware(datetime.combine(fecha, time()))
+        estados, pesos = ESTADOS_PASADOS if fecha < hoy else ESTADOS_FUTUROS
+        horas = {}  # minuto del día → valor preparado, compartido por los barberos
+
+        def hora(minuto):
+            if minuto not in horas:
+                horas[minuto] = preparar_fecha(inicio_dia + timedelta(minutes=minuto), connection)
+            return horas[minuto]
+
+        for barbero in tenant['barberos']:
+            for minuto, servicio in _agenda_dia(rng, tenant['servicios'], citas_por_dia):
+                estado = rng.choices(estados, cum_weights=pesos)[0]
+                acumulado = resumen[(fecha, barbero.id, barbero.sucursal_principal_id, servicio.id, estado)]
+                acumulado[0] += 1
+                acumulado[1] += servicio.precio
+                acumulado[2] += servicio.duracion_minutos
+                yield (
+                    rng.choice(cliente_ids),
+                    barbero.id,
+                    barbero.sucursal_principal_id,
+                    servicio.id,
+                    hora(minuto),
+                    hora(minuto + servicio.duracion_minutos),
+                    estado,
+                    precios[servicio.id],
+                )
+
+
+def _resumenes(nosotros, resumen):
+    """Filas de ResumenDiarioCitas desde lo acumulado por `_citas` (mismas claves que rollup)"""
+    fecha = ResumenDiarioCitas._meta.get_field('fecha')
+    ingresos = ResumenDiarioCitas._meta.get_field('ingresos')
+    for (dia, barbero_id, sucursal_id, servicio_id, estado), (cantidad, suma, minutos) in resumen.items():
+        yield (
+            nosotros.id, sucursal_id, barbero_id, servicio_id, fecha.get_db_prep_save(dia, connection), estado,
+            cantidad, ingresos.get_db_prep_save(suma, connection), minutos,
+        )
+
+
+def _valoraciones(rng, nosotros, batch_size):
+    """
+    Valora una parte de las citas completadas del tenant. Las filas se
+    leen sin conversores y vuelven a la base tal como salieron.
+    """
+    sql, params = Cita.objects.filter(
+        barbero__nosotros=nosotros,
+        estado=Cita.Estado.COMPLETADA
+    ).order_by('id').values_list('id', 'cliente_id', 'barbero_id', 'fecha_hora_fin').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        completadas = iter(lambda: cursor.fetchmany(batch_size), [])
+        valoraciones = (
+            (cita_id, cliente_id, barbero_id, fin, rng.choices(PUNTUACIONES[0], cum_weights=PUNTUACIONES[1])[0])
+            for lote in completadas
+            for cita_id, cliente_id, barbero_id, fin in lote
+            if rng.random() < PROPORCION_VALORADAS
+        )
+        return _insertar(
+            Valoracion, ('cita_id', 'cliente_id', 'barbero_id', 'creada_en', 'puntuacion'), valoraciones, batch_size
+        )
+
+
+def generar(tenants=1, sucursales=2, barberos=4, clientes=200, citas_por_dia=8, meses=3, dias_futuros=14,
+            semilla=1, prefijo=None, password=None, batch_size=5000, avance=None):
+    """
+    Genera `tenants` tenants completos con `meses` meses de historia y
+    `dias_futuros` días de agenda. `citas_por_dia` es por barbero (se
+    recorta a lo que cabe en su horario). `avance(tenant, citas)` se
+    llama tras escribir cada tenant. Devuelve un Resultado.
+    """
+    rng = random.Random(semilla)
+    prefijo = prefijo or timezone.now().strftime('s%Y%m%d%H%M%S')
+    resultado = Resultado(prefijo=prefijo)
+    hoy = timezone.localdate()
+    desde = hoy - timedelta(days=meses * DIAS_POR_MES)
+    hasta = hoy + timedelta(days=dias_futuros)
+    fechas = [desde + timedelta(days=i) for i in range((hasta - desde).days + 1)]
+    clave = make_password(password)
+
+    with transaction.atomic():
+        cliente_ids = [
+            u.id for u in _usuarios(
+                prefijo, [(f'cliente{i}', f'Cliente {i}') for i in range(clientes)],
+                User.Roles.CLIENTE, clave, batch_size,
+            )
+        ]
+        creados, usuarios = _crear_tenants(
+            prefijo, rng, tenants, sucursales, barberos, clave, desde, hasta, batch_size
+        )
+    resultado.usuarios = len(cliente_ids) + usuarios
+
+    for tenant in creados:
+        with transaction.atomic():
+            resumen = defaultdict(lambda: [0, 0, 0])
+            citas = _insertar(
+                Cita, CAMPOS_CITA, _citas(rng, tenant, cliente_ids, fechas, hoy, citas_por_dia, resumen), batch_size
+            )
+            resultado.valoraciones += _valoraciones(rng, tenant['nosotros'], batch_size)
+            _insertar(
+                ResumenDiarioCitas,
+                ('nosotros_id', 'sucursal_id', 'barbero_id', 'servicio_id', 'fecha', 'estado', 'cantidad', 'ingresos', 'minutos'),
+                _resumenes(tenant['nosotros'], resumen),
+                batch_size,
+            )
+        resultado.nosotros_ids.append(tenant['nosotros'].id)
+        resultado.citas += citas
+        if avance:
+            avance(tenant['nosotros'], citas)
+    return resultado
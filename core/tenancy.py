@@ -0,0 +1,142 @@
+"""
+HU30: Resolución del tenant (Nosotros) y su licencia para un usuario.
+
+Una sola consulta indexada devuelve nosotros_id y el estado de la
+licencia:
+
+- BARBERO: por Barbero.user (único) → nosotros → licencia
+- ADMIN_BARBERIA: por User.barberia (pk) → nosotros → licencia (los
+  admins antiguos sin barbería se asignaron en la migración 0015)
+
+El resultado queda en caché por usuario con un TTL corto y se borra tras
+el COMMIT cuando cambia la Licencia, el Barbero o el propio User (ver
+core/signals.py). PlanRequiredMiddleware lo deja en request.tenant y las
+vistas lo leen con `tenant_de(request)`: nosotros, barberias, sucursales
+y licencia se cargan la primera vez que se usan y se reutilizan durante
+el resto del request.
+"""
+from functools import cached_property
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Barberia, Barbero, Licencia, Nosotros, Sucursal, User
+
+TENANT_TTL_SEG = 5 * 60
+_SIN_TENANT = 0  # se cachea también "sin tenant" para no repetir la consulta
+
+
+class ContextoTenant:
+    """
+    Tenant del usuario y estado de su licencia. Los atributos de estado
+    vienen de la caché; los modelos se consultan al primer acceso.
+    """
+
+    def __init__(self, nosotros_id, licencia_id=None, licencia_activa=False,
+                 pago_pendiente=False, fecha_expiracion=None):
+        self.nosotros_id = nosotros_id
+        self.licencia_id = licencia_id
+        self.licencia_activa = licencia_activa
+        self.pago_pendiente = pago_pendiente
+        self.fecha_expiracion = fecha_expiracion
+
+    def licencia_vigente(self):
+        """Mismo criterio que Licencia.esta_activa"""
+        if self.licencia_id is None:
+            return False
+        return (
+            self.licencia_activa
+            and not self.pago_pendiente
+            and self.fecha_expiracion >= timezone.now().date()
+        )
+
+    @cached_property
+    def nosotros(self):
+        return Nosotros.objects.get(id=self.nosotros_id)
+
+    @cached_property
+    def barberias(self):
+        return list(Barberia.objects.filter(nosotros_id=self.nosotros_id).order_by('id'))
+
+    @cached_property
+    def sucursales(self):
+        """QuerySet de las sucursales del tenant; al recorrerlo queda en memoria"""
+        return Sucursal.objects.filter(barberia__nosotros_id=self.nosotros_id).select_related('barberia')
+
+    @cached_property
+    def licencia(self):
+        if self.licencia_id is None:
+            return None
+        return Licencia.objects.select_related('plan').get(id=self.licencia_id)
+
+
+def _clave(usuario_id):
+    return f"tenant:usuario:{usuario_id}"
+
+
+def _campos(prefijo):
+    return {
+        'tenant_id': F(f'{prefijo}id') if prefijo else F('id'),
+        'licencia_id': F(f'{prefijo}licencia__id'),
+        'licencia_activa': F(f'{prefijo}licencia__activa'),
+        'pago_pendiente': F(f'{prefijo}licencia__pago_pendiente'),
+        'fecha_expiracion': F(f'{prefijo}licencia__fecha_expiracion'),
+    }
+
+
+def _consultar(user):
+    """Una consulta; None si el usuario no pertenece a ningún tenant"""
+    if user.rol == User.Roles.BARBERO:
+        filas = Barbero.objects.filter(user_id=user.id).values(**_campos('nosotros__'))
+    elif user.rol == User.Roles.ADMIN_BARBERIA and user.barberia_id:
+        filas = Barberia.objects.filter(id=user.barberia_id).values(**_campos('nosotros__'))
+    else:
+        return None
+    fila = filas.first()
+    if not fila:
+        return None
+    return {
+        'nosotros_id': fila['tenant_id'],
+        'licencia_id': fila['licencia_id'],
+        'licencia_activa': bool(fila['licencia_activa']),
+        'pago_pendiente': bool(fila['pago_pendiente']),
+        'fecha_expiracion': fila['fecha_expiracion'],
+    }
+
+
+def resolver_tenant(user):
+    """ContextoTenant del usuario (desde caché si está), o None"""
+    if not user.is_authenticated:
+        return None
+    clave = _clave(user.id)
+    datos = cache.get(clave)
+    if datos is None:
+        datos = _consultar(user) or _SIN_TENANT
+        cache.set(clave, datos, TENANT_TTL_SEG)
+    if datos == _SIN_TENANT:
+        return None
+    return ContextoTenant(**datos)
+
+
+def tenant_de(request):
+    """Tenant del request (resuelto una vez por PlanRequiredMiddleware)"""
+    if not hasattr(request, 'tenant'):
+        request.tenant = resolver_tenant(request.user)
+    return request.tenant
+
+
+def invalidar_usuarios(usuario_ids):
+    usuario_ids = [usuario_id for usuario_id in set(usuario_ids) if usuario_id]
+    if usuario_ids:
+        transaction.on_commit(lambda: cache.delete_many([_clave(usuario_id) for usuario_id in usuario_ids]))
+
+
+def invalidar_tenant(nosotros_id):
+    """Borra la resolución de todos los usuarios (barberos y admins) del tenant"""
+    invalidar_usuarios(
+        User.objects.filter(
+            Q(barbero__nosotros_id=nosotros_id) | Q(barberia__nosotros_id=nosotros_id)
+        ).values_list('id', flat=True)
+    )
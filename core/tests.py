@@ -1,3 +1,265 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import (
+    Barberia, Barbero, HistorialPuntos, Licencia, Nosotros, Plan, ProgramaFidelidad, SaldoPuntos, User,
+)
+from analytics import rollup
+from analytics.models import ResumenDiarioCitas
+from core import sinteticos
+from core.tenancy import resolver_tenant
+from scheduling.models import Cita, Valoracion
+
+
+class SaldoPuntosTest(TestCase):
+    """HU42: el saldo vive en SaldoPuntos y cada movimiento queda en HistorialPuntos"""
+
+    def setUp(self):
+        nosotros = Nosotros.objects.create(nombre='N')
+        self.barberia = Barberia.objects.create(nosotros=nosotros, nombre='B')
+        self.cliente = User.objects.create_user(email='c@test.com', password='x', nombre='C')
+
+    def test_agregar_y_canjear_actualizan_saldo_e_historial(self):
+        self.assertEqual(self.cliente.obtener_puntos(self.barberia.id), 0)
+        self.assertEqual(self.cliente.agregar_puntos(self.barberia.id, 60), 60)
+        self.assertEqual(self.cliente.agregar_puntos(self.barberia.id, 10), 70)
+        self.assertEqual(self.cliente.canjear_puntos(self.barberia.id, 50), (True, 20))
+        self.assertEqual(self.cliente.obtener_puntos(self.barberia.id), 20)
+        self.assertEqual(SaldoPuntos.objects.count(), 1)
+        self.assertEqual(
+            sum(HistorialPuntos.objects.filter(cliente=self.cliente).values_list('puntos', flat=True)),
+            20
+        )
+
+    def test_canje_sin_saldo_no_modifica_nada(self):
+        self.cliente.agregar_puntos(self.barberia.id, 30)
+        self.assertEqual(self.cliente.canjear_puntos(self.barberia.id, 40), (False, "Puntos insuficientes"))
+        self.assertEqual(self.cliente.obtener_puntos(self.barberia.id), 30)
+        self.assertFalse(HistorialPuntos.objects.filter(tipo=HistorialPuntos.TipoMovimiento.CANJEADOS).exists())
+
+    def test_saldo_se_lee_con_una_consulta(self):
+        self.cliente.agregar_puntos(self.barberia.id, 10)
+        with self.assertNumQueries(1):
+            self.cliente.obtener_puntos(self.barberia.id)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ResumenPuntosTest(TestCase):
+    """HU42: resumen de puntos en consultas constantes y cacheado por usuario"""
+
+    def setUp(self):
+        cache.clear()
+        nosotros = Nosotros.objects.create(nombre='N')
+        self.barberias = [Barberia.objects.create(nosotros=nosotros, nombre=f'B{i}') for i in range(4)]
+        for barberia in self.barberias[:3]:
+            ProgramaFidelidad.objects.create(barberia=barberia, pesos_por_punto=10)
+        self.cliente = User.objects.create_user(email='c@test.com', password='x', nombre='C')
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, barberia in enumerate(self.barberias):
+                self.cliente.agregar_puntos(barberia.id, 10 * (i + 1))
+
+    def test_resumen_en_tres_consultas_y_cacheado(self):
+        with self.assertNumQueries(3):
+            resumen = self.cliente.obtener_todas_las_barberias_con_puntos()
+        self.assertEqual([item['puntos'] for item in resumen], [40, 30, 20, 10])
+        self.assertEqual([item['valor'] for item in resumen], [0.0, 300.0, 200.0, 100.0])
+        with self.assertNumQueries(0):
+            self.cliente.obtener_todas_las_barberias_con_puntos()
+
+    def test_nuevo_movimiento_invalida_el_resumen(self):
+        self.cliente.obtener_todas_las_barberias_con_puntos()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cliente.canjear_puntos(self.barberias[0].id, 5)
+        resumen = self.cliente.obtener_todas_las_barberias_con_puntos()
+        self.assertIn(5, [item['puntos'] for item in resumen])
+
+    def test_cambio_de_programa_invalida_el_resumen(self):
+        self.cliente.obtener_todas_las_barberias_con_puntos()
+        programa = ProgramaFidelidad.objects.get(barberia=self.barberias[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            programa.pesos_por_punto = 20
+            programa.save()
+        valores = {item['barberia'].id: item['valor'] for item in self.cliente.obtener_todas_las_barberias_con_puntos()}
+        self.assertEqual(valores[self.barberias[1].id], 400.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            programa.delete()
+        resumen = self.cliente.obtener_todas_las_barberias_con_puntos()
+        self.assertFalse(next(i for i in resumen if i['barberia'].id == self.barberias[1].id)['programa_activo'])
+
+    def test_panel_cliente_muestra_solo_programas_activos(self):
+        self.client.force_login(self.cliente)
+        respuesta = self.client.get(reverse('panel_cliente'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.context['barberias_con_puntos']), 3)
+
+    def test_pagina_de_canje(self):
+        self.client.force_login(self.cliente)
+        url = reverse('scheduling:canjear_puntos', args=[self.barberias[1].id])
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertContains(respuesta, '20 puntos')
+        # Bajo el mínimo del programa se vuelve a mostrar la página con el error
+        respuesta = self.client.post(url, {'puntos': '10'})
+        self.assertContains(respuesta, 'Mínimo 50 puntos para canjear')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ResolucionTenantTest(TestCase):
+    """HU30: tenant y licencia en una consulta, cacheados e invalidados al cambiar"""
+
+    def setUp(self):
+        cache.clear()
+        plan = Plan.objects.create(nombre=Plan.TipoPlan.BASICO, precio=0)
+        hoy = timezone.localdate()
+        self.tenants = []
+        for nombre in ('Norte', 'Sur'):
+            nosotros = Nosotros.objects.create(nombre=nombre)
+            Licencia.objects.create(
+                nosotros=nosotros, plan=plan, fecha_inicio=hoy, fecha_expiracion=hoy + timedelta(days=30)
+            )
+            self.tenants.append(nosotros)
+        self.norte, self.sur = self.tenants
+        barberia = Barberia.objects.create(nosotros=self.norte, nombre='B')
+        self.admin = User.objects.create_user(
+            email='admin@test.com', password='x', nombre='Admin', rol=User.Roles.ADMIN_BARBERIA, barberia=barberia
+        )
+        usuario_barbero = User.objects.create_user(
+            email='b@test.com', password='x', nombre='Barbero', rol=User.Roles.BARBERO
+        )
+        Barbero.objects.create(nosotros=self.sur, user=usuario_barbero, nombre='Barbero')
+        self.barbero = usuario_barbero
+
+    def test_una_consulta_y_luego_cache(self):
+        with self.assertNumQueries(1):
+            tenant = resolver_tenant(self.admin)
+        self.assertEqual(tenant.nosotros_id, self.norte.id)
+        self.assertTrue(tenant.licencia_vigente())
+        with self.assertNumQueries(0):
+            resolver_tenant(self.admin)
+        with self.assertNumQueries(1):
+            self.assertEqual(resolver_tenant(self.barbero).nosotros_id, self.sur.id)
+
+    def test_admin_sin_barberia_no_tiene_tenant(self):
+        # Ya no se busca por nombre: la migración 0015 asignó la barbería
+        legado = User.objects.create_user(
+            email='legado@test.com', password='x', nombre='Admin Sur', rol=User.Roles.ADMIN_BARBERIA
+        )
+        with self.assertNumQueries(0):
+            self.assertIsNone(resolver_tenant(legado))
+
+    def test_cambio_de_licencia_invalida_y_el_middleware_redirige(self):
+        self.assertTrue(resolver_tenant(self.barbero).licencia_vigente())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sur.licencia.fecha_expiracion = timezone.localdate() - timedelta(days=1)
+            self.sur.licencia.save()
+        self.assertFalse(resolver_tenant(self.barbero).licencia_vigente())
+
+        self.client.force_login(self.barbero)
+        respuesta = self.client.get(reverse('panel_barbero'))
+        self.assertRedirects(respuesta, reverse('route_by_role'), fetch_redirect_response=False)
+        self.assertEqual(respuesta.wsgi_request.tenant.nosotros_id, self.sur.id)
+
+    def test_cambio_de_barberia_del_usuario_invalida(self):
+        resolver_tenant(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.barberia = Barberia.objects.create(nosotros=self.sur, nombre='B2')
+            self.admin.save()
+        self.assertEqual(resolver_tenant(self.admin).nosotros_id, self.sur.id)
+
+
+class MigracionBarberiaAdminsTest(TransactionTestCase):
+    """0015 asigna la barbería a los admins antiguos que se resolvían por nombre"""
+
+    def setUp(self):
+        from django.db import connection
+        from django.db.migrations.executor import MigrationExecutor
+        self.executor = MigrationExecutor(connection)
+        self.final = self.executor.loader.graph.leaf_nodes()
+
+    def tearDown(self):
+        self.executor.loader.build_graph()
+        self.executor.migrate(self.final)
+
+    def test_asigna_solo_coincidencias_exactas_y_unicas(self):
+        destino = [('core', '0014_barbero_version_enlace_ical')]
+        self.executor.migrate(destino)
+        apps = self.executor.loader.project_state(destino).apps
+        Historico = apps.get_model('core', 'User')
+        Barberia = apps.get_model('core', 'Barberia')
+        Nosotros = apps.get_model('core', 'Nosotros')
+
+        sur = Nosotros.objects.create(nombre='Sur')
+        central = Barberia.objects.create(nosotros=sur, nombre='Sur Central')
+        Barberia.objects.create(nosotros=sur, nombre='Sur Anexo')
+        # "Admin Sur Norte" contiene "Sur": antes podía caer en este tenant
+        Nosotros.objects.create(nombre='Sur Norte')
+        for nombre in ('Repetido', 'Repetido'):
+            Barberia.objects.create(nosotros=Nosotros.objects.create(nombre=nombre), nombre=nombre)
+
+        def admin(nombre):
+            return Historico.objects.create(email=f'{nombre}@migra.test', nombre=nombre, rol='admin_barberia').id
+
+        exacto = admin('Admin Sur')
+        parecido = admin('Admin Sur Norte')
+        repetido = admin('Admin Repetido')
+
+        with self.assertLogs('core.migrations', 'WARNING'):
+            self.executor.loader.build_graph()
+            self.executor.migrate(self.final)
+
+        barberias = dict(User.objects.filter(id__in=[exacto, parecido, repetido]).values_list('id', 'barberia_id'))
+        self.assertEqual(barberias, {exacto: central.id, parecido: None, repetido: None})
+
+
+class DatosSinteticosTest(TestCase):
+    """generar_datos_sinteticos: volumen coherente con lo que escriben las vistas"""
+
+    def setUp(self):
+        call_command(
+            'generar_datos_sinteticos', tenants=2, sucursales=2, barberos=3, clientes=20, citas_por_dia=6,
+            meses=1, dias_futuros=7, prefijo='t', password='clave123', stdout=StringIO(),
+        )
+
+    def _agenda(self, prefijo):
+        citas = Cita.objects.filter(cliente__email__endswith=f'.{prefijo}@{sinteticos.DOMINIO}').order_by('id')
+        return list(citas.values_list('barbero__nombre', 'servicio__nombre', 'fecha_hora', 'estado', 'precio'))
+
+    def test_estructura_de_los_tenants(self):
+        self.assertEqual(Nosotros.objects.filter(nombre__startswith='Sintética t ').count(), 2)
+        self.assertEqual(Barbero.objects.filter(user__email__endswith='.t@sinteticos.test').count(), 6)
+        admin = User.objects.get(email=sinteticos.correo('t', 'admin0'))
+        self.assertTrue(admin.check_password('clave123'))
+        self.assertTrue(resolver_tenant(admin).licencia_vigente())
+        barbero = Barbero.objects.filter(nosotros_id=resolver_tenant(admin).nosotros_id).first()
+        self.assertEqual(barbero.horarios.count(), len(sinteticos.DIAS_LABORALES))
+
+    def test_citas_con_fin_y_sin_solapes(self):
+        citas = Cita.objects.select_related('servicio').order_by('barbero_id', 'fecha_hora')
+        self.assertGreater(len(citas), 0)
+        anterior = None
+        for cita in citas:
+            self.assertEqual(cita.fecha_hora_fin, cita.fecha_hora + timedelta(minutes=cita.servicio.duracion_minutos))
+            if anterior and anterior.barbero_id == cita.barbero_id:
+                self.assertLessEqual(anterior.fecha_hora_fin, cita.fecha_hora)
+            anterior = cita
+        self.assertFalse(Valoracion.objects.exclude(cita__estado=Cita.Estado.COMPLETADA).exists())
+
+    def test_resumen_igual_al_de_la_reconciliacion(self):
+        campos = ('nosotros_id', 'sucursal_id', 'barbero_id', 'servicio_id', 'fecha', 'estado', 'cantidad', 'ingresos', 'minutos')
+        generado = set(ResumenDiarioCitas.objects.values_list(*campos))
+        hoy = timezone.localdate()
+        rollup.reconciliar(hoy - timedelta(days=60), hoy + timedelta(days=30))
+        self.assertEqual(generado, set(ResumenDiarioCitas.objects.values_list(*campos)))
+
+    def test_misma_semilla_mismos_datos(self):
+        sinteticos.generar(
+            tenants=2, sucursales=2, barberos=3, clientes=20, citas_por_dia=6, meses=1, dias_futuros=7, prefijo='u'
+        )
+        self.assertEqual(self._agenda('t'), self._agenda('u'))
@@ -0,0 +1,251 @@
+"""
+Presupuesto de consultas por vista: se siembra un tenant realista y se
+visita cada ruta de dashboard, scheduling y licensing con su rol. Los
+límites están en core/presupuestos_consultas.py.
+"""
+import re
+import tempfile
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver
+from django.utils import timezone
+
+from analytics import rollup
+from core.models import (
+    Barberia, Barbero, DiaExcepcional, HistorialPuntos, HorarioDisponibilidad, Licencia, Nosotros, Plan,
+    ProgramaFidelidad, SaldoPuntos, Servicio, Sucursal, User,
+)
+from core.presupuestos_consultas import PRESUPUESTOS, SIN_MEDIR
+from core.tenancy import resolver_tenant
+from dashboard import agenda_ical
+from dashboard.models import TrabajoExportacion
+from scheduling.models import Cita, Promocion, Valoracion, WaitlistEntry
+from scheduling.utils import firmar
+
+URLCONFS = ('dashboard.urls', 'scheduling.urls', 'licensing.urls')
+
+# Objeto sembrado que llena cada parámetro de ruta si la entrada no dice otro
+OBJETO_POR_PARAMETRO = {
+    'barberia_id': 'barberia',
+    'sucursal_id': 'sucursal',
+    'servicio_id': 'servicio',
+    'barbero_id': 'barbero',
+    'cita_id': 'cita_pendiente',
+    'trabajo_id': 'trabajo',
+    'plan_id': 'plan',
+    'tipo': 'tipo_exportacion',
+}
+
+PARAMETRO = re.compile(r'<(?:\w+:)?(\w+)>')
+
+
+def rutas():
+    """Rutas completas (con sus parámetros) de las apps medidas"""
+    for resolver in get_resolver().url_patterns:
+        modulo = getattr(resolver, 'urlconf_name', None)
+        if getattr(modulo, '__name__', modulo) in URLCONFS:
+            for patron in resolver.url_patterns:
+                yield f'/{resolver.pattern}{patron.pattern}'
+
+
+def _en(dias, hora):
+    return timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=dias), time(hora)))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PresupuestoConsultasTest(TestCase):
+    """Ninguna vista supera su presupuesto de consultas (p. ej. por un N+1)"""
+
+    DIAS_PASADOS = 30
+    DIAS_FUTUROS = 7
+    HORAS_CITAS = (10, 11, 12, 13, 14)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directorio = tempfile.TemporaryDirectory()
+        cls.ajustes = override_settings(EXPORTACIONES_ROOT=cls.directorio.name)
+        cls.ajustes.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.ajustes.disable()
+        cls.directorio.cleanup()
+
+    @classmethod
+    def setUpTestData(cls):
+        hoy = timezone.localdate()
+        plan = Plan.objects.create(nombre=Plan.TipoPlan.PROFESIONAL, precio=20000, max_barberos=10, max_sucursales=5)
+        nosotros = Nosotros.objects.create(nombre='Barbería Central')
+        Licencia.objects.create(
+            nosotros=nosotros, plan=plan, fecha_inicio=hoy - timedelta(days=60), fecha_expiracion=hoy + timedelta(days=300)
+        )
+        barberia = Barberia.objects.create(nosotros=nosotros, nombre='Central')
+        sucursales = [
+            Sucursal.objects.create(barberia=barberia, nombre=nombre, direccion=f'{nombre} 100')
+            for nombre in ('Centro', 'Norte', 'Sur')
+        ]
+        servicios = [
+            Servicio.objects.create(barberia=barberia, nombre=nombre, precio=Decimal(precio), duracion_minutos=minutos)
+            for nombre, precio, minutos in (
+                ('Corte', 10000, 30), ('Barba', 6000, 30), ('Corte y barba', 15000, 60), ('Degradado', 12000, 45),
+                ('Afeitado', 8000, 30), ('Tinte', 20000, 60), ('Cejas', 3000, 30), ('Niño', 8000, 30),
+            )
+        ]
+        barberos = []
+        for i in range(6):
+            user = User.objects.create_user(
+                email=f'barbero{i}@central.test', password=None, nombre=f'Barbero {i}', rol=User.Roles.BARBERO
+            )
+            barberos.append(Barbero.objects.create(
+                nosotros=nosotros, user=user, nombre=f'Barbero {i}', sucursal_principal=sucursales[i % len(sucursales)]
+            ))
+        HorarioDisponibilidad.objects.bulk_create([
+            HorarioDisponibilidad(barbero=barbero, dia_semana=dia, hora_inicio=time(9), hora_fin=time(19))
+            for barbero in barberos for dia in range(7)
+        ])
+        DiaExcepcional.objects.create(
+            sucursal=sucursales[1], fecha=hoy + timedelta(days=5), tipo=DiaExcepcional.TipoExcepcion.CERRADO,
+            motivo='Feriado'
+        )
+
+        # Otro tenant, para que los listados públicos no vean uno solo
+        otra = Barberia.objects.create(nosotros=Nosotros.objects.create(nombre='Otra'), nombre='Otra')
+        Sucursal.objects.create(barberia=otra, nombre='Única', direccion='Otra 1')
+
+        clientes = [
+            User.objects.create_user(email=f'cliente{i}@test.com', password=None, nombre=f'Cliente {i}')
+            for i in range(30)
+        ]
+        cliente = clientes[0]
+
+        pasados = [Cita.Estado.COMPLETADA, Cita.Estado.COMPLETADA, Cita.Estado.NO_SHOW, Cita.Estado.CANCELADA_CLIENTE]
+        futuros = [Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA]
+        citas = []
+        for dias in range(-cls.DIAS_PASADOS, cls.DIAS_FUTUROS + 1):
+            estados = pasados if dias < 0 else futuros
+            for b, barbero in enumerate(barberos):
+                for h, hora in enumerate(cls.HORAS_CITAS):
+                    servicio = servicios[(b + h + dias) % len(servicios)]
+                    inicio = _en(dias, hora)
+                    citas.append(Cita(
+                        cliente=clientes[(b * 7 + h + dias) % len(clientes)], barbero=barbero,
+                        sucursal=barbero.sucursal_principal, servicio=servicio,
+                        fecha_hora=inicio, fecha_hora_fin=inicio + timedelta(minutes=servicio.duracion_minutos),
+                        estado=estados[(b + h + dias) % len(estados)], precio=servicio.precio,
+                    ))
+        Cita.objects.bulk_create(citas, batch_size=500)
+
+        completadas = Cita.objects.filter(estado=Cita.Estado.COMPLETADA).order_by('id')
+        Valoracion.objects.bulk_create([
+            Valoracion(cita=cita, cliente_id=cita.cliente_id, barbero_id=cita.barbero_id, puntuacion=3 + cita.id % 3)
+            for cita in completadas[::2]
+        ])
+        rollup.reconciliar(hoy - timedelta(days=cls.DIAS_PASADOS), hoy + timedelta(days=cls.DIAS_FUTUROS))
+
+        ProgramaFidelidad.objects.create(barberia=barberia, pesos_por_punto=Decimal('10'), minimo_canje=50)
+        SaldoPuntos.objects.create(cliente=cliente, barberia=barberia, puntos=500)
+        HistorialPuntos.objects.bulk_create([
+            HistorialPuntos(cliente=cliente, barberia=barberia, tipo=HistorialPuntos.TipoMovimiento.GANADOS, puntos=100)
+            for _ in range(5)
+        ])
+        for i in range(3):
+            Promocion.objects.create(
+                barberia=barberia, nombre=f'Promo {i}', codigo=f'PROMO{i}', tipo_descuento=Promocion.TipoDescuento.PORCENTAJE,
+                valor=10, fecha_inicio=hoy - timedelta(days=10), fecha_fin=hoy + timedelta(days=10),
+            )
+        WaitlistEntry.objects.bulk_create([
+            WaitlistEntry(cliente=c, barbero=barberos[0], servicio=servicios[0], fecha_dia=hoy + timedelta(days=1))
+            for c in clientes[1:6]
+        ])
+
+        # Citas propias del cliente y del barbero principal, fuera de las horas sembradas
+        barbero = barberos[0]
+        cita_pendiente = Cita.objects.create(
+            cliente=cliente, barbero=barbero, sucursal=barbero.sucursal_principal, servicio=servicios[0],
+            fecha_hora=_en(2, 17), precio=servicios[0].precio,
+        )
+        cita_completada = Cita.objects.create(
+            cliente=cliente, barbero=barbero, sucursal=barbero.sucursal_principal, servicio=servicios[0],
+            fecha_hora=_en(-2, 17), precio=servicios[0].precio, estado=Cita.Estado.COMPLETADA,
+        )
+
+        admin = User.objects.create_user(
+            email='admin@central.test', password=None, nombre='Admin Central',
+            rol=User.Roles.ADMIN_BARBERIA, barberia=barberia,
+        )
+        superadmin = User.objects.create_user(
+            email='super@test.com', password=None, nombre='Super', rol=User.Roles.SUPERADMIN
+        )
+        trabajo = TrabajoExportacion.objects.create(
+            solicitante=admin, nosotros=nosotros, tipo=TrabajoExportacion.Tipo.CITAS_CSV, huella='x',
+            estado=TrabajoExportacion.Estado.COMPLETADO, archivo='citas.csv', total=1, procesadas=1,
+        )
+        with open(f'{cls.directorio.name}/citas.csv', 'w', encoding='utf-8') as archivo:
+            archivo.write('id\n1\n')
+
+        cls.usuarios = {'admin': admin, 'barbero': barbero.user, 'cliente': cliente, 'superadmin': superadmin}
+        cls.objetos = {
+            'barberia': barberia.id,
+            'sucursal': barbero.sucursal_principal_id,
+            'servicio': servicios[0].id,
+            'barbero': barbero.id,
+            'cita_pendiente': cita_pendiente.id,
+            'cita_completada': cita_completada.id,
+            'trabajo': trabajo.id,
+            'plan': plan.id,
+            'tipo_exportacion': TrabajoExportacion.Tipo.CITAS_CSV,
+            'token_agenda': agenda_ical.token_suscripcion(barbero),
+            'token_confirmacion': firmar(f'cita:{cita_pendiente.id}:confirmar'),
+        }
+        cls.valores = {
+            'sucursal': barbero.sucursal_principal_id,
+            'slot_libre': timezone.localtime(_en(2, 18)).strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+
+    def _url(self, ruta, objetos):
+        def valor(coincidencia):
+            parametro = coincidencia.group(1)
+            return str(self.objetos[objetos.get(parametro, OBJETO_POR_PARAMETRO.get(parametro))])
+        return PARAMETRO.sub(valor, ruta)
+
+    def _medir(self, ruta, entrada):
+        """Visita la ruta con su rol y deshace lo que haya escrito. Devuelve (respuesta, consultas)"""
+        url = self._url(ruta, entrada['objetos'])
+        datos = {clave: valor.format(**self.valores) for clave, valor in entrada['datos'].items()}
+        usuario = self.usuarios.get(entrada['rol'])
+        with transaction.atomic():
+            cache.clear()
+            self.client.logout()
+            if usuario:
+                self.client.force_login(usuario)
+                resolver_tenant(usuario)
+            # Los efectos tras el COMMIT (on_commit) también cuentan
+            with CaptureQueriesContext(connection) as consultas, self.captureOnCommitCallbacks(execute=True):
+                respuesta = getattr(self.client, entrada['metodo'])(url, datos)
+                if respuesta.streaming:
+                    b''.join(respuesta.streaming_content)
+            transaction.set_rollback(True)
+        return respuesta, consultas
+
+    def test_todas_las_rutas_tienen_presupuesto(self):
+        self.assertEqual(set(rutas()), set(PRESUPUESTOS) | set(SIN_MEDIR))
+
+    @mock.patch('celery.app.task.Task.apply_async')
+    def test_consultas_dentro_del_presupuesto(self, _):
+        for ruta, entradas in PRESUPUESTOS.items():
+            for entrada in entradas if isinstance(entradas, list) else [entradas]:
+                with self.subTest(ruta=ruta, metodo=entrada['metodo']):
+                    respuesta, consultas = self._medir(ruta, entrada)
+                    self.assertEqual(respuesta.status_code, entrada['estado'], ruta)
+                    self.assertLessEqual(
+                        len(consultas), entrada['consultas'],
+                        '\n'.join([f'{ruta}: {len(consultas)} consultas'] + [q['sql'] for q in consultas.captured_queries])
+                    )
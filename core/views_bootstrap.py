@@ -111,7 +111,7 @@ def bootstrap_init(request):
                 rol=User.Roles.ADMIN_BARBERIA
             )
             
-            admin.nosotros = nos      # ← VITAL
+            admin.barberia = barberia      # ← VITAL: así se resuelve su tenant
             admin.save()
             mensajes.append(f"✔ Admin creado para {nos.nombre}")
         else:
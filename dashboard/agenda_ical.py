@@ -0,0 +1,98 @@
+"""
+HU37: Feed iCal de la agenda del barbero para suscripción.
+
+Los calendarios (Google, Apple, Outlook) consultan el feed cada pocos
+minutos. En vez de reconstruir el Calendar en cada consulta se calcula un
+sello barato de la ventana: el nombre del barbero más, por cita, id,
+actualizada_en y los textos que salen en el evento (servicio, cliente,
+nombre y dirección de la sucursal), leídos en una sola consulta sobre el
+índice barbero + fecha_hora y resumidos en un hash:
+
+- si coincide con If-None-Match se responde 304 sin más consultas;
+- si coincide con el guardado en caché se sirve el .ics cacheado;
+- si no, se reconstruye y se guarda en la caché del barbero.
+
+El feed se puede abrir con un token firmado en la URL, sin sesión. El
+token lleva la versión del enlace del barbero (Barbero.version_enlace_ical):
+regenerarlo invalida los anteriores, y el de un barbero desactivado deja
+de servir el feed.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import F
+
+from core.models import Barbero
+from scheduling.models import Cita
+from .exportacion import ESTADOS_AGENDA, calendario_agenda, citas_agenda
+
+DIAS_AGENDA = 30
+CACHE_AGENDA_SEG = 24 * 60 * 60
+SALT_SUSCRIPCION = "barberflow-agenda-ical"
+
+
+def _clave(barbero_id):
+    return f"agenda_ical:{barbero_id}"
+
+
+def sello(barbero, desde):
+    """ETag de la agenda: cambia con cualquier alta, baja o edición que se vea en el feed"""
+    filas = Cita.objects.filter(
+        barbero_id=barbero.id,
+        fecha_hora__gte=desde,
+        fecha_hora__lte=desde + timedelta(days=DIAS_AGENDA),
+        estado__in=ESTADOS_AGENDA
+    ).order_by('id').values_list(
+        'id', 'actualizada_en', 'servicio__nombre', 'servicio__duracion_minutos',
+        'cliente__nombre', 'sucursal__nombre', 'sucursal__direccion',
+    )
+    huella = hashlib.sha1(f"{barbero.id}:{barbero.nombre}".encode('utf-8'))
+    for fila in filas:
+        huella.update(repr(fila).encode('utf-8'))
+    return '"' + huella.hexdigest() + '"'
+
+
+def coincide(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidatos = [valor.strip() for valor in if_none_match.split(',')]
+    return '*' in candidatos or etag in candidatos or f'W/{etag}' in candidatos
+
+
+def contenido(barbero, etag, desde):
+    """Bytes del .ics para ese sello, desde la caché del barbero si está al día"""
+    guardado = cache.get(_clave(barbero.id))
+    if guardado and guardado[0] == etag:
+        return guardado[1]
+
+    ical = calendario_agenda(barbero, citas_agenda(barbero, desde, DIAS_AGENDA)).to_ical()
+    cache.set(_clave(barbero.id), (etag, ical), CACHE_AGENDA_SEG)
+    return ical
+
+
+def token_suscripcion(barbero):
+    return signing.dumps({'barbero': barbero.id, 'version': barbero.version_enlace_ical}, salt=SALT_SUSCRIPCION)
+
+
+def barbero_de_token(token):
+    """
+    Barbero activo del token, o None si la firma no es válida o el enlace
+    se regeneró. Los tokens sin versión son de la versión 1.
+    """
+    try:
+        datos = signing.loads(token, salt=SALT_SUSCRIPCION)
+    except signing.BadSignature:
+        return None
+    return Barbero.objects.filter(
+        id=datos.get('barbero'),
+        version_enlace_ical=datos.get('version', 1),
+        activo=True
+    ).first()
+
+
+def regenerar_enlace(barbero):
+    """Cambia la versión del enlace: los tokens emitidos hasta ahora dejan de valer"""
+    Barbero.objects.filter(id=barbero.id).update(version_enlace_ical=F('version_enlace_ical') + 1)
+    barbero.refresh_from_db(fields=['version_enlace_ical'])
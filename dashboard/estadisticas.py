@@ -0,0 +1,65 @@
+"""
+HU48: Estadísticas del panel del cliente.
+
+Los KPIs escalares salen de una sola agregación condicional sobre las
+citas del cliente y los favoritos de una consulta agrupada por
+(barbero, servicio). El resultado queda en caché por cliente y se borra
+tras el COMMIT de cualquier cambio en sus citas (ver dashboard/signals.py).
+"""
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from scheduling.models import Cita
+
+ESTADISTICAS_TTL_SEG = 60 * 60
+
+
+def _clave(cliente_id):
+    return f"estadisticas:cliente:{cliente_id}"
+
+
+def _favorito(conteo):
+    """Nombre con más citas; en empate, el primero alfabéticamente"""
+    if not conteo:
+        return None
+    return min(conteo.items(), key=lambda par: (-par[1], par[0]))[0]
+
+
+def estadisticas_cliente(cliente_id):
+    """
+    {'total_citas', 'completadas', 'gasto_total', 'barbero_favorito',
+    'servicio_favorito'}; los favoritos son None si no hay completadas.
+    """
+    clave = _clave(cliente_id)
+    estadisticas = cache.get(clave)
+    if estadisticas is not None:
+        return estadisticas
+
+    completada = Q(estado=Cita.Estado.COMPLETADA)
+    estadisticas = Cita.objects.filter(cliente_id=cliente_id).aggregate(
+        total_citas=Count('id'),
+        completadas=Count('id', filter=completada),
+        gasto_total=Sum('precio', filter=completada),
+    )
+    estadisticas['gasto_total'] = estadisticas['gasto_total'] or 0
+
+    barberos, servicios = Counter(), Counter()
+    pares = Cita.objects.filter(completada, cliente_id=cliente_id).values_list(
+        'barbero__nombre', 'servicio__nombre'
+    ).annotate(total=Count('id')).order_by()
+    for barbero, servicio, total in pares:
+        barberos[barbero] += total
+        servicios[servicio] += total
+    estadisticas['barbero_favorito'] = _favorito(barberos)
+    estadisticas['servicio_favorito'] = _favorito(servicios)
+
+    cache.set(clave, estadisticas, ESTADISTICAS_TTL_SEG)
+    return estadisticas
+
+
+def invalidar_estadisticas_cliente(*cliente_ids):
+    claves = [_clave(cliente_id) for cliente_id in set(cliente_ids)]
+    transaction.on_commit(lambda: cache.delete_many(claves))
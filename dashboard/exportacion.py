@@ -0,0 +1,129 @@
+"""
+HU14 / HU37: Contenido de las exportaciones (citas, ingresos y agenda).
+
+Las filas de citas salen de un values_list recorrido con
+.iterator(chunk_size), sin instanciar modelos ni guardar el resultado
+completo: la memoria depende del tamaño del bloque y no de la historia
+del tenant. El CSV se escribe por bloques de filas para no emitir un
+chunk por línea. Lo usan tanto las vistas en streaming como los trabajos
+en segundo plano (ver trabajos.py).
+"""
+import csv
+import io
+from datetime import timedelta
+
+from django.db.models import Sum
+from icalendar import Calendar, Event
+
+from analytics.models import ResumenDiarioCitas
+from scheduling.models import Cita
+
+BOM = '\ufeff'  # para que Excel abra el archivo como UTF-8
+TAMANO_CHUNK = 2000
+FILAS_POR_BLOQUE = 500
+
+COLUMNAS_CITAS = ['ID', 'Fecha', 'Hora', 'Cliente', 'Barbero', 'Servicio', 'Sucursal', 'Estado', 'Precio']
+COLUMNAS_INGRESOS = ['Servicio', 'Cantidad', 'Ingresos']
+ESTADOS_AGENDA = [Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA]
+
+
+def citas_a_exportar(nosotros, desde=None, hasta=None):
+    citas = Cita.objects.filter(barbero__nosotros=nosotros).order_by('-fecha_hora')
+    if desde:
+        citas = citas.filter(fecha_hora__date__gte=desde)
+    if hasta:
+        citas = citas.filter(fecha_hora__date__lte=hasta)
+    return citas
+
+
+def filas_citas(citas, chunk_size=TAMANO_CHUNK):
+    """Encabezado y una fila por cita, leídas por bloques de `chunk_size`"""
+    estados = dict(Cita.Estado.choices)
+    yield COLUMNAS_CITAS
+    filas = citas.values_list(
+        'id',
+        'fecha_hora',
+        'cliente__nombre',
+        'barbero__nombre',
+        'servicio__nombre',
+        'sucursal__nombre',
+        'estado',
+        'precio',
+    ).iterator(chunk_size=chunk_size)
+    for id_, fecha_hora, cliente, barbero, servicio, sucursal, estado, precio in filas:
+        yield [
+            id_,
+            fecha_hora.date(),
+            fecha_hora.time(),
+            cliente,
+            barbero,
+            servicio,
+            sucursal,
+            estados.get(estado, estado),
+            precio,
+        ]
+
+
+def lineas_csv(filas, filas_por_bloque=FILAS_POR_BLOQUE):
+    """Texto CSV (con BOM) en bloques de `filas_por_bloque` filas"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    yield BOM
+    for numero, fila in enumerate(filas, 1):
+        writer.writerow(fila)
+        if numero % filas_por_bloque == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def ingresos_por_servicio(nosotros, desde=None, hasta=None):
+    """Citas completadas e ingresos por servicio, desde el resumen diario"""
+    resumenes = ResumenDiarioCitas.objects.filter(
+        nosotros=nosotros,
+        estado=Cita.Estado.COMPLETADA
+    )
+    if desde:
+        resumenes = resumenes.filter(fecha__gte=desde)
+    if hasta:
+        resumenes = resumenes.filter(fecha__lte=hasta)
+    return resumenes.values('servicio__nombre').annotate(
+        cantidad=Sum('cantidad'),
+        total=Sum('ingresos')
+    ).order_by('-total')
+
+
+def filas_ingresos(resumen):
+    yield COLUMNAS_INGRESOS
+    for r in resumen:
+        yield [r['servicio__nombre'], r['cantidad'], r['total']]
+
+
+def citas_agenda(barbero, desde, dias=30):
+    return Cita.objects.filter(
+        barbero=barbero,
+        fecha_hora__gte=desde,
+        fecha_hora__lte=desde + timedelta(days=dias),
+        estado__in=ESTADOS_AGENDA
+    ).select_related('cliente', 'servicio', 'sucursal')
+
+
+def calendario_agenda(barbero, citas):
+    """HU37: calendario iCal con un evento por cita"""
+    cal = Calendar()
+    cal.add('prodid', '-//BarberFlow//ES')
+    cal.add('version', '2.0')
+    cal.add('x-wr-calname', f'Agenda {barbero.nombre}')
+
+    for cita in citas:
+        event = Event()
+        event.add('summary', f'{cita.servicio.nombre} - {cita.cliente.nombre}')
+        event.add('dtstart', cita.fecha_hora)
+        event.add('dtend', cita.fecha_hora + timedelta(minutes=cita.servicio.duracion_minutos))
+        event.add('location', f'{cita.sucursal.nombre}, {cita.sucursal.direccion}')
+        event.add('uid', f'cita-{cita.id}@barberflow.com')
+        event.add('status', 'CONFIRMED')
+        cal.add_component(event)
+    return cal
@@ -0,0 +1,128 @@
+import csv
+import io
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Barberia, Barbero, Nosotros, Servicio, Sucursal, User
+from dashboard.exportacion import BOM, citas_a_exportar, filas_citas, lineas_csv
+from scheduling.models import Cita
+
+
+class Command(BaseCommand):
+    help = 'HU14: Mide memoria y tiempo de la exportación de citas a CSV con datos sintéticos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--filas',
+            type=int,
+            default=500_000,
+            help='Citas sintéticas a exportar',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Filas por lectura del cursor',
+        )
+        parser.add_argument(
+            '--comparar',
+            action='store_true',
+            help='Mide también la exportación anterior (instancias y buffer completo)',
+        )
+        parser.add_argument(
+            '--conservar',
+            action='store_true',
+            help='Deja las citas sintéticas en la base (por defecto se revierten)',
+        )
+
+    def crear_datos(self, filas):
+        """Tenant con un barbero y `filas` citas repartidas hacia atrás en el tiempo"""
+        sufijo = timezone.now().strftime('%Y%m%d%H%M%S')
+        nosotros = Nosotros.objects.create(nombre=f'Benchmark {sufijo}')
+        barberia = Barberia.objects.create(nosotros=nosotros, nombre='Benchmark')
+        sucursal = Sucursal.objects.create(barberia=barberia, nombre='Centro', direccion='Benchmark 123')
+        servicio = Servicio.objects.create(barberia=barberia, nombre='Corte', precio=Decimal('10000'), duracion_minutos=30)
+        user = User.objects.create_user(
+            email=f'barbero.{sufijo}@benchmark.test', password=None, nombre='Barbero', rol=User.Roles.BARBERO
+        )
+        barbero = Barbero.objects.create(nosotros=nosotros, user=user, nombre='Barbero', sucursal_principal=sucursal)
+        cliente = User.objects.create_user(email=f'cliente.{sufijo}@benchmark.test', password=None, nombre='Cliente')
+
+        inicio = timezone.now() - timedelta(minutes=30 * filas)
+        duracion = timedelta(minutes=servicio.duracion_minutos)
+        estados = [Cita.Estado.COMPLETADA, Cita.Estado.COMPLETADA, Cita.Estado.NO_SHOW, Cita.Estado.CANCELADA_CLIENTE]
+        lote = []
+        for i in range(filas):
+            fecha_hora = inicio + timedelta(minutes=30 * i)
+            lote.append(Cita(
+                cliente=cliente, barbero=barbero, sucursal=sucursal, servicio=servicio,
+                fecha_hora=fecha_hora, fecha_hora_fin=fecha_hora + duracion,
+                estado=estados[i % len(estados)], precio=servicio.precio,
+            ))
+            if len(lote) == 5000:
+                Cita.objects.bulk_create(lote)
+                lote = []
+        Cita.objects.bulk_create(lote)
+        return nosotros
+
+    def medir(self, nombre, exportar):
+        tracemalloc.start()
+        inicio = time.monotonic()
+        bytes_, filas = exportar()
+        segundos = time.monotonic() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(
+            f'  • {nombre}: {filas} filas, {bytes_ / 1024 / 1024:.1f} MB de CSV, '
+            f'pico {pico / 1024 / 1024:.1f} MB, {segundos:.2f}s'
+        )
+
+    def exportar_streaming(self, nosotros, chunk_size):
+        def exportar():
+            bytes_ = filas = 0
+            for bloque in lineas_csv(filas_citas(citas_a_exportar(nosotros), chunk_size=chunk_size)):
+                bytes_ += len(bloque.encode('utf-8'))
+                filas += bloque.count('\n')
+            return bytes_, filas - 1
+        return exportar
+
+    def exportar_buffer(self, nosotros):
+        """Versión anterior: instancias con select_related y todo el CSV en memoria"""
+        def exportar():
+            buffer = io.StringIO()
+            buffer.write(BOM)
+            writer = csv.writer(buffer)
+            citas = citas_a_exportar(nosotros).select_related('cliente', 'barbero', 'servicio', 'sucursal')
+            filas = 0
+            for c in citas:
+                writer.writerow([
+                    c.id, c.fecha_hora.date(), c.fecha_hora.time(), c.cliente.nombre, c.barbero.nombre,
+                    c.servicio.nombre, c.sucursal.nombre, c.get_estado_display(), c.precio,
+                ])
+                filas += 1
+            return len(buffer.getvalue().encode('utf-8')), filas
+        return exportar
+
+    def handle(self, *args, **options):
+        filas = options['filas']
+        with transaction.atomic():
+            inicio = time.monotonic()
+            nosotros = self.crear_datos(filas)
+            self.stdout.write(f'Datos sintéticos: {filas} citas en {time.monotonic() - inicio:.1f}s')
+
+            self.stdout.write('Exportación:')
+            self.medir(
+                f'streaming (chunk_size={options["chunk_size"]})',
+                self.exportar_streaming(nosotros, options['chunk_size'])
+            )
+            if options['comparar']:
+                self.medir('buffer completo', self.exportar_buffer(nosotros))
+
+            if not options['conservar']:
+                transaction.set_rollback(True)
@@ -0,0 +1,69 @@
+"""
+HU43: Métricas por barbero.
+
+Todas las métricas de citas salen de una única consulta agrupada por
+barbero con agregados condicionales sobre el resumen diario
+(analytics.ResumenDiarioCitas), y las valoraciones de otra. El costo
+depende de los días del rango, no de la cantidad de citas.
+"""
+from datetime import date
+
+from django.db.models import Avg, Q, Sum
+
+from analytics.models import ResumenDiarioCitas
+from scheduling.models import Cita, Valoracion
+
+CANCELADAS = [Cita.Estado.CANCELADA_CLIENTE, Cita.Estado.CANCELADA_ADMIN]
+
+
+def leer_fecha(valor, por_defecto):
+    """Fecha de un parámetro GET (YYYY-MM-DD); la por defecto si no es válida"""
+    if isinstance(valor, date):
+        return valor
+    try:
+        return date.fromisoformat(valor)
+    except (TypeError, ValueError):
+        return por_defecto
+
+
+def metricas_barberos(barberos, desde, hasta):
+    """Una fila de métricas por barbero, en el orden de `barberos`"""
+    barberos = list(barberos)
+    completada = Q(estado=Cita.Estado.COMPLETADA)
+
+    por_barbero = {
+        fila['barbero']: fila
+        for fila in ResumenDiarioCitas.objects.filter(
+            barbero__in=barberos,
+            fecha__gte=desde,
+            fecha__lte=hasta
+        ).values('barbero').annotate(
+            total=Sum('cantidad'),
+            completadas=Sum('cantidad', filter=completada),
+            canceladas=Sum('cantidad', filter=Q(estado__in=CANCELADAS)),
+            no_shows=Sum('cantidad', filter=Q(estado=Cita.Estado.NO_SHOW)),
+            ingresos=Sum('ingresos', filter=completada),
+        ).order_by()
+    }
+    valoraciones = dict(
+        Valoracion.objects.filter(barbero__in=barberos).values('barbero').annotate(
+            promedio=Avg('puntuacion')
+        ).order_by().values_list('barbero', 'promedio')
+    )
+
+    estadisticas = []
+    for barbero in barberos:
+        fila = por_barbero.get(barbero.id, {})
+        total = fila.get('total') or 0
+        completadas = fila.get('completadas') or 0
+        estadisticas.append({
+            'barbero': barbero,
+            'total_citas': total,
+            'completadas': completadas,
+            'canceladas': fila.get('canceladas') or 0,
+            'no_shows': fila.get('no_shows') or 0,
+            'tasa_completado': int((completadas/total*100)) if total else 0,
+            'ingresos': fila.get('ingresos') or 0,
+            'valoracion': round(valoraciones.get(barbero.id) or 0, 1)
+        })
+    return estadisticas
@@ -0,0 +1,47 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('core', '0012_saldopuntos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoExportacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('citas_csv', 'Citas (CSV)'), ('ingresos_csv', 'Ingresos por servicio (CSV)'), ('agenda_ical', 'Agenda (iCal)')], max_length=20)),
+                ('formato', models.CharField(choices=[('plano', 'Sin comprimir'), ('gzip', 'Comprimido (gzip)')], default='plano', max_length=10)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('huella', models.CharField(max_length=64)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('completado', 'Completado'), ('fallido', 'Fallido')], default='pendiente', max_length=20)),
+                ('total', models.PositiveIntegerField(default=0, help_text='Filas a exportar')),
+                ('procesadas', models.PositiveIntegerField(default=0)),
+                ('archivo', models.CharField(blank=True, help_text='Ruta dentro de EXPORTACIONES_ROOT', max_length=255)),
+                ('tamano_bytes', models.PositiveBigIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('iniciado_en', models.DateTimeField(blank=True, null=True)),
+                ('terminado_en', models.DateTimeField(blank=True, null=True)),
+                ('barbero', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='exportaciones', to='core.barbero')),
+                ('nosotros', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exportaciones', to='core.nosotros')),
+                ('solicitante', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exportaciones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Trabajo de exportación',
+                'verbose_name_plural': 'Trabajos de exportación',
+                'ordering': ['-creado_en'],
+                'indexes': [models.Index(fields=['huella', 'creado_en'], name='dashboard_t_huella_12bfcf_idx'), models.Index(fields=['solicitante', 'creado_en'], name='dashboard_t_solicit_58e1d7_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('estado__in', ['pendiente', 'en_proceso'])), fields=('huella',), name='exportacion_activa_unica_por_huella')],
+            },
+        ),
+    ]
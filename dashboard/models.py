@@ -1,3 +1,86 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+from core.models import Barbero, Nosotros
+
+
+class TrabajoExportacion(models.Model):
+    """
+    HU14 / HU37: Exportación generada en segundo plano (ver trabajos.py).
+
+    `huella` identifica la petición (tipo, formato, tenant, barbero y
+    parámetros): una petición idéntica dentro de la ventana de
+    deduplicación reutiliza el trabajo en vez de crear otro. Solo puede
+    haber un trabajo pendiente o en proceso por huella, lo que resuelve
+    dos peticiones simultáneas en la base de datos.
+    """
+
+    class Tipo(models.TextChoices):
+        CITAS_CSV = "citas_csv", "Citas (CSV)"
+        INGRESOS_CSV = "ingresos_csv", "Ingresos por servicio (CSV)"
+        AGENDA_ICAL = "agenda_ical", "Agenda (iCal)"
+
+    class Formato(models.TextChoices):
+        PLANO = "plano", "Sin comprimir"
+        GZIP = "gzip", "Comprimido (gzip)"
+
+    class Estado(models.TextChoices):
+        PENDIENTE = "pendiente", "Pendiente"
+        EN_PROCESO = "en_proceso", "En proceso"
+        COMPLETADO = "completado", "Completado"
+        FALLIDO = "fallido", "Fallido"
+
+    solicitante = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="exportaciones")
+    nosotros = models.ForeignKey(Nosotros, on_delete=models.CASCADE, related_name="exportaciones")
+    barbero = models.ForeignKey(Barbero, on_delete=models.CASCADE, null=True, blank=True, related_name="exportaciones")
+    tipo = models.CharField(max_length=20, choices=Tipo.choices)
+    formato = models.CharField(max_length=10, choices=Formato.choices, default=Formato.PLANO)
+    parametros = models.JSONField(default=dict, blank=True)
+    huella = models.CharField(max_length=64)
+    estado = models.CharField(max_length=20, choices=Estado.choices, default=Estado.PENDIENTE)
+    total = models.PositiveIntegerField(default=0, help_text="Filas a exportar")
+    procesadas = models.PositiveIntegerField(default=0)
+    archivo = models.CharField(max_length=255, blank=True, help_text="Ruta dentro de EXPORTACIONES_ROOT")
+    tamano_bytes = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    iniciado_en = models.DateTimeField(null=True, blank=True)
+    terminado_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-creado_en"]
+        verbose_name = "Trabajo de exportación"
+        verbose_name_plural = "Trabajos de exportación"
+        indexes = [
+            models.Index(fields=["huella", "creado_en"]),
+            models.Index(fields=["solicitante", "creado_en"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["huella"],
+                condition=models.Q(estado__in=["pendiente", "en_proceso"]),
+                name="exportacion_activa_unica_por_huella",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} #{self.id} ({self.get_estado_display()})"
+
+    @property
+    def progreso(self):
+        if self.estado == self.Estado.COMPLETADO:
+            return 100
+        if not self.total:
+            return 0
+        return min(int(self.procesadas * 100 / self.total), 99)
+
+    @property
+    def extension(self):
+        extension = "ics" if self.tipo == self.Tipo.AGENDA_ICAL else "csv"
+        if self.formato == self.Formato.GZIP:
+            extension += ".gz"
+        return extension
+
+    @property
+    def nombre_descarga(self):
+        return f"{self.tipo}_{self.creado_en:%Y%m%d}_{self.id}.{self.extension}"
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from scheduling.models import Cita
+from scheduling.signals import citas_actualizadas_en_bloque
+from .estadisticas import invalidar_estadisticas_cliente
+
+
+@receiver(post_save, sender=Cita)
+@receiver(post_delete, sender=Cita)
+def invalidar_estadisticas_cita(sender, instance, **kwargs):
+    """HU48: Cualquier cambio en una cita recalcula el panel de su cliente"""
+    invalidar_estadisticas_cliente(instance.cliente_id)
+
+
+@receiver(citas_actualizadas_en_bloque, sender=Cita)
+def invalidar_estadisticas_en_bloque(sender, ids, **kwargs):
+    clientes = Cita.objects.filter(id__in=ids).values_list('cliente_id', flat=True).distinct()
+    invalidar_estadisticas_cliente(*clientes)
@@ -0,0 +1,23 @@
+from celery import shared_task
+
+from . import trabajos
+
+
+@shared_task
+def generar_exportacion(trabajo_id):
+    """HU14 / HU37: genera el archivo de un TrabajoExportacion"""
+    nombre = trabajos.ejecutar(trabajo_id)
+    return f"exportacion={trabajo_id} archivo={nombre or '-'}"
+
+
+@shared_task
+def limpiar_exportaciones(dias=trabajos.RETENCION_DIAS):
+    borrados = trabajos.limpiar(dias)
+    return f"exportaciones_borradas={borrados}"
+
+
+@shared_task
+def reencolar_exportaciones():
+    """Reencola las exportaciones que se quedaron sin worker (broker caído o worker muerto)"""
+    encolados = trabajos.reencolar_atascados()
+    return f"exportaciones_reencoladas={encolados}"
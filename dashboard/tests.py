@@ -1,3 +1,508 @@
-from django.test import TestCase
+import gzip
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from analytics.tasks import recalcular_resumen_diario
+from core.models import Barberia, Barbero, Licencia, Nosotros, Plan, Servicio, Sucursal, User
+from dashboard import agenda_ical, trabajos
+from dashboard.models import TrabajoExportacion
+from scheduling.models import Cita
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PanelBaseTestCase(TestCase):
+    """
+    Barbería con dos barberos, dos servicios y un cliente. El recálculo del
+    resumen diario corre en línea en vez de ir al broker.
+    """
+
+    def setUp(self):
+        cache.clear()
+        parche = mock.patch.object(
+            recalcular_resumen_diario, 'apply_async',
+            side_effect=lambda args, countdown: recalcular_resumen_diario(*args),
+        )
+        parche.start()
+        self.addCleanup(parche.stop)
+        nosotros = Nosotros.objects.create(nombre='N')
+        Licencia.objects.create(
+            nosotros=nosotros,
+            plan=Plan.objects.create(nombre=Plan.TipoPlan.PROFESIONAL, precio=0),
+            fecha_inicio=timezone.localdate(),
+            fecha_expiracion=timezone.localdate() + timedelta(days=30),
+        )
+        barberia = Barberia.objects.create(nosotros=nosotros, nombre='B')
+        self.sucursal = Sucursal.objects.create(barberia=barberia, nombre='S', direccion='D')
+        self.corte = Servicio.objects.create(barberia=barberia, nombre='Corte', precio=100, duracion_minutos=30)
+        self.barba = Servicio.objects.create(barberia=barberia, nombre='Barba', precio=50, duracion_minutos=30)
+        self.barberos = []
+        for nombre in ('Ana', 'Beto'):
+            user = User.objects.create_user(email=f'{nombre}@test.com', password='x', nombre=nombre, rol=User.Roles.BARBERO)
+            self.barberos.append(Barbero.objects.create(nosotros=nosotros, user=user, nombre=nombre, sucursal_principal=self.sucursal))
+        self.cliente = User.objects.create_user(email='c@test.com', password='x', nombre='C')
+
+    def _cita(self, barbero, servicio, estado, dias=-1):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Cita.objects.create(
+                cliente=self.cliente, barbero=barbero, sucursal=self.sucursal, servicio=servicio,
+                fecha_hora=timezone.now() + timedelta(days=dias), precio=servicio.precio, estado=estado,
+            )
+
+
+class EstadisticasClienteTest(PanelBaseTestCase):
+    """HU48: KPIs del panel del cliente en dos consultas y cacheados"""
+
+    def test_kpis_y_favoritos(self):
+        from dashboard.estadisticas import estadisticas_cliente
+        ana, beto = self.barberos
+        self._cita(ana, self.corte, Cita.Estado.COMPLETADA)
+        self._cita(beto, self.barba, Cita.Estado.COMPLETADA)
+        self._cita(beto, self.corte, Cita.Estado.COMPLETADA)
+        self._cita(ana, self.corte, Cita.Estado.PENDIENTE, dias=3)
+
+        with self.assertNumQueries(2):
+            estadisticas = estadisticas_cliente(self.cliente.id)
+        self.assertEqual(estadisticas, {
+            'total_citas': 4,
+            'completadas': 3,
+            'gasto_total': 250,
+            'barbero_favorito': 'Beto',
+            'servicio_favorito': 'Corte',
+        })
+        with self.assertNumQueries(0):
+            estadisticas_cliente(self.cliente.id)
+
+    def test_cambio_de_cita_refresca_el_panel(self):
+        from dashboard.estadisticas import estadisticas_cliente
+        cita = self._cita(self.barberos[0], self.corte, Cita.Estado.CONFIRMADA)
+        self.assertEqual(estadisticas_cliente(self.cliente.id)['completadas'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.estado = Cita.Estado.COMPLETADA
+            cita.save()
+        self.assertEqual(estadisticas_cliente(self.cliente.id)['completadas'], 1)
+
+
+class MetricasBarberosTest(PanelBaseTestCase):
+    """HU43: métricas de todos los barberos en dos consultas"""
+
+    def test_metricas_en_dos_consultas(self):
+        from dashboard.metricas import metricas_barberos
+        from scheduling.models import Valoracion
+        ana, beto = self.barberos
+        completada = self._cita(ana, self.corte, Cita.Estado.COMPLETADA)
+        self._cita(ana, self.barba, Cita.Estado.COMPLETADA)
+        self._cita(ana, self.corte, Cita.Estado.NO_SHOW)
+        self._cita(beto, self.corte, Cita.Estado.CANCELADA_CLIENTE)
+        self._cita(beto, self.corte, Cita.Estado.COMPLETADA, dias=-40)
+        Valoracion.objects.create(cita=completada, cliente=self.cliente, barbero=ana, puntuacion=4)
+
+        hoy = timezone.localdate()
+        with self.assertNumQueries(2):
+            filas = metricas_barberos(self.barberos, hoy - timedelta(days=30), hoy)
+        self.assertEqual(
+            [(f['total_citas'], f['completadas'], f['canceladas'], f['no_shows'], f['ingresos'], f['valoracion']) for f in filas],
+            [(3, 2, 0, 1, 150, 4.0), (1, 0, 1, 0, 0, 0)]
+        )
+        self.assertEqual(filas[0]['tasa_completado'], 66)
+
+
+class PanelAdminOcupacionTest(PanelBaseTestCase):
+    """Ocupación del panel de administración a partir de horarios y citas"""
+
+    def test_ocupacion_y_mapa_de_calor(self):
+        from datetime import datetime, time
+
+        from core.models import HorarioDisponibilidad
+        ana, _ = self.barberos
+        for dia in range(7):
+            HorarioDisponibilidad.objects.create(barbero=ana, dia_semana=dia, hora_inicio=time(9), hora_fin=time(13))
+        ayer = timezone.localdate() - timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Cita.objects.create(
+                cliente=self.cliente, barbero=ana, sucursal=self.sucursal, servicio=self.corte,
+                fecha_hora=timezone.make_aware(datetime.combine(ayer, time(10))),
+                precio=self.corte.precio, estado=Cita.Estado.COMPLETADA,
+            )
+            # Reservada hoy pero para la semana que viene: no entra en los KPIs
+            Cita.objects.create(
+                cliente=self.cliente, barbero=ana, sucursal=self.sucursal, servicio=self.corte,
+                fecha_hora=timezone.make_aware(datetime.combine(ayer + timedelta(days=8), time(10))),
+                precio=self.corte.precio,
+            )
+        admin = User.objects.create_user(
+            email='admin@test.com', password='x', nombre='Admin',
+            rol=User.Roles.ADMIN_BARBERIA, barberia=self.sucursal.barberia,
+        )
+        self.client.force_login(admin)
+
+        respuesta = self.client.get(reverse('panel_admin_barberia'))
+        self.assertEqual(respuesta.status_code, 200)
+        # 30 minutos reservados de 7 × 240 disponibles
+        self.assertEqual(respuesta.context['kpi']['ocupacion'], 1)
+        self.assertEqual((respuesta.context['kpi']['completadas'], respuesta.context['kpi']['total_citas']), (1, 1))
+        mapa = respuesta.context['mapa_ocupacion']
+        self.assertEqual(mapa['horas'], [9, 10, 11, 12])
+        fila = dict(mapa['filas'])[HorarioDisponibilidad.DiaSemana(ayer.weekday()).label]
+        self.assertEqual(fila, [0, 50, 0, 0])
+
+
+class ReagendarCitaTest(PanelBaseTestCase):
+    """Reagendar desde el panel valida el solapamiento igual que una reserva"""
+
+    def test_reagendar_sobre_otra_cita_muestra_error(self):
+        ana, _ = self.barberos
+        ocupada = self._cita(ana, self.corte, Cita.Estado.CONFIRMADA, dias=2)
+        cita = self._cita(ana, self.corte, Cita.Estado.PENDIENTE, dias=3)
+        url = reverse('reagendar_cita', args=[cita.id])
+        original = cita.fecha_hora
+        destino = timezone.localtime(ocupada.fecha_hora + timedelta(minutes=15))
+
+        respuesta = self.client.post(url, {'fecha_hora': destino.strftime('%Y-%m-%dT%H:%M')})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.context['form'].has_error('fecha_hora'))
+        cita.refresh_from_db()
+        self.assertEqual(cita.fecha_hora, original)
+
+        libre = timezone.localtime(ocupada.fecha_hora + timedelta(hours=1))
+        respuesta = self.client.post(url, {'fecha_hora': libre.strftime('%Y-%m-%dT%H:%M')})
+        self.assertRedirects(respuesta, reverse('listar_citas_admin'), fetch_redirect_response=False)
+        cita.refresh_from_db()
+        self.assertEqual(cita.fecha_hora, libre.replace(second=0, microsecond=0))
+
+
+class SucursalEliminarTest(PanelBaseTestCase):
+    """Borrar una sucursal cuesta lo mismo con pocas o muchas citas"""
+
+    def _consultas_al_borrar(self, citas):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from core.models import Sucursal
+        sucursal = Sucursal.objects.create(barberia=self.sucursal.barberia, nombre=f'S{citas}')
+        for dia in range(citas):
+            Cita.objects.create(
+                cliente=self.cliente, barbero=self.barberos[dia % 2], sucursal=sucursal, servicio=self.corte,
+                fecha_hora=timezone.now() + timedelta(days=dia - citas // 2), precio=self.corte.precio,
+            )
+        with CaptureQueriesContext(connection) as consultas, self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post(reverse('sucursal_eliminar', args=[sucursal.id]))
+        self.assertRedirects(respuesta, reverse('panel_admin_barberia'), fetch_redirect_response=False)
+        self.assertFalse(Cita.objects.filter(sucursal_id=sucursal.id).exists())
+        return len(consultas)
+
+    def test_consultas_no_crecen_con_las_citas(self):
+        admin = User.objects.create_user(
+            email='admin@test.com', password='x', nombre='Admin',
+            rol=User.Roles.ADMIN_BARBERIA, barberia=self.sucursal.barberia,
+        )
+        self.client.force_login(admin)
+        self._consultas_al_borrar(1)  # resuelve y cachea el tenant
+        self.assertEqual(self._consultas_al_borrar(3), self._consultas_al_borrar(30))
+
+
+class ExportarCitasCsvTest(PanelBaseTestCase):
+    """HU14: el CSV de citas sale en streaming con BOM y las columnas de siempre"""
+
+    def test_csv_en_streaming(self):
+        ana, beto = self.barberos
+        self._cita(ana, self.corte, Cita.Estado.COMPLETADA, dias=-2)
+        reciente = self._cita(beto, self.barba, Cita.Estado.NO_SHOW)
+        admin = User.objects.create_user(
+            email='admin@test.com', password='x', nombre='Admin',
+            rol=User.Roles.ADMIN_BARBERIA, barberia=self.sucursal.barberia,
+        )
+        self.client.force_login(admin)
+
+        respuesta = self.client.get(reverse('exportar_citas'))
+        self.assertTrue(respuesta.streaming)
+        contenido = b''.join(respuesta.streaming_content).decode('utf-8')
+        self.assertTrue(contenido.startswith('\ufeff'))
+        lineas = contenido.lstrip('\ufeff').splitlines()
+        self.assertEqual(lineas[0], 'ID,Fecha,Hora,Cliente,Barbero,Servicio,Sucursal,Estado,Precio')
+        self.assertEqual(len(lineas), 3)
+        self.assertEqual(
+            lineas[1],
+            f'{reciente.id},{reciente.fecha_hora.date()},{reciente.fecha_hora.time()},C,Beto,Barba,S,No Show,50.00'
+        )
+
+
+class ExportacionSegundoPlanoTest(PanelBaseTestCase):
+    """HU14 / HU37: exportaciones encoladas, deduplicadas y notificadas"""
+
+    def setUp(self):
+        super().setUp()
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = override_settings(EXPORTACIONES_ROOT=directorio.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.admin = User.objects.create_user(
+            email='admin@test.com', password='x', nombre='Admin',
+            rol=User.Roles.ADMIN_BARBERIA, barberia=self.sucursal.barberia,
+        )
+
+    def _solicitar(self, tipo, **datos):
+        with mock.patch('dashboard.tasks.generar_exportacion.delay', side_effect=trabajos.ejecutar), \
+                mock.patch('dashboard.trabajos.enviar_notificacion') as notificar, \
+                self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post(reverse('solicitar_exportacion', args=[tipo]), datos)
+        self.assertRedirects(respuesta, reverse('mis_exportaciones'))
+        return notificar
+
+    def test_citas_csv_gzip_deduplicado_y_notificado(self):
+        ana, beto = self.barberos
+        self._cita(ana, self.corte, Cita.Estado.COMPLETADA, dias=-2)
+        self._cita(beto, self.barba, Cita.Estado.NO_SHOW)
+        self.client.force_login(self.admin)
+
+        notificar = self._solicitar('citas_csv', gzip='1')
+        trabajo = TrabajoExportacion.objects.get()
+        self.assertEqual(trabajo.estado, TrabajoExportacion.Estado.COMPLETADO)
+        self.assertEqual((trabajo.total, trabajo.procesadas, trabajo.progreso), (2, 2, 100))
+        notificar.assert_called_once()
+        self.assertEqual(notificar.call_args.args[:2], (self.admin.id, 'exportacion_lista'))
+
+        # La misma petición dentro de la ventana reutiliza el trabajo
+        notificar = self._solicitar('citas_csv', gzip='1')
+        self.assertEqual(TrabajoExportacion.objects.count(), 1)
+        notificar.assert_not_called()
+
+        respuesta = self.client.get(reverse('descargar_exportacion', args=[trabajo.id]))
+        contenido = gzip.decompress(b''.join(respuesta.streaming_content))
+        en_streaming = self.client.get(reverse('exportar_citas'))
+        self.assertEqual(contenido, b''.join(en_streaming.streaming_content))
+
+        estado = self.client.get(reverse('estado_exportacion', args=[trabajo.id])).json()
+        self.assertEqual(estado['estado'], TrabajoExportacion.Estado.COMPLETADO)
+
+    def test_broker_caido_y_barrido_de_atascados(self):
+        self.client.force_login(self.admin)
+        with mock.patch('dashboard.tasks.generar_exportacion.delay', side_effect=ConnectionError('broker caído')), \
+                self.assertLogs('dashboard.trabajos', 'WARNING'), \
+                self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post(reverse('solicitar_exportacion', args=['citas_csv']))
+        self.assertRedirects(respuesta, reverse('mis_exportaciones'))
+        trabajo = TrabajoExportacion.objects.get()
+        self.assertEqual(trabajo.estado, TrabajoExportacion.Estado.PENDIENTE)
+
+        # Recién creado no se toca; pasado el plazo se reencola y se genera
+        with mock.patch('dashboard.tasks.generar_exportacion.delay') as encolar:
+            self.assertEqual(trabajos.reencolar_atascados(), 0)
+        encolar.assert_not_called()
+        TrabajoExportacion.objects.filter(id=trabajo.id).update(
+            creado_en=timezone.now() - timedelta(seconds=trabajos.PLAZO_PENDIENTE_SEG + 1)
+        )
+        with mock.patch('dashboard.tasks.generar_exportacion.delay', side_effect=trabajos.ejecutar), \
+                mock.patch('dashboard.trabajos.enviar_notificacion'):
+            self.assertEqual(trabajos.reencolar_atascados(), 1)
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, TrabajoExportacion.Estado.COMPLETADO)
+
+        # Un worker muerto a mitad de trabajo también se recupera
+        TrabajoExportacion.objects.filter(id=trabajo.id).update(
+            estado=TrabajoExportacion.Estado.EN_PROCESO,
+            iniciado_en=timezone.now() - timedelta(seconds=trabajos.PLAZO_EN_PROCESO_SEG + 1),
+        )
+        with mock.patch('dashboard.tasks.generar_exportacion.delay') as encolar:
+            self.assertEqual(trabajos.reencolar_atascados(), 1)
+        encolar.assert_called_once_with(trabajo.id)
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, TrabajoExportacion.Estado.PENDIENTE)
+
+    def test_un_solo_trabajo_activo_por_huella(self):
+        # Fuera de la ventana la consulta previa no lo ve: la restricción decide
+        with mock.patch('dashboard.tasks.generar_exportacion.delay'), \
+                self.captureOnCommitCallbacks(execute=True):
+            primero, creado = trabajos.solicitar(self.admin, self.sucursal.barberia.nosotros, 'citas_csv')
+        self.assertTrue(creado)
+        TrabajoExportacion.objects.filter(id=primero.id).update(
+            creado_en=timezone.now() - timedelta(seconds=trabajos.DEDUPLICACION_SEG + 1)
+        )
+        with mock.patch('dashboard.tasks.generar_exportacion.delay') as encolar, \
+                self.captureOnCommitCallbacks(execute=True):
+            segundo, creado = trabajos.solicitar(self.admin, self.sucursal.barberia.nosotros, 'citas_csv')
+        self.assertEqual((segundo, creado), (primero, False))
+        encolar.assert_not_called()
+        self.assertEqual(TrabajoExportacion.objects.count(), 1)
+
+    def test_carrera_con_un_trabajo_ya_terminado_reintenta(self):
+        from django.db import IntegrityError
+        crear = TrabajoExportacion.objects.create
+        intentos = []
+
+        def crear_tras_perder_la_carrera(**campos):
+            # El ganador ya terminó: la restricción salta pero no queda activo
+            intentos.append(campos)
+            if len(intentos) == 1:
+                raise IntegrityError('exportacion_activa_unica_por_huella')
+            return crear(**campos)
+
+        with mock.patch.object(TrabajoExportacion.objects, 'create', side_effect=crear_tras_perder_la_carrera), \
+                mock.patch('dashboard.tasks.generar_exportacion.delay'), \
+                self.captureOnCommitCallbacks(execute=True):
+            trabajo, creado = trabajos.solicitar(self.admin, self.sucursal.barberia.nosotros, 'citas_csv')
+        self.assertTrue(creado)
+        self.assertEqual(len(intentos), 2)
+        self.assertEqual(list(TrabajoExportacion.objects.all()), [trabajo])
+
+    def test_agenda_ical_del_barbero(self):
+        ana, _ = self.barberos
+        self._cita(ana, self.corte, Cita.Estado.CONFIRMADA, dias=2)
+        self.client.force_login(ana.user)
+        self._solicitar('agenda_ical')
+
+        trabajo = TrabajoExportacion.objects.get()
+        self.assertEqual((trabajo.barbero, trabajo.total), (ana, 1))
+        respuesta = self.client.get(reverse('descargar_exportacion', args=[trabajo.id]))
+        self.assertIn(b'BEGIN:VEVENT', b''.join(respuesta.streaming_content))
+        # Otro usuario no puede descargarlo
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(reverse('descargar_exportacion', args=[trabajo.id])).status_code, 404)
+
+    def test_rol_incorrecto_no_encola(self):
+        self.client.force_login(self.admin)
+        respuesta = self.client.post(reverse('solicitar_exportacion', args=['agenda_ical']))
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertFalse(TrabajoExportacion.objects.exists())
+
+
+class AgendaIcalSuscripcionTest(PanelBaseTestCase):
+    """HU37: feed iCal por token, cacheado por barbero y con ETag"""
+
+    def setUp(self):
+        super().setUp()
+        self.ana = self.barberos[0]
+        self.url = reverse('agenda_ical_suscripcion', args=[agenda_ical.token_suscripcion(self.ana)])
+        self._cita(self.ana, self.corte, Cita.Estado.CONFIRMADA, dias=2)
+
+    def test_consultas_repetidas_cuestan_dos_consultas(self):
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.content.count(b'BEGIN:VEVENT'), 1)
+        etag = respuesta['ETag']
+
+        # El barbero del token y el sello
+        with self.assertNumQueries(2):
+            respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+        with self.assertNumQueries(2):
+            respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.content.count(b'BEGIN:VEVENT'), 1)
+
+        # Una cita nueva cambia el sello y el contenido
+        self._cita(self.ana, self.barba, Cita.Estado.PENDIENTE, dias=3)
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], etag)
+        self.assertEqual(respuesta.content.count(b'BEGIN:VEVENT'), 2)
+
+    def test_cancelar_cambia_el_sello(self):
+        etag = self.client.get(self.url)['ETag']
+        cita = Cita.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            Cita.objects.filter(id=cita.id).update(estado=Cita.Estado.CANCELADA_ADMIN)
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotIn(b'BEGIN:VEVENT', respuesta.content)
+
+    def test_renombrar_barbero_o_sucursal_cambia_el_sello(self):
+        etag = self.client.get(self.url)['ETag']
+        self.ana.nombre = 'Ana María'
+        self.ana.save()
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('Ana María', respuesta.content.decode('utf-8'))
+
+        etag = respuesta['ETag']
+        self.sucursal.direccion = 'Av. Siempre Viva 742'
+        self.sucursal.save()
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('Siempre Viva 742', respuesta.content.decode('utf-8'))
+
+    def test_token_invalido(self):
+        self.assertEqual(self.client.get(self.url.replace('/agenda.ics', 'x/agenda.ics')).status_code, 404)
+
+    def test_regenerar_enlace_invalida_el_anterior(self):
+        self.client.force_login(self.ana.user)
+        respuesta = self.client.post(reverse('regenerar_enlace_agenda'))
+        self.assertRedirects(respuesta, reverse('panel_barbero'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        self.ana.refresh_from_db()
+        nueva = reverse('agenda_ical_suscripcion', args=[agenda_ical.token_suscripcion(self.ana)])
+        self.assertNotEqual(nueva, self.url)
+        self.assertContains(self.client.get(reverse('panel_barbero')), nueva)
+        self.assertEqual(self.client.get(nueva).status_code, 200)
+
+    def test_barbero_desactivado_no_sirve_el_feed(self):
+        self.ana.activo = False
+        self.ana.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_panel_del_barbero_muestra_el_enlace(self):
+        self.client.force_login(self.ana.user)
+        respuesta = self.client.get(reverse('panel_barbero'))
+        self.assertContains(respuesta, self.url)
+        self.assertEqual(self.client.get(reverse('exportar_agenda')).status_code, 200)
+
+
+class ConsultasVistasTenantTest(PanelBaseTestCase):
+    """HU30: las vistas del admin resuelven el tenant una vez y no repiten consultas"""
+
+    # (vista, argumentos, consultas con el tenant en caché; incluye sesión y usuario)
+    VISTAS = [
+        ('panel_admin_barberia', [], 6),
+        ('listar_citas_admin', [], 4),
+        ('metricas_barberos', [], 5),
+        ('estadisticas_ingresos', [], 4),
+        ('sucursal_crear', [], 5),
+        ('sucursal_editar', ['sucursal'], 3),
+        ('barbero_crear', [], 4),
+        ('servicio_list', [], 4),
+        ('servicio_crear', [], 2),
+        ('servicio_editar', ['servicio'], 3),
+        ('servicio_eliminar', ['servicio'], 3),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self._cita(self.barberos[0], self.corte, Cita.Estado.COMPLETADA)
+        self.admin = User.objects.create_user(
+            email='admin@test.com', password='x', nombre='Admin',
+            rol=User.Roles.ADMIN_BARBERIA, barberia=self.sucursal.barberia,
+        )
+        self.client.force_login(self.admin)
+
+    def _url(self, nombre, args):
+        ids = {'sucursal': self.sucursal.id, 'servicio': self.corte.id}
+        return reverse(nombre, args=[ids[arg] for arg in args])
+
+    def test_consultas_por_vista(self):
+        for nombre, args, consultas in self.VISTAS:
+            url = self._url(nombre, args)
+            self.client.get(url)
+            with self.subTest(vista=nombre), self.assertNumQueries(consultas):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_tenant_resuelto_una_vez(self):
+        from core import tenancy
+        with mock.patch.object(tenancy, '_consultar', wraps=tenancy._consultar) as consultar:
+            for nombre, args, _ in self.VISTAS:
+                self.client.get(self._url(nombre, args))
+        consultar.assert_called_once()
+
+    def test_sucursal_de_otro_tenant(self):
+        otra = Barberia.objects.create(nosotros=Nosotros.objects.create(nombre='Otra'), nombre='O')
+        ajena = Sucursal.objects.create(barberia=otra, nombre='X', direccion='D')
+        self.assertEqual(self.client.get(reverse('sucursal_editar', args=[ajena.id])).status_code, 404)
+
+    def test_crear_sucursal_en_la_barberia_del_tenant(self):
+        respuesta = self.client.post(reverse('sucursal_crear'), {'nombre': 'Norte', 'direccion': 'Calle 2', 'activo': 'on'})
+        self.assertRedirects(respuesta, reverse('panel_admin_barberia'), fetch_redirect_response=False)
+        self.assertEqual(Sucursal.objects.get(nombre='Norte').barberia, self.sucursal.barberia)
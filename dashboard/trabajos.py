@@ -0,0 +1,248 @@
+"""
+HU14 / HU37: Exportaciones en segundo plano.
+
+`solicitar` registra un TrabajoExportacion y lo encola tras el COMMIT;
+una petición idéntica del mismo usuario dentro de DEDUPLICACION_SEG
+devuelve el trabajo existente. Si el broker no responde el trabajo queda
+pendiente y `reencolar_atascados` (tarea periódica) lo vuelve a encolar. `ejecutar` (tarea Celery) escribe el
+archivo por bloques en EXPORTACIONES_ROOT, opcionalmente comprimido con
+gzip, actualiza el avance cada FILAS_POR_AVANCE filas y avisa al
+solicitante por el WebSocket de notificaciones cuando termina.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from scheduling.utils import enviar_notificacion
+from .exportacion import (
+    calendario_agenda,
+    citas_a_exportar,
+    citas_agenda,
+    filas_citas,
+    filas_ingresos,
+    ingresos_por_servicio,
+    lineas_csv,
+)
+from .models import TrabajoExportacion
+
+logger = logging.getLogger(__name__)
+
+DEDUPLICACION_SEG = 10 * 60
+# Sin avance en este plazo un trabajo se considera perdido y se reencola
+PLAZO_PENDIENTE_SEG = 5 * 60
+PLAZO_EN_PROCESO_SEG = 60 * 60
+FILAS_POR_AVANCE = 5000
+RETENCION_DIAS = 7
+TAMANO_BLOQUE_BYTES = 64 * 1024
+
+
+def huella(usuario_id, tipo, formato, nosotros_id, barbero_id=None, parametros=None):
+    datos = json.dumps(
+        [usuario_id, tipo, formato, nosotros_id, barbero_id, parametros or {}],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(datos.encode('utf-8')).hexdigest()
+
+
+def solicitar(usuario, nosotros, tipo, formato=TrabajoExportacion.Formato.PLANO, barbero=None, parametros=None):
+    """
+    Crea el trabajo o reutiliza uno idéntico reciente que no haya fallado.
+    Devuelve (trabajo, creado).
+    """
+    parametros = {clave: valor for clave, valor in (parametros or {}).items() if valor}
+    firma = huella(usuario.id, tipo, formato, nosotros.id, barbero.id if barbero else None, parametros)
+    with transaction.atomic():
+        existente = TrabajoExportacion.objects.filter(
+            huella=firma,
+            creado_en__gte=timezone.now() - timedelta(seconds=DEDUPLICACION_SEG)
+        ).exclude(
+            estado=TrabajoExportacion.Estado.FALLIDO
+        ).order_by('-creado_en').first()
+        if existente:
+            return existente, False
+
+        for _ in range(2):
+            try:
+                with transaction.atomic():
+                    trabajo = TrabajoExportacion.objects.create(
+                        solicitante=usuario,
+                        nosotros=nosotros,
+                        barbero=barbero,
+                        tipo=tipo,
+                        formato=formato,
+                        parametros=parametros,
+                        huella=firma,
+                    )
+                break
+            except IntegrityError:
+                # Otra petición idéntica ganó la carrera (ver Meta.constraints)
+                ganador = TrabajoExportacion.objects.filter(
+                    huella=firma,
+                    estado__in=[TrabajoExportacion.Estado.PENDIENTE, TrabajoExportacion.Estado.EN_PROCESO]
+                ).order_by('-id').first()
+                if ganador:
+                    return ganador, False
+                # Terminó entre el INSERT y la lectura: se reintenta una vez
+        else:
+            return TrabajoExportacion.objects.filter(huella=firma).order_by('-id').first(), False
+        transaction.on_commit(lambda: _encolar(trabajo.id))
+    return trabajo, True
+
+
+def _encolar(trabajo_id):
+    from .tasks import generar_exportacion
+    try:
+        generar_exportacion.delay(trabajo_id)
+    except Exception:
+        # reencolar_atascados lo recogerá igualmente
+        logger.warning("No se pudo encolar la exportación %s", trabajo_id, exc_info=True)
+
+
+def reencolar_atascados():
+    """
+    Vuelve a encolar los trabajos pendientes sin worker tras
+    PLAZO_PENDIENTE_SEG y los que llevan más de PLAZO_EN_PROCESO_SEG en
+    proceso (worker caído). Devuelve cuántos encoló.
+    """
+    ahora = timezone.now()
+    pendientes = list(TrabajoExportacion.objects.filter(
+        estado=TrabajoExportacion.Estado.PENDIENTE,
+        creado_en__lt=ahora - timedelta(seconds=PLAZO_PENDIENTE_SEG)
+    ).values_list('id', flat=True))
+
+    en_proceso = TrabajoExportacion.objects.filter(
+        estado=TrabajoExportacion.Estado.EN_PROCESO,
+        iniciado_en__lt=ahora - timedelta(seconds=PLAZO_EN_PROCESO_SEG)
+    )
+    for trabajo_id in en_proceso.values_list('id', flat=True):
+        # Condicional: si el worker terminó entretanto, no se toca
+        if en_proceso.filter(id=trabajo_id).update(estado=TrabajoExportacion.Estado.PENDIENTE, procesadas=0):
+            pendientes.append(trabajo_id)
+
+    for trabajo_id in pendientes:
+        _encolar(trabajo_id)
+    return len(pendientes)
+
+
+def ruta_absoluta(nombre):
+    return os.path.join(settings.EXPORTACIONES_ROOT, nombre)
+
+
+def _abrir(ruta, formato, binario=False):
+    opciones = {} if binario else {'encoding': 'utf-8', 'newline': ''}
+    if formato == TrabajoExportacion.Formato.GZIP:
+        return gzip.open(ruta, 'wb' if binario else 'wt', **opciones)
+    return open(ruta, 'wb' if binario else 'w', **opciones)
+
+
+def _con_avance(trabajo, filas):
+    """Deja pasar las filas y guarda el avance cada FILAS_POR_AVANCE (la 0 es el encabezado)"""
+    for numero, fila in enumerate(filas):
+        yield fila
+        if numero and numero % FILAS_POR_AVANCE == 0:
+            TrabajoExportacion.objects.filter(id=trabajo.id).update(procesadas=numero)
+
+
+def _escribir(trabajo, ruta):
+    """Escribe el archivo del trabajo y devuelve cuántas filas/eventos contiene"""
+    parametros = trabajo.parametros
+    desde, hasta = parametros.get('desde'), parametros.get('hasta')
+
+    if trabajo.tipo == TrabajoExportacion.Tipo.AGENDA_ICAL:
+        citas = citas_agenda(trabajo.barbero, trabajo.iniciado_en, parametros.get('dias', 30))
+        contenido = calendario_agenda(trabajo.barbero, citas).to_ical()
+        with _abrir(ruta, trabajo.formato, binario=True) as archivo:
+            for inicio in range(0, len(contenido), TAMANO_BLOQUE_BYTES):
+                archivo.write(contenido[inicio:inicio + TAMANO_BLOQUE_BYTES])
+        return contenido.count(b'BEGIN:VEVENT')
+
+    if trabajo.tipo == TrabajoExportacion.Tipo.CITAS_CSV:
+        consulta = citas_a_exportar(trabajo.nosotros, desde, hasta)
+        filas = filas_citas(consulta)
+    else:
+        consulta = ingresos_por_servicio(trabajo.nosotros, desde, hasta)
+        filas = filas_ingresos(consulta)
+
+    total = consulta.count()
+    TrabajoExportacion.objects.filter(id=trabajo.id).update(total=total)
+    with _abrir(ruta, trabajo.formato) as archivo:
+        for bloque in lineas_csv(_con_avance(trabajo, filas)):
+            archivo.write(bloque)
+    return total
+
+
+def ejecutar(trabajo_id):
+    """
+    Genera el archivo de un trabajo pendiente. El UPDATE condicional que lo
+    pasa a EN_PROCESO evita que dos workers lo generen a la vez.
+    """
+    ahora = timezone.now()
+    reclamado = TrabajoExportacion.objects.filter(
+        id=trabajo_id,
+        estado=TrabajoExportacion.Estado.PENDIENTE
+    ).update(estado=TrabajoExportacion.Estado.EN_PROCESO, iniciado_en=ahora)
+    if not reclamado:
+        return None
+
+    trabajo = TrabajoExportacion.objects.select_related('nosotros', 'barbero').get(id=trabajo_id)
+    nombre = os.path.join(str(trabajo.nosotros_id), f'{trabajo.id}_{trabajo.tipo}.{trabajo.extension}')
+    ruta = ruta_absoluta(nombre)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+
+    try:
+        filas = _escribir(trabajo, ruta)
+    except Exception as e:
+        logger.exception("Error generando la exportación %s", trabajo_id)
+        if os.path.exists(ruta):
+            os.remove(ruta)
+        TrabajoExportacion.objects.filter(id=trabajo_id).update(
+            estado=TrabajoExportacion.Estado.FALLIDO,
+            error=str(e),
+            terminado_en=timezone.now(),
+        )
+        _notificar(trabajo, 'exportacion_fallida', f'No se pudo generar la exportación "{trabajo.get_tipo_display()}".')
+        return None
+
+    TrabajoExportacion.objects.filter(id=trabajo_id).update(
+        estado=TrabajoExportacion.Estado.COMPLETADO,
+        total=filas,
+        procesadas=filas,
+        archivo=nombre,
+        tamano_bytes=os.path.getsize(ruta),
+        terminado_en=timezone.now(),
+    )
+    _notificar(
+        trabajo,
+        'exportacion_lista',
+        f'Tu exportación "{trabajo.get_tipo_display()}" está lista.',
+        {'url': reverse('descargar_exportacion', args=[trabajo.id])},
+    )
+    return nombre
+
+
+def _notificar(trabajo, tipo, mensaje, data=None):
+    """El aviso es best-effort: el trabajo queda visible en la lista igualmente"""
+    try:
+        enviar_notificacion(trabajo.solicitante_id, tipo, mensaje, {'trabajo_id': trabajo.id, **(data or {})})
+    except Exception:
+        logger.warning("No se pudo notificar la exportación %s", trabajo.id, exc_info=True)
+
+
+def limpiar(dias=RETENCION_DIAS):
+    """Borra los archivos y trabajos con más de `dias` días. Devuelve cuántos"""
+    viejos = TrabajoExportacion.objects.filter(creado_en__lt=timezone.now() - timedelta(days=dias))
+    for nombre in viejos.exclude(archivo='').values_list('archivo', flat=True).iterator():
+        ruta = ruta_absoluta(nombre)
+        if os.path.exists(ruta):
+            os.remove(ruta)
+    borrados, _ = viejos.delete()
+    return borrados
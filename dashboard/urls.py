@@ -12,6 +12,10 @@ urlpatterns = [
     path("cliente/", views.panel_cliente, name="panel_cliente"),
     path('exportar/citas/', views.exportar_citas_csv, name='exportar_citas'),
     path('exportar/ingresos/', views.exportar_ingresos_csv, name='exportar_ingresos'),
+    path('exportaciones/', views.mis_exportaciones, name='mis_exportaciones'),
+    path('exportaciones/solicitar/<str:tipo>/', views.solicitar_exportacion, name='solicitar_exportacion'),
+    path('exportaciones/<int:trabajo_id>/estado/', views.estado_exportacion, name='estado_exportacion'),
+    path('exportaciones/<int:trabajo_id>/descargar/', views.descargar_exportacion, name='descargar_exportacion'),
     path('metricas/barberos/', views.metricas_barberos, name='metricas_barberos'),
     path('cita/<int:cita_id>/completar/', views.marcar_cita_completada, name='marcar_cita_completada'),
     path('cita/<int:cita_id>/no-show/', views.marcar_no_show, name='marcar_no_show'),
@@ -37,6 +41,8 @@ urlpatterns = [
     path("admin/invitaciones/nueva/", views.crear_invitacion_barbero, name="crear_invitacion_barbero"),
     path("barbero/crear/", views.barbero_crear, name="barbero_crear"),
     path('exportar-agenda/', views.exportar_agenda_ical, name='exportar_agenda'),
+    path('agenda/<str:token>/agenda.ics', views.agenda_ical_suscripcion, name='agenda_ical_suscripcion'),
+    path('agenda/regenerar-enlace/', views.regenerar_enlace_agenda, name='regenerar_enlace_agenda'),
 
     
     # Servicios
@@ -5,10 +5,11 @@ from django.utils import timezone
 from datetime import datetime, timedelta 
 from django.db.models import Count, Q, Avg
 from datetime import date, timedelta
-import csv
-from django.http import HttpResponse
+import os
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.http import require_POST
 from django.db import models
-from icalendar import Calendar, Event
 from django.http import HttpResponse
 
 from core.models import (
@@ -20,40 +21,34 @@ from core.models import (
     Servicio,
 )
 from core.decorators import role_required
+from core.tenancy import tenant_de
 from .forms import SucursalCreateForm, SucursalUpdateForm
 from scheduling.forms   import ReagendarCitaForm, CancelarCitaForm, CompletarCitaForm
 from scheduling.models import Cita,Promocion  # ← AGREGA ESTA LÍNEA
+from scheduling import reservas
 from .forms_servicios import ServicioForm
 import json
 from django.db.models.functions import TruncDate
 from core.models import DiaExcepcional, HorarioDisponibilidad
 from .forms_filtros import FiltroCitasAdminForm
+from .exportacion import (
+    calendario_agenda,
+    citas_a_exportar,
+    citas_agenda,
+    filas_citas,
+    filas_ingresos,
+    ingresos_por_servicio,
+    lineas_csv,
+)
+from . import agenda_ical, trabajos
+from .models import TrabajoExportacion
+from analytics.models import ResumenDiarioCitas
+from analytics.ocupacion import mapa_calor, ocupacion_dias, ocupacion_total
 
 
 
 
 
-# Helper: obtener la barbería (Nosotros) asociada al usuario
-def get_nosotros_from_user(user):
-    """
-    Dado un usuario, devuelve la instancia de 'Nosotros' asociada.
-
-    - Para BARBERO: usa Barbero.nosotros
-    - Para ADMIN_BARBERIA: usa user.barberia.nosotros (campo que llenamos en bootstrap)
-    """
-    # Caso 1: Barbero
-    if hasattr(user, "barbero") and user.barbero is not None:
-        return user.barbero.nosotros
-
-    # Caso 2: Admin de barbería
-    if getattr(user, "rol", None) == User.Roles.ADMIN_BARBERIA:
-        barberia = getattr(user, "barberia", None)
-        if barberia is not None:
-            return barberia.nosotros
-
-    # Otros roles (superadmin, cliente, etc.) -> por ahora None
-    return None
-
 # Helpers de licencia
 def _licencia_activa(licencia):
     try:
@@ -71,7 +66,7 @@ def _puede_agregar_sucursal(nosotros, licencia):
         max_s = getattr(licencia, "max_sucursales", None)
         if max_s is None:
             return True
-        return Sucursal.objects.filter(nosotros=nosotros).count() < max_s
+        return Sucursal.objects.filter(barberia__nosotros=nosotros).count() < max_s
 
 
 def _puede_agregar_barbero(nosotros, licencia):
@@ -95,31 +90,36 @@ def panel_licencias(request):
 @login_required
 @role_required(User.Roles.ADMIN_BARBERIA)
 def panel_admin_barberia(request):
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("login")
-    
-    sucursales = Sucursal.objects.filter(barberia__nosotros=nosotros)
-    servicios = Servicio.objects.filter(barberia__nosotros=nosotros, activo=True)[:5]
-    
-    # KPIs últimos 7 días
-    hace_7 = timezone.now() - timedelta(days=7)
-    citas_periodo = Cita.objects.filter(
-        barbero__nosotros=nosotros,
-        creada_en__gte=hace_7
+    nosotros = tenant.nosotros
+    
+    sucursales = tenant.sucursales
+    servicios = Servicio.objects.filter(barberia__nosotros_id=tenant.nosotros_id, activo=True)[:5]
+    
+    # KPIs últimos 7 días (resumen diario, no la tabla de citas). Se cuentan
+    # las citas por su fecha, no por creada_en: el resumen no guarda cuándo
+    # se reservaron. La plantilla lo indica junto a las métricas
+    hoy = timezone.localdate()
+    kpis_periodo = ResumenDiarioCitas.objects.filter(
+        nosotros_id=tenant.nosotros_id,
+        fecha__gt=hoy - timedelta(days=7),
+        fecha__lte=hoy
+    ).aggregate(
+        total=models.Sum('cantidad'),
+        completadas=models.Sum('cantidad', filter=Q(estado=Cita.Estado.COMPLETADA)),
+        no_shows=models.Sum('cantidad', filter=Q(estado=Cita.Estado.NO_SHOW)),
     )
     
-    total = citas_periodo.count()
-    completadas = citas_periodo.filter(estado=Cita.Estado.COMPLETADA).count()
-    no_shows = citas_periodo.filter(estado=Cita.Estado.NO_SHOW).count()
-    
-    # Tasa de ocupación (horas reservadas / horas disponibles)
-    barberos_activos = Barbero.objects.filter(nosotros=nosotros, activo=True).count()
-    horas_disponibles = barberos_activos * 8 * 7  # 8h/día, 7 días
-    horas_reservadas = total * 0.5  # asume 30min promedio por cita
+    total = kpis_periodo['total'] or 0
+    completadas = kpis_periodo['completadas'] or 0
+    no_shows = kpis_periodo['no_shows'] or 0
     
-    ocupacion = int((horas_reservadas / horas_disponibles * 100)) if horas_disponibles else 0
+    # Tasa de ocupación: minutos reservados / minutos de horario, por día
+    dias_ocupacion = ocupacion_dias(tenant.nosotros_id, hoy - timedelta(days=6), hoy)
+    _, _, ocupacion = ocupacion_total(dias_ocupacion)
     
     # Conversión lista espera (simplificado)
     conversion_15 = 0  # implementar cuando exista modelo Oferta15min
@@ -137,6 +137,7 @@ def panel_admin_barberia(request):
         "sucursales": sucursales,
         "servicios": servicios,
         "kpi": kpi,
+        "mapa_ocupacion": mapa_calor(dias_ocupacion),
     }
     return render(request, "dashboard/admin_sucursal.html", context)
 
@@ -145,20 +146,20 @@ def listar_citas_admin(request):
     HU07: Vista para mostrar todas las citas de la barbería
     con filtros por fecha y barbero.
     """
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
 
     # Base queryset
     citas = (
-        Cita.objects.filter(barbero__nosotros=nosotros)
+        Cita.objects.filter(barbero__nosotros_id=tenant.nosotros_id)
         .select_related("cliente", "servicio", "barbero", "sucursal")
         .order_by("fecha_hora")
     )
 
     # Form de filtros
-    form = FiltroCitasAdminForm(request.GET or None, nosotros=nosotros)
+    form = FiltroCitasAdminForm(request.GET or None, nosotros=tenant.nosotros_id)
 
     if form.is_valid():
         fecha = form.cleaned_data.get("fecha")
@@ -179,12 +180,13 @@ def listar_citas_admin(request):
 @login_required
 @role_required(User.Roles.ADMIN_BARBERIA)
 def sucursal_crear(request):
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
+    nosotros = tenant.nosotros
 
-    licencia = getattr(nosotros, "licencia", None)
+    licencia = tenant.licencia
     if not licencia:
         messages.error(request, "Tu barbería no tiene una licencia activa asignada.")
         return redirect("panel_admin_barberia")
@@ -195,11 +197,14 @@ def sucursal_crear(request):
         max_s = getattr(licencia, "max_sucursales", 0)
         messages.error(request, f"Límite de sucursales alcanzado ({max_s}) para tu plan.")
         return redirect("panel_admin_barberia")
+    if not tenant.barberias:
+        messages.error(request, "Tu cuenta no tiene una barbería registrada.")
+        return redirect("panel_admin_barberia")
 
     form = SucursalCreateForm(request.POST or None)
     if request.method == "POST" and form.is_valid():
         suc = form.save(commit=False)
-        suc.nosotros = nosotros
+        suc.barberia = tenant.barberias[0]
         suc.save()
         messages.success(request, "Sucursal creada con éxito.")
         return redirect("panel_admin_barberia")
@@ -211,12 +216,12 @@ def sucursal_crear(request):
 @login_required
 @role_required(User.Roles.ADMIN_BARBERIA)
 def sucursal_editar(request, sucursal_id):
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
 
-    suc = get_object_or_404(Sucursal, id=sucursal_id, nosotros=nosotros)
+    suc = get_object_or_404(tenant.sucursales, id=sucursal_id)
     form = SucursalUpdateForm(request.POST or None, instance=suc)
     if request.method == "POST" and form.is_valid():
         form.save()
@@ -230,12 +235,12 @@ def sucursal_editar(request, sucursal_id):
 @login_required
 @role_required(User.Roles.ADMIN_BARBERIA)
 def sucursal_eliminar(request, sucursal_id):
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
 
-    suc = get_object_or_404(Sucursal, id=sucursal_id, nosotros=nosotros)
+    suc = get_object_or_404(tenant.sucursales, id=sucursal_id)
     if request.method == "POST":
         suc.delete()
         messages.success(request, "Sucursal eliminada con éxito.")
@@ -248,12 +253,13 @@ def sucursal_eliminar(request, sucursal_id):
 @login_required
 @role_required(User.Roles.ADMIN_BARBERIA)
 def crear_invitacion_barbero(request):
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
+    nosotros = tenant.nosotros
 
-    licencia = getattr(nosotros, "licencia", None)
+    licencia = tenant.licencia
     if not licencia:
         messages.error(request, "Tu barbería no tiene una licencia activa asignada.")
         return redirect("panel_admin_barberia")
@@ -268,7 +274,7 @@ def crear_invitacion_barbero(request):
     if request.method == "POST":
         email = request.POST.get("email")
         sucursal_id = request.POST.get("sucursal_id")
-        sucursal = Sucursal.objects.filter(id=sucursal_id, nosotros=nosotros).first()
+        sucursal = tenant.sucursales.filter(id=sucursal_id).first()
 
         if User.objects.filter(email=email).exists():
             messages.error(request, "Ya existe un usuario con ese email.")
@@ -282,7 +288,7 @@ def crear_invitacion_barbero(request):
         messages.success(request, f"Invitación generada con éxito. Enlace: /registro/barbero/{inv.token}/")
         return redirect("panel_admin_barberia")
 
-    sucursales = Sucursal.objects.filter(nosotros=nosotros, activo=True)
+    sucursales = tenant.sucursales.filter(activo=True)
     return render(request, "dashboard/invitaciones_form.html", {"sucursales": sucursales})
 
 
@@ -295,13 +301,14 @@ def barbero_crear(request):
     sin esperar a que el barbero use la invitación.
     """
 
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
+    nosotros = tenant.nosotros
 
     # Validaciones de licencia
-    licencia = getattr(nosotros, "licencia", None)
+    licencia = tenant.licencia
     if not licencia:
         messages.error(request, "Tu barbería no tiene una licencia activa asignada.")
         return redirect("panel_admin_barberia")
@@ -355,16 +362,17 @@ def barbero_crear(request):
 @login_required
 @role_required(User.Roles.ADMIN_BARBERIA)
 def barbero_toggle_activo(request, barbero_id):
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
+    nosotros = tenant.nosotros
 
     barbero = get_object_or_404(Barbero, id=barbero_id, nosotros=nosotros)
 
     # Si vamos a activar, validar límites de licencia
     if not barbero.activo:
-        licencia = getattr(nosotros, "licencia", None)
+        licencia = tenant.licencia
         if not licencia:
             messages.error(request, "Tu barbería no tiene una licencia activa asignada.")
             return redirect("panel_admin_barberia")
@@ -411,6 +419,9 @@ def panel_barbero(request):
     context = {
         'barbero': barbero,
         'fecha': fecha,
+        'url_suscripcion_ical': request.build_absolute_uri(
+            reverse('agenda_ical_suscripcion', args=[agenda_ical.token_suscripcion(barbero)])
+        ),
         'citas_dia': citas_dia,
         'total_citas': total_citas,
         'completadas': completadas,
@@ -448,13 +459,9 @@ def marcar_cita_completada(request, cita_id):
 @role_required(User.Roles.CLIENTE)
 def panel_cliente(request):
     """HU48: Dashboard del cliente con estadísticas"""
-    from django.db.models import Count, Sum, Avg
+    from .estadisticas import estadisticas_cliente
     
-    total_citas = Cita.objects.filter(cliente=request.user).count()
-    completadas = Cita.objects.filter(
-        cliente=request.user,
-        estado=Cita.Estado.COMPLETADA
-    ).count()
+    estadisticas = estadisticas_cliente(request.user.id)
     
     proximas = Cita.objects.filter(
         cliente=request.user,
@@ -462,53 +469,19 @@ def panel_cliente(request):
         estado__in=[Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA]
     ).select_related('barbero', 'servicio', 'sucursal').order_by('fecha_hora')[:5]
     
-    # Barbero favorito
-    barbero_fav = Cita.objects.filter(
-        cliente=request.user,
-        estado=Cita.Estado.COMPLETADA
-    ).values('barbero__nombre').annotate(
-        total=Count('id')
-    ).order_by('-total').first()
-    
-    # Servicio más solicitado
-    servicio_fav = Cita.objects.filter(
-        cliente=request.user,
-        estado=Cita.Estado.COMPLETADA
-    ).values('servicio__nombre').annotate(
-        total=Count('id')
-    ).order_by('-total').first()
-    
-    # Gasto total
-    gasto_total = Cita.objects.filter(
-        cliente=request.user,
-        estado=Cita.Estado.COMPLETADA
-    ).aggregate(total=Sum('precio'))['total'] or 0
-    
-    # Puntos de fidelidad
-    barberias_con_puntos = []
-    for barberia_id, puntos in request.user.puntos_fidelidad.items():
-        if puntos > 0:
-            from core.models import Barberia, ProgramaFidelidad
-            try:
-                barberia = Barberia.objects.get(id=barberia_id)
-                programa = ProgramaFidelidad.objects.get(barberia=barberia, activo=True)
-                valor = float(puntos) * float(programa.pesos_por_punto)
-                
-                barberias_con_puntos.append({
-                    'barberia': barberia,
-                    'puntos': puntos,
-                    'valor': valor
-                })
-            except (Barberia.DoesNotExist, ProgramaFidelidad.DoesNotExist):
-                pass
+    # Puntos de fidelidad (resumen en caché, solo programas activos)
+    barberias_con_puntos = [
+        item for item in request.user.obtener_todas_las_barberias_con_puntos()
+        if item['programa_activo']
+    ]
     
     context = {
-        'total_citas': total_citas,
-        'completadas': completadas,
+        'total_citas': estadisticas['total_citas'],
+        'completadas': estadisticas['completadas'],
         'proximas_citas': proximas,
-        'barbero_favorito': barbero_fav['barbero__nombre'] if barbero_fav else 'N/A',
-        'servicio_favorito': servicio_fav['servicio__nombre'] if servicio_fav else 'N/A',
-        'gasto_total': gasto_total,
+        'barbero_favorito': estadisticas['barbero_favorito'] or 'N/A',
+        'servicio_favorito': estadisticas['servicio_favorito'] or 'N/A',
+        'gasto_total': estadisticas['gasto_total'],
         'barberias_con_puntos': barberias_con_puntos
     }
     return render(request, 'dashboard/panel_cliente.html', context)
@@ -516,138 +489,152 @@ def panel_cliente(request):
 @role_required(User.Roles.ADMIN_BARBERIA)
 def exportar_citas_csv(request):
     """HU14: Exportar reporte de citas en CSV"""
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
+    nosotros = tenant.nosotros
     
     # Filtros opcionales
-    desde = request.GET.get('desde')
-    hasta = request.GET.get('hasta')
-    
-    citas = Cita.objects.filter(
-        barbero__nosotros=nosotros
-    ).select_related('cliente', 'barbero', 'servicio', 'sucursal').order_by('-fecha_hora')
-    
-    if desde:
-        citas = citas.filter(fecha_hora__date__gte=desde)
-    if hasta:
-        citas = citas.filter(fecha_hora__date__lte=hasta)
+    citas = citas_a_exportar(nosotros, request.GET.get('desde'), request.GET.get('hasta'))
     
-    # Crear CSV
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
+    # CSV en streaming: la memoria no crece con el número de citas
+    response = StreamingHttpResponse(
+        lineas_csv(filas_citas(citas)),
+        content_type='text/csv; charset=utf-8'
+    )
     response['Content-Disposition'] = f'attachment; filename="citas_{timezone.now().date()}.csv"'
-    response.write('\ufeff')  # BOM para Excel UTF-8
-    
-    writer = csv.writer(response)
-    writer.writerow(['ID', 'Fecha', 'Hora', 'Cliente', 'Barbero', 'Servicio', 'Sucursal', 'Estado', 'Precio'])
-    
-    for c in citas:
-        writer.writerow([
-            c.id,
-            c.fecha_hora.date(),
-            c.fecha_hora.time(),
-            c.cliente.nombre,
-            c.barbero.nombre,
-            c.servicio.nombre,
-            c.sucursal.nombre,
-            c.get_estado_display(),
-            c.precio
-        ])
-    
     return response
 
 @login_required
 @role_required(User.Roles.ADMIN_BARBERIA)
 def exportar_ingresos_csv(request):
     """HU14: Exportar reporte de ingresos por servicio"""
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
+    nosotros = tenant.nosotros
     
-    desde = request.GET.get('desde')
-    hasta = request.GET.get('hasta')
-    
-    citas = Cita.objects.filter(
-        barbero__nosotros=nosotros,
-        estado=Cita.Estado.COMPLETADA
-    ).select_related('servicio')
-    
-    if desde:
-        citas = citas.filter(fecha_hora__date__gte=desde)
-    if hasta:
-        citas = citas.filter(fecha_hora__date__lte=hasta)
+    from .metricas import leer_fecha
     
     # Agrupar por servicio
-    from django.db.models import Sum, Count
-    resumen = citas.values('servicio__nombre').annotate(
-        cantidad=Count('id'),
-        total=Sum('precio')
-    ).order_by('-total')
+    resumen = ingresos_por_servicio(
+        nosotros,
+        leer_fecha(request.GET.get('desde'), None),
+        leer_fecha(request.GET.get('hasta'), None)
+    )
     
     response = HttpResponse(content_type='text/csv; charset=utf-8')
     response['Content-Disposition'] = f'attachment; filename="ingresos_{timezone.now().date()}.csv"'
-    response.write('\ufeff')
-    
-    writer = csv.writer(response)
-    writer.writerow(['Servicio', 'Cantidad', 'Ingresos'])
-    
-    for r in resumen:
-        writer.writerow([
-            r['servicio__nombre'],
-            r['cantidad'],
-            r['total']
-        ])
+    for bloque in lineas_csv(filas_ingresos(resumen)):
+        response.write(bloque)
     
     return response
+# Exportaciones en segundo plano (HU14 / HU37)
+TIPOS_EXPORTACION_ROL = {
+    TrabajoExportacion.Tipo.CITAS_CSV: User.Roles.ADMIN_BARBERIA,
+    TrabajoExportacion.Tipo.INGRESOS_CSV: User.Roles.ADMIN_BARBERIA,
+    TrabajoExportacion.Tipo.AGENDA_ICAL: User.Roles.BARBERO,
+}
+
+
+@login_required
+@require_POST
+def solicitar_exportacion(request, tipo):
+    """Encola una exportación y lleva al listado donde se ve su avance"""
+    if TIPOS_EXPORTACION_ROL.get(tipo) != request.user.rol:
+        messages.error(request, "No tienes permisos para esta exportación.")
+        return redirect("route_by_role")
+    tenant = tenant_de(request)
+    if not tenant:
+        messages.error(request, "No se encontró tu barbería asociada.")
+        return redirect("route_by_role")
+    nosotros = tenant.nosotros
+
+    barbero = None
+    if tipo == TrabajoExportacion.Tipo.AGENDA_ICAL:
+        barbero = get_object_or_404(Barbero, user=request.user)
+
+    from .metricas import leer_fecha
+    desde = leer_fecha(request.POST.get('desde'), None)
+    hasta = leer_fecha(request.POST.get('hasta'), None)
+    formato = (
+        TrabajoExportacion.Formato.GZIP if request.POST.get('gzip')
+        else TrabajoExportacion.Formato.PLANO
+    )
+
+    trabajo, creado = trabajos.solicitar(
+        request.user, nosotros, tipo, formato, barbero,
+        {'desde': desde and desde.isoformat(), 'hasta': hasta and hasta.isoformat()},
+    )
+    if creado:
+        messages.success(request, "Estamos generando tu exportación. Te avisaremos cuando esté lista.")
+    else:
+        messages.info(request, "Ya tienes esta misma exportación en curso o recién generada.")
+    return redirect("mis_exportaciones")
+
+
+@login_required
+def mis_exportaciones(request):
+    exportaciones = TrabajoExportacion.objects.filter(solicitante=request.user)[:20]
+    return render(request, "dashboard/exportaciones.html", {"exportaciones": exportaciones})
+
+
+@login_required
+def estado_exportacion(request, trabajo_id):
+    trabajo = get_object_or_404(TrabajoExportacion, id=trabajo_id, solicitante=request.user)
+    return JsonResponse({
+        'estado': trabajo.estado,
+        'progreso': trabajo.progreso,
+        'procesadas': trabajo.procesadas,
+        'total': trabajo.total,
+        'url': (
+            reverse('descargar_exportacion', args=[trabajo.id])
+            if trabajo.estado == TrabajoExportacion.Estado.COMPLETADO else None
+        ),
+    })
+
+
+@login_required
+def descargar_exportacion(request, trabajo_id):
+    trabajo = get_object_or_404(
+        TrabajoExportacion,
+        id=trabajo_id,
+        solicitante=request.user,
+        estado=TrabajoExportacion.Estado.COMPLETADO
+    )
+    ruta = trabajos.ruta_absoluta(trabajo.archivo)
+    if not os.path.exists(ruta):
+        raise Http404("El archivo ya no está disponible")
+    tipo_contenido = 'text/calendar' if trabajo.tipo == TrabajoExportacion.Tipo.AGENDA_ICAL else 'text/csv'
+    if trabajo.formato == TrabajoExportacion.Formato.GZIP:
+        tipo_contenido = 'application/gzip'
+    return FileResponse(
+        open(ruta, 'rb'),
+        as_attachment=True,
+        filename=trabajo.nombre_descarga,
+        content_type=tipo_contenido,
+    )
+
+
 @login_required
 @role_required(User.Roles.ADMIN_BARBERIA)
 def metricas_barberos(request):
     """HU43: Métricas individuales por barbero"""
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
     
-    desde = request.GET.get('desde', (timezone.now() - timedelta(days=30)).date())
-    hasta = request.GET.get('hasta', timezone.now().date())
+    from .metricas import leer_fecha, metricas_barberos as calcular_metricas
     
-    barberos = Barbero.objects.filter(nosotros=nosotros, activo=True)
-    estadisticas = []
+    hoy = timezone.localdate()
+    desde = leer_fecha(request.GET.get('desde'), hoy - timedelta(days=30))
+    hasta = leer_fecha(request.GET.get('hasta'), hoy)
     
-    for barbero in barberos:
-        citas = Cita.objects.filter(
-            barbero=barbero,
-            fecha_hora__date__gte=desde,
-            fecha_hora__date__lte=hasta
-        )
-        
-        total = citas.count()
-        completadas = citas.filter(estado=Cita.Estado.COMPLETADA).count()
-        canceladas = citas.filter(estado__in=[Cita.Estado.CANCELADA_CLIENTE, Cita.Estado.CANCELADA_ADMIN]).count()
-        no_shows = citas.filter(estado=Cita.Estado.NO_SHOW).count()
-        
-        # Ingresos generados
-        ingresos = citas.filter(estado=Cita.Estado.COMPLETADA).aggregate(
-            total=models.Sum('precio')
-        )['total'] or 0
-        
-        # Valoración promedio
-        promedio_val = barbero.valoraciones.aggregate(
-            avg=models.Avg('puntuacion')
-        )['avg'] or 0
-        
-        estadisticas.append({
-            'barbero': barbero,
-            'total_citas': total,
-            'completadas': completadas,
-            'canceladas': canceladas,
-            'no_shows': no_shows,
-            'tasa_completado': int((completadas/total*100)) if total else 0,
-            'ingresos': ingresos,
-            'valoracion': round(promedio_val, 1)
-        })
+    barberos = Barbero.objects.filter(nosotros_id=tenant.nosotros_id, activo=True)
+    estadisticas = calcular_metricas(barberos, desde, hasta)
     
     context = {
         'estadisticas': estadisticas,
@@ -690,39 +677,34 @@ def marcar_no_show(request, cita_id):
 @role_required(User.Roles.ADMIN_BARBERIA)
 def estadisticas_ingresos(request):
     """HU30: Estadísticas de ingresos por período"""
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
     
     periodo = request.GET.get('periodo', '30')  # días
     dias = int(periodo)
     
-    fecha_inicio = timezone.now() - timedelta(days=dias)
+    fecha_inicio = timezone.localdate() - timedelta(days=dias)
+    ingresos_periodo = ResumenDiarioCitas.objects.filter(
+        nosotros_id=tenant.nosotros_id,
+        estado=Cita.Estado.COMPLETADA,
+        fecha__gte=fecha_inicio
+    )
     
     # Ingresos por día
-    ingresos_diarios = Cita.objects.filter(
-        barbero__nosotros=nosotros,
-        estado=Cita.Estado.COMPLETADA,
-        fecha_hora__gte=fecha_inicio
-    ).annotate(
-        dia=TruncDate('fecha_hora')
-    ).values('dia').annotate(
-        total=models.Sum('precio')
-    ).order_by('dia')
+    ingresos_diarios = ingresos_periodo.values('fecha').annotate(
+        total=models.Sum('ingresos')
+    ).order_by('fecha')
     
     # Preparar datos para gráfico
-    fechas = [item['dia'].strftime('%d/%m') for item in ingresos_diarios]
+    fechas = [item['fecha'].strftime('%d/%m') for item in ingresos_diarios]
     montos = [float(item['total']) for item in ingresos_diarios]
     
     # Ingresos por servicio
-    ingresos_servicios = Cita.objects.filter(
-        barbero__nosotros=nosotros,
-        estado=Cita.Estado.COMPLETADA,
-        fecha_hora__gte=fecha_inicio
-    ).values('servicio__nombre').annotate(
-        total=models.Sum('precio'),
-        cantidad=models.Count('id')
+    ingresos_servicios = ingresos_periodo.values('servicio__nombre').annotate(
+        total=models.Sum('ingresos'),
+        cantidad=models.Sum('cantidad')
     ).order_by('-total')[:5]
     
     context = {
@@ -738,12 +720,12 @@ def estadisticas_ingresos(request):
 @role_required(User.Roles.ADMIN_BARBERIA)
 def listar_promociones(request):
     """HU32: Listar promociones"""
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         return redirect("panel_admin_barberia")
     
     promociones = Promocion.objects.filter(
-        barberia__nosotros=nosotros
+        barberia__nosotros_id=tenant.nosotros_id
     ).order_by('-creado_en')
     
     return render(request, 'dashboard/promociones_list.html', {
@@ -754,12 +736,12 @@ def listar_promociones(request):
 @role_required(User.Roles.ADMIN_BARBERIA)
 def crear_promocion(request):
     """HU32: Crear promoción"""
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         return redirect("panel_admin_barberia")
     
     if request.method == 'POST':
-        barberia = nosotros.barberias.first()
+        barberia = tenant.barberias[0] if tenant.barberias else None
         
         promocion = Promocion.objects.create(
             barberia=barberia,
@@ -781,7 +763,7 @@ def crear_promocion(request):
         messages.success(request, f"Promoción '{promocion.nombre}' creada exitosamente")
         return redirect('listar_promociones')
     
-    servicios = Servicio.objects.filter(barberia__nosotros=nosotros)
+    servicios = Servicio.objects.filter(barberia__nosotros_id=tenant.nosotros_id)
     return render(request, 'dashboard/promocion_form.html', {
         'servicios': servicios
     })
@@ -794,54 +776,64 @@ def exportar_agenda_ical(request):
         messages.error(request, "No eres un barbero registrado")
         return redirect('panel_barbero')
     
-    # Crear calendario
-    cal = Calendar()
-    cal.add('prodid', '-//BarberFlow//ES')
-    cal.add('version', '2.0')
-    cal.add('x-wr-calname', f'Agenda {barbero.nombre}')
-    
-    # Obtener citas próximas (30 días)
+    response = _respuesta_agenda_ical(request, barbero)
+    response['Content-Disposition'] = f'attachment; filename="agenda_{barbero.nombre}_{timezone.now().date()}.ics"'
+    return response
+
+
+def agenda_ical_suscripcion(request, token):
+    """
+    HU37: Feed iCal para suscribirse desde Google/Apple Calendar.
+    El token firmado identifica al barbero; no requiere sesión.
+    """
+    barbero = agenda_ical.barbero_de_token(token)
+    if barbero is None:
+        raise Http404("Enlace de agenda no válido")
+    return _respuesta_agenda_ical(request, barbero)
+
+
+@login_required
+@require_POST
+def regenerar_enlace_agenda(request):
+    """HU37: Invalida el enlace de suscripción iCal del barbero y genera otro"""
+    try:
+        barbero = Barbero.objects.get(user=request.user)
+    except Barbero.DoesNotExist:
+        messages.error(request, "No eres un barbero registrado")
+        return redirect('panel_barbero')
+
+    agenda_ical.regenerar_enlace(barbero)
+    messages.success(request, "Generamos un nuevo enlace de suscripción. El anterior ya no funciona.")
+    return redirect('panel_barbero')
+
+
+def _respuesta_agenda_ical(request, barbero):
+    """Responde 304 si el calendario no cambió; si no, el .ics (cacheado por sello)"""
     fecha_inicio = timezone.now()
-    fecha_fin = fecha_inicio + timedelta(days=30)
-    
-    citas = Cita.objects.filter(
-        barbero=barbero,
-        fecha_hora__gte=fecha_inicio,
-        fecha_hora__lte=fecha_fin,
-        estado__in=[Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA]
-    ).select_related('cliente', 'servicio', 'sucursal')
-    
-    for cita in citas:
-        event = Event()
-        event.add('summary', f'{cita.servicio.nombre} - {cita.cliente.nombre}')
-        event.add('dtstart', cita.fecha_hora)
-        event.add('dtend', cita.fecha_hora + timedelta(minutes=cita.servicio.duracion_minutos))
-        event.add('location', f'{cita.sucursal.nombre}, {cita.sucursal.direccion}')
-        
-        event.add('uid', f'cita-{cita.id}@barberflow.com')
-        event.add('status', 'CONFIRMED')
-        
-        cal.add_component(event)
-    
-    response = HttpResponse(cal.to_ical(), content_type='text/calendar; charset=utf-8')
-    response['Content-Disposition'] = f'attachment; filename="agenda_{barbero.nombre}_{fecha_inicio.date()}.ics"'
-    
+    etag = agenda_ical.sello(barbero, fecha_inicio)
+    if agenda_ical.coincide(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+        response = HttpResponse(status=304)
+    else:
+        ical = agenda_ical.contenido(barbero, etag, fecha_inicio)
+        response = HttpResponse(ical, content_type='text/calendar; charset=utf-8')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=300'
     return response
 @login_required
 @role_required(User.Roles.ADMIN_BARBERIA)
 def gestionar_dias_excepcionales(request):
     """HU40: Gestionar días festivos/excepcionales"""
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         return redirect("panel_admin_barberia")
     
-    sucursales = Sucursal.objects.filter(barberia__nosotros=nosotros)
+    sucursales = tenant.sucursales
     
     if request.method == 'POST':
         from core.models import DiaExcepcional
         
         DiaExcepcional.objects.create(
-            sucursal_id=request.POST['sucursal'],
+            sucursal=get_object_or_404(sucursales, id=request.POST['sucursal']),
             fecha=request.POST['fecha'],
             tipo=request.POST['tipo'],
             hora_apertura=request.POST.get('hora_apertura') or None,
@@ -852,7 +844,7 @@ def gestionar_dias_excepcionales(request):
         return redirect('gestionar_dias_excepcionales')
     
     excepciones = DiaExcepcional.objects.filter(
-        sucursal__barberia__nosotros=nosotros,
+        sucursal__barberia__nosotros_id=tenant.nosotros_id,
         fecha__gte=timezone.now().date()
     ).order_by('fecha')
     
@@ -862,7 +854,9 @@ def gestionar_dias_excepcionales(request):
     })
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib import messages
-from django.core.mail import send_mail
+from django.db import transaction
+from core.correos import encolar_email
+from core.models import NotificacionEmail
 from scheduling.models import Cita
 from scheduling.forms import ReagendarCitaForm, CancelarCitaForm
 
@@ -873,22 +867,29 @@ def reagendar_cita(request, cita_id):
     if request.method == 'POST':
         form = ReagendarCitaForm(request.POST, instance=cita)
         if form.is_valid():
-            form.save()
+            def guardar():
+                form.save()
+
+                # Notificación vía email (bandeja de salida)
+                encolar_email(
+                    cita.cliente,
+                    NotificacionEmail.TipoNotificacion.REPROGRAMACION_CITA,
+                    'Tu cita fue reagendada',
+                    f'Hola {cita.cliente.nombre},\n\n'
+                    f'Tu cita ha sido reagendada para: {cita.fecha_hora}.\n'
+                    f'Barbería: {cita.sucursal.nombre}\n\n'
+                    f'— BarberFlow',
+                    cita=cita,
+                    remitente='barberflow@system.com',
+                )
 
-            # Notificación vía email
-            send_mail(
-                'Tu cita fue reagendada',
-                f'Hola {cita.cliente.nombre},\n\n'
-                f'Tu cita ha sido reagendada para: {cita.fecha_hora}.\n'
-                f'Barbería: {cita.sucursal.nombre}\n\n'
-                f'— BarberFlow',
-                'barberflow@system.com',
-                [cita.cliente.email],
-                fail_silently=True
-            )
-
-            messages.success(request, "Cita reagendada correctamente.")
-            return redirect('listar_citas_admin')
+            try:
+                reservas.mover_cita(cita, form.cleaned_data['fecha_hora'], guardar=guardar)
+            except reservas.SlotOcupado:
+                form.add_error('fecha_hora', "El barbero ya tiene una cita en ese horario.")
+            else:
+                messages.success(request, "Cita reagendada correctamente.")
+                return redirect('listar_citas_admin')
     else:
         form = ReagendarCitaForm(instance=cita)
 
@@ -905,19 +906,21 @@ def cancelar_cita(request, cita_id):
         form = CancelarCitaForm(request.POST, instance=cita)
         if form.is_valid():
             cita.estado = 'CANCELADA'
-            form.save()
-
-            # Notificación al cliente
-            send_mail(
-                'Tu cita ha sido cancelada',
-                f'Hola {cita.cliente.nombre},\n\n'
-                f'Tu cita del {cita.fecha_hora} ha sido cancelada.\n'
-                f'Motivo: {cita.motivo_cancelacion}\n\n'
-                f'— BarberFlow',
-                'barberflow@system.com',
-                [cita.cliente.email],
-                fail_silently=True
-            )
+            with transaction.atomic():
+                form.save()
+
+                # Notificación al cliente (bandeja de salida)
+                encolar_email(
+                    cita.cliente,
+                    NotificacionEmail.TipoNotificacion.CANCELACION_CITA,
+                    'Tu cita ha sido cancelada',
+                    f'Hola {cita.cliente.nombre},\n\n'
+                    f'Tu cita del {cita.fecha_hora} ha sido cancelada.\n'
+                    f'Motivo: {cita.motivo_cancelacion}\n\n'
+                    f'— BarberFlow',
+                    cita=cita,
+                    remitente='barberflow@system.com',
+                )
 
             messages.success(request, "Cita cancelada correctamente.")
             return redirect('listar_citas_admin')
@@ -3,29 +3,10 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from core.models import Servicio, User
 from core.decorators import role_required
+from core.tenancy import tenant_de
 from .forms_servicios import ServicioForm
 
 
-def get_nosotros_from_user(user):
-    """
-    Retorna el objeto Nosotros asociado al usuario,
-    tanto para ADMIN_BARBERIA como para BARBERO.
-    """
-
-    # Caso administrador → obtiene la barbería mediante user.barberia
-    if user.rol == User.Roles.ADMIN_BARBERIA:
-        if hasattr(user, "barberia") and user.barberia is not None:
-            return user.barberia.nosotros
-        return None
-
-    # Caso barbero → usa la relación barbero.nosotros
-    if user.rol == User.Roles.BARBERO:
-        if hasattr(user, "barbero") and user.barbero.nosotros:
-            return user.barbero.nosotros
-
-    return None
-
-
 # ============================================================
 # LISTAR SERVICIOS (HU02)
 # ============================================================
@@ -35,16 +16,16 @@ def servicio_list(request):
     """
     Lista todos los servicios de la barbería del admin.
     """
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
 
-    servicios = Servicio.objects.filter(barberia__nosotros=nosotros).order_by("-activo", "nombre")
+    servicios = Servicio.objects.filter(barberia__nosotros_id=tenant.nosotros_id).order_by("-activo", "nombre")
     
     context = {
         "servicios": servicios,
-        "nosotros": nosotros,
+        "nosotros": tenant.nosotros,
     }
     return render(request, "dashboard/servicio_list.html", context)
 
@@ -55,8 +36,8 @@ def servicio_list(request):
 @login_required
 @role_required(User.Roles.ADMIN_BARBERIA)
 def servicio_crear(request):
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
 
@@ -64,7 +45,7 @@ def servicio_crear(request):
     if request.method == "POST" and form.is_valid():
         servicio = form.save(commit=False)
         # Asigna la barbería correctamente
-        servicio.barberia = nosotros.barberias.first()  # O ajusta según tu modelo
+        servicio.barberia = tenant.barberias[0] if tenant.barberias else None
         servicio.save()
         messages.success(request, f"Servicio '{servicio.nombre}' creado con éxito.")
         return redirect("servicio_list")
@@ -86,12 +67,12 @@ def servicio_editar(request, servicio_id):
     """
     Edita un servicio existente.
     """
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
 
-    servicio = get_object_or_404(Servicio, id=servicio_id, barberia__nosotros=nosotros)
+    servicio = get_object_or_404(Servicio, id=servicio_id, barberia__nosotros_id=tenant.nosotros_id)
     form = ServicioForm(request.POST or None, instance=servicio)
     
     if request.method == "POST" and form.is_valid():
@@ -117,12 +98,12 @@ def servicio_eliminar(request, servicio_id):
     """
     Elimina un servicio (confirmación requerida).
     """
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
 
-    servicio = get_object_or_404(Servicio, id=servicio_id, barberia__nosotros=nosotros)
+    servicio = get_object_or_404(Servicio, id=servicio_id, barberia__nosotros_id=tenant.nosotros_id)
     
     if request.method == "POST":
         nombre = servicio.nombre
@@ -145,12 +126,12 @@ def servicio_toggle_activo(request, servicio_id):
     """
     Activa o desactiva un servicio sin eliminarlo.
     """
-    nosotros = get_nosotros_from_user(request.user)
-    if not nosotros:
+    tenant = tenant_de(request)
+    if not tenant:
         messages.error(request, "No se encontró tu barbería asociada.")
         return redirect("panel_admin_barberia")
 
-    servicio = get_object_or_404(Servicio, id=servicio_id, barberia__nosotros=nosotros)
+    servicio = get_object_or_404(Servicio, id=servicio_id, barberia__nosotros_id=tenant.nosotros_id)
     servicio.activo = not servicio.activo
     servicio.save()
     
@@ -0,0 +1,322 @@
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from django.db.models import Avg, Count
+from django.utils import timezone
+
+from core.models import Barbero, DiaExcepcional, HorarioDisponibilidad
+from .models import Cita, Valoracion
+from . import ocupacion, retenciones
+
+# Estados de cita que ocupan el horario del barbero
+ESTADOS_BLOQUEANTES = (Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA)
+
+# Separación entre slots ofrecidos al cliente
+INTERVALO_SLOT_MIN = 30
+
+
+def parsear_fecha(fecha):
+    """Acepta 'YYYY-MM-DD', date o datetime y devuelve un date"""
+    if isinstance(fecha, datetime):
+        return fecha.date()
+    if isinstance(fecha, date):
+        return fecha
+    return datetime.fromisoformat(fecha).date()
+
+
+def rango_dia(fecha, margen_minutos=0):
+    """Inicio y fin (aware) del día, ampliados en `margen_minutos` por ambos lados"""
+    margen = timedelta(minutes=margen_minutos)
+    inicio = timezone.make_aware(datetime.combine(fecha, time.min))
+    fin = timezone.make_aware(datetime.combine(fecha + timedelta(days=1), time.min))
+    return inicio - margen, fin + margen
+
+
+def cargar_intervalos_bloqueantes(barbero_ids, inicio, fin):
+    """
+    Carga en UNA consulta los intervalos [fecha_hora, fecha_hora_fin) de
+    las citas que bloquean agenda para los barberos dados y se cruzan
+    con [inicio, fin), con la misma regla que reservas.hay_solapamiento.
+
+    Devuelve {barbero_id: [(inicio, fin), ...]} ordenado por inicio.
+    """
+    ocupados = defaultdict(list)
+    filas = Cita.objects.filter(
+        barbero_id__in=list(barbero_ids),
+        estado__in=ESTADOS_BLOQUEANTES,
+        fecha_hora__lt=fin,
+        fecha_hora_fin__gt=inicio,
+    ).order_by('fecha_hora').values_list('barbero_id', 'fecha_hora', 'fecha_hora_fin')
+    for barbero_id, fecha_hora, fecha_hora_fin in filas:
+        ocupados[barbero_id].append((fecha_hora, fecha_hora_fin))
+    return ocupados
+
+
+def sumar_retenciones(ocupados, barbero_ids, fechas, usuario=None):
+    """Agrega a `ocupados` los intervalos retenidos en checkout por otros usuarios"""
+    retenidas = retenciones.retenciones_activas(
+        barbero_ids, fechas, excluir_usuario_id=getattr(usuario, 'id', None)
+    )
+    for barbero_id, intervalos in retenidas.items():
+        ocupados[barbero_id] = sorted(list(ocupados[barbero_id]) + list(intervalos))
+    return ocupados
+
+
+def unir_intervalos(intervalos):
+    """Une intervalos (inicio, fin) ordenados por inicio en tramos disjuntos"""
+    unidos = []
+    for inicio, fin in intervalos:
+        if unidos and inicio <= unidos[-1][1]:
+            if fin > unidos[-1][1]:
+                unidos[-1][1] = fin
+        else:
+            unidos.append([inicio, fin])
+    return unidos
+
+
+def franjas_excepcion(excepcion):
+    """Franjas de un día excepcional: ninguna si está cerrado, la especial si no"""
+    if excepcion.tipo == DiaExcepcional.TipoExcepcion.CERRADO:
+        return []
+    if not excepcion.hora_apertura or not excepcion.hora_cierre:
+        return []
+    return [(excepcion.hora_apertura, excepcion.hora_cierre)]
+
+
+def franjas_del_dia(barbero, fecha):
+    """HU24 + HU40: franjas (hora_inicio, hora_fin) del barbero para la fecha"""
+    excepcion = DiaExcepcional.objects.filter(
+        sucursal=barbero.sucursal_principal,
+        fecha=fecha
+    ).first()
+    if excepcion:
+        return franjas_excepcion(excepcion)
+
+    return list(
+        HorarioDisponibilidad.objects.filter(
+            barbero=barbero,
+            dia_semana=fecha.weekday(),
+            activo=True
+        ).order_by('hora_inicio').values_list('hora_inicio', 'hora_fin')
+    )
+
+
+def calcular_slots(fecha, franjas, ocupados, duracion_minutos, ahora=None):
+    """
+    Calcula en memoria los slots libres de un día.
+
+    Un slot choca si algún intervalo ocupado (inicio, fin) cumple
+    inicio < slot + duración y fin > slot, la misma regla que
+    reservas.hay_solapamiento. `ocupados` debe venir ordenado por inicio;
+    se une en tramos disjuntos y cada slot se resuelve con una búsqueda
+    binaria en lugar de una consulta.
+    """
+    ahora = ahora or timezone.now()
+    duracion = timedelta(minutes=duracion_minutos)
+    intervalo = timedelta(minutes=INTERVALO_SLOT_MIN)
+    tramos = unir_intervalos(ocupados)
+    inicios = [inicio for inicio, _ in tramos]
+    slots = []
+
+    for hora_inicio, hora_fin in franjas:
+        hora_actual = timezone.make_aware(datetime.combine(fecha, hora_inicio))
+        fin_franja = timezone.make_aware(datetime.combine(fecha, hora_fin))
+
+        while hora_actual + duracion <= fin_franja:
+            # Último tramo que empieza antes del fin del slot
+            idx = bisect_left(inicios, hora_actual + duracion)
+            conflicto = idx > 0 and tramos[idx - 1][1] > hora_actual
+            if not conflicto and hora_actual >= ahora:
+                slots.append(hora_actual.time())
+            hora_actual += intervalo
+
+    return slots
+
+
+def obtener_slots_disponibles(barbero, fecha, duracion_minutos, ocupados=None, usuario=None):
+    """
+    HU24 + HU40: Slots libres de un barbero para una fecha.
+
+    Usa como máximo tres consultas (excepción, horario y citas). Si se
+    pasa `ocupados` (p. ej. precargado para toda la sucursal con
+    `cargar_intervalos_bloqueantes`) no se consulta la tabla de citas.
+    Los slots retenidos por otros usuarios se muestran ocupados.
+    """
+    fecha = parsear_fecha(fecha)
+    if fecha < timezone.now().date():
+        return []
+
+    franjas = franjas_del_dia(barbero, fecha)
+    if not franjas:
+        return []
+
+    if ocupados is None:
+        inicio, fin = rango_dia(fecha)
+        ocupados = cargar_intervalos_bloqueantes([barbero.id], inicio, fin)[barbero.id]
+    ocupados = sumar_retenciones({barbero.id: ocupados}, [barbero.id], [fecha], usuario)[barbero.id]
+
+    return calcular_slots(fecha, franjas, ocupados, duracion_minutos)
+
+
+def matriz_disponibilidad_sucursal(sucursal, servicio, fecha, barberos=None, usuario=None):
+    """
+    Matriz barbero × slot de una sucursal para un servicio y fecha.
+
+    Número constante de consultas sin importar cuántos barberos haya:
+    horarios, día excepcional, citas bloqueantes y valoraciones agrupadas
+    (más la de barberos si no se entregan). Las retenciones de checkout
+    de otros usuarios cuentan como ocupadas.
+
+    Devuelve {'fecha', 'slots', 'barberos'} donde 'slots' es la unión
+    ordenada de horas y cada fila de 'barberos' trae sus slots, la fila
+    de la matriz ('disponible', alineada con 'slots') y su valoración.
+    """
+    fecha = parsear_fecha(fecha)
+    if barberos is None:
+        barberos = Barbero.objects.filter(sucursal_principal=sucursal, user__is_active=True)
+    barberos = list(barberos)
+    barbero_ids = [b.id for b in barberos]
+
+    franjas_por_barbero = defaultdict(list)
+    if fecha >= timezone.now().date() and barbero_ids:
+        excepcion = DiaExcepcional.objects.filter(sucursal=sucursal, fecha=fecha).first()
+        if excepcion:
+            franjas = franjas_excepcion(excepcion)
+            for barbero_id in barbero_ids:
+                franjas_por_barbero[barbero_id] = franjas
+        else:
+            horarios = HorarioDisponibilidad.objects.filter(
+                barbero_id__in=barbero_ids,
+                dia_semana=fecha.weekday(),
+                activo=True
+            ).order_by('hora_inicio').values_list('barbero_id', 'hora_inicio', 'hora_fin')
+            for barbero_id, hora_inicio, hora_fin in horarios:
+                franjas_por_barbero[barbero_id].append((hora_inicio, hora_fin))
+
+    ocupados = defaultdict(list)
+    con_horario = [b_id for b_id in barbero_ids if franjas_por_barbero[b_id]]
+    if con_horario:
+        inicio, fin = rango_dia(fecha)
+        ocupados = cargar_intervalos_bloqueantes(con_horario, inicio, fin)
+        sumar_retenciones(ocupados, con_horario, [fecha], usuario)
+
+    valoraciones = {}
+    if barbero_ids:
+        valoraciones = {
+            fila['barbero_id']: fila
+            for fila in Valoracion.objects.filter(barbero_id__in=barbero_ids)
+            .values('barbero_id')
+            .annotate(promedio=Avg('puntuacion'), total=Count('id'))
+        }
+
+    ahora = timezone.now()
+    filas = []
+    todas = set()
+    for barbero in barberos:
+        slots = calcular_slots(
+            fecha, franjas_por_barbero[barbero.id], ocupados[barbero.id],
+            servicio.duracion_minutos, ahora=ahora
+        )
+        todas.update(slots)
+        stats = valoraciones.get(barbero.id, {})
+        promedio = stats.get('promedio')
+        filas.append({
+            'barbero': barbero,
+            'promedio': round(promedio, 1) if promedio else 0,
+            'total': stats.get('total', 0),
+            'slots': slots,
+        })
+
+    columnas = sorted(todas)
+    for fila in filas:
+        libres = set(fila['slots'])
+        fila['disponible'] = [slot in libres for slot in columnas]
+
+    return {'fecha': fecha, 'slots': columnas, 'barberos': filas}
+
+
+def matriz_a_json(matriz):
+    """Versión serializable de `matriz_disponibilidad_sucursal`"""
+    return {
+        'fecha': matriz['fecha'].isoformat(),
+        'slots': [slot.strftime('%H:%M') for slot in matriz['slots']],
+        'barberos': [
+            {
+                'id': fila['barbero'].id,
+                'nombre': fila['barbero'].nombre,
+                'promedio': fila['promedio'],
+                'total_valoraciones': fila['total'],
+                'disponible': fila['disponible'],
+            }
+            for fila in matriz['barberos']
+        ],
+    }
+
+
+# Días de agenda que se leen por consulta al buscar hacia adelante
+VENTANA_BUSQUEDA_DIAS = 7
+
+
+def buscar_proximos_slots(servicio, sucursal, desde=None, limite=10, horizonte_dias=14, barbero=None, usuario=None):
+    """
+    Próximos `limite` slots libres para un servicio en una sucursal,
+    recorriendo hasta `horizonte_dias` días hacia adelante.
+
+    Lee los bitmaps OcupacionDia (ocupacion.py) en ventanas de
+    VENTANA_BUSQUEDA_DIAS días: una consulta por ventana sin tocar
+    scheduling_cita, más un pase de materialización para los días que
+    faltan. Las retenciones de otros usuarios se suman a lo ocupado y la
+    búsqueda se corta en cuanto se completan los resultados. Si se indica
+    `barbero` solo se busca en su agenda.
+
+    Devuelve una lista cronológica de {'fecha_hora', 'barbero'}.
+    """
+    ahora = timezone.now()
+    if isinstance(desde, datetime):
+        minimo = max(desde, ahora)
+    else:
+        minimo = ahora
+    fecha_inicio = max(parsear_fecha(desde) if desde else ahora.date(), timezone.localdate(minimo))
+    fecha_fin = fecha_inicio + timedelta(days=horizonte_dias)
+
+    if barbero is not None:
+        barberos = [barbero]
+    else:
+        barberos = list(Barbero.objects.filter(sucursal_principal=sucursal, user__is_active=True))
+    barbero_ids = [b.id for b in barberos]
+    if not barbero_ids or limite <= 0:
+        return []
+
+    resultados = []
+    ventana_inicio = fecha_inicio
+    while ventana_inicio < fecha_fin:
+        ventana_fin = min(ventana_inicio + timedelta(days=VENTANA_BUSQUEDA_DIAS), fecha_fin)
+        dias_ventana = [ventana_inicio + timedelta(days=i) for i in range((ventana_fin - ventana_inicio).days)]
+        filas = ocupacion.filas_vigentes(barberos, dias_ventana)
+        retenido = ocupacion.bits_por_dia(retenciones.retenciones_activas(
+            barbero_ids, dias_ventana, excluir_usuario_id=getattr(usuario, 'id', None)
+        ))
+
+        for fecha in dias_ventana:
+            candidatos = []
+            for b in barberos:
+                slots = ocupacion.slots_libres(
+                    filas[(b.id, fecha)], fecha, servicio.duracion_minutos,
+                    ahora=minimo, retenido=retenido[(b.id, fecha)]
+                )
+                for slot in slots:
+                    candidatos.append((slot, b.id, b))
+
+            candidatos.sort(key=lambda c: (c[0], c[1]))
+            for slot, _, b in candidatos:
+                resultados.append({
+                    'fecha_hora': timezone.make_aware(datetime.combine(fecha, slot)),
+                    'barbero': b,
+                })
+                if len(resultados) >= limite:
+                    return resultados
+
+        ventana_inicio = ventana_fin
+
+    return resultados
@@ -0,0 +1,80 @@
+import logging
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+class LoteEfectos:
+    """
+    Efectos secundarios de una operación (WebSocket, emails, puntos)
+    que se ejecutan juntos en un único transaction.on_commit.
+
+    Si no hay transacción abierta se ejecutan de inmediato, igual que
+    on_commit. Un efecto que falla se registra y no detiene al resto.
+    """
+
+    def __init__(self):
+        self.efectos = []
+        self.programado = False
+
+    def agregar(self, funcion, *args, **kwargs):
+        self.efectos.append((funcion, args, kwargs))
+        if not self.programado:
+            self.programado = True
+            transaction.on_commit(self.ejecutar)
+
+    def ejecutar(self):
+        efectos, self.efectos = self.efectos, []
+        self.programado = False
+        for funcion, args, kwargs in efectos:
+            try:
+                funcion(*args, **kwargs)
+            except Exception:
+                logger.exception("Error ejecutando efecto post-commit %s", getattr(funcion, '__name__', funcion))
+
+
+def lote_de(instancia):
+    """Lote de efectos asociado a una instancia (p. ej. la Cita recién reservada)"""
+    lote = getattr(instancia, '_efectos_pendientes', None)
+    if lote is None:
+        lote = LoteEfectos()
+        instancia._efectos_pendientes = lote
+    return lote
+
+
+class _Acumulado:
+    """Elementos juntados durante una transacción para `funcion`"""
+
+    def __init__(self, funcion):
+        self.funcion = funcion
+        self.elementos = set()
+        self.ejecutado = False
+
+    def __call__(self):
+        self.ejecutado = True
+        self.funcion(self.elementos)
+
+
+def acumular_tras_commit(funcion, elementos):
+    """
+    Junta `elementos` de toda la transacción actual y llama una sola vez a
+    funcion(conjunto) tras el COMMIT; sin transacción abierta, de inmediato.
+
+    Para receptores por fila: un borrado en cascada dispara un post_delete
+    por cita, pero el recálculo se hace una vez por (barbero, fecha).
+    """
+    elementos = {e for e in elementos if e is not None}
+    if not elementos:
+        return
+    conexion = transaction.get_connection()
+    if not conexion.in_atomic_block:
+        funcion(elementos)
+        return
+    # Un ROLLBACK descarta el on_commit; entonces se programa otro lote
+    lotes = conexion.__dict__.setdefault('_acumulados_tras_commit', {})
+    lote = lotes.get(funcion)
+    if lote is None or lote.ejecutado or not any(programada is lote for _, programada, _ in conexion.run_on_commit):
+        lote = lotes[funcion] = _Acumulado(funcion)
+        transaction.on_commit(lote)
+    lote.elementos.update(elementos)
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.14 on 2026-10-18 16:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_alter_user_barberia'),
+        ('scheduling', '0009_cita_nota_interna'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcupacionDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('horario', models.BinaryField(help_text='Bits de tiempo laborable')),
+                ('ocupado', models.BinaryField(help_text='Bits cubiertos por citas bloqueantes')),
+                ('version_agenda', models.PositiveIntegerField(help_text='Barbero.version_agenda con la que se calculó la fila')),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+                ('barbero', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ocupacion_dias', to='core.barbero')),
+            ],
+            options={
+                'db_table': 'scheduling_ocupacion_dia',
+                'indexes': [models.Index(fields=['fecha', 'barbero'], name='scheduling__fecha_bc00e2_idx')],
+                'unique_together': {('barbero', 'fecha')},
+            },
+        ),
+    ]
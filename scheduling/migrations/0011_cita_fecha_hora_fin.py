@@ -0,0 +1,86 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:05
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def rellenar_fecha_hora_fin(apps, schema_editor):
+    Cita = apps.get_model('scheduling', 'Cita')
+    Servicio = apps.get_model('core', 'Servicio')
+    for servicio_id, duracion in Servicio.objects.values_list('id', 'duracion_minutos'):
+        Cita.objects.filter(servicio_id=servicio_id).update(
+            fecha_hora_fin=models.F('fecha_hora') + timedelta(minutes=duracion)
+        )
+
+
+# Solo PostgreSQL soporta restricciones de exclusión; en otros motores
+# la reserva se protege con el bloqueo de scheduling.reservas.
+SQL_CREAR_EXCLUSION = [
+    "CREATE EXTENSION IF NOT EXISTS btree_gist;",
+    """
+ALTER TABLE scheduling_cita ADD CONSTRAINT cita_sin_solapamiento
+    EXCLUDE USING gist (
+        barbero_id WITH =,
+        tstzrange(fecha_hora, fecha_hora_fin, '[)') WITH &&
+    ) WHERE (estado IN ('pendiente', 'confirmada') AND fecha_hora_fin IS NOT NULL);
+""",
+]
+
+SQL_BORRAR_EXCLUSION = "ALTER TABLE scheduling_cita DROP CONSTRAINT IF EXISTS cita_sin_solapamiento;"
+
+
+# Pares de citas bloqueantes del mismo barbero que se cruzan
+SQL_SOLAPADAS = """
+SELECT a.id, b.id FROM scheduling_cita a
+JOIN scheduling_cita b ON b.barbero_id = a.barbero_id AND b.id > a.id
+    AND b.fecha_hora < a.fecha_hora_fin AND a.fecha_hora < b.fecha_hora_fin
+WHERE a.estado IN ('pendiente', 'confirmada') AND b.estado IN ('pendiente', 'confirmada')
+ORDER BY a.id, b.id
+"""
+MAX_REPORTE = 50
+
+
+def crear_exclusion(apps, schema_editor):
+    """
+    Las citas existentes no se tocan: si hay solapamientos la migración
+    se detiene con la lista, para resolverlos con el comando
+    resolver_solapamientos (que avisa a los clientes) y volver a migrar.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(SQL_SOLAPADAS)
+        pares = cursor.fetchall()
+    if pares:
+        detalle = ', '.join(f'#{a}/#{b}' for a, b in pares[:MAX_REPORTE])
+        raise RuntimeError(
+            f'{len(pares)} pares de citas solapadas impiden crear cita_sin_solapamiento: {detalle}'
+            + (' …' if len(pares) > MAX_REPORTE else '')
+            + '. Ejecuta "python manage.py resolver_solapamientos --aplicar" y vuelve a migrar.'
+        )
+    for sql in SQL_CREAR_EXCLUSION:
+        schema_editor.execute(sql)
+
+
+def borrar_exclusion(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(SQL_BORRAR_EXCLUSION)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_alter_user_barberia'),
+        ('scheduling', '0010_ocupaciondia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cita',
+            name='fecha_hora_fin',
+            field=models.DateTimeField(blank=True, editable=False, help_text='fecha_hora + duración del servicio', null=True),
+        ),
+        migrations.RunPython(rellenar_fecha_hora_fin, migrations.RunPython.noop),
+        migrations.RunPython(crear_exclusion, borrar_exclusion),
+    ]
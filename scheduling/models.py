@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from core.models import Barbero, Sucursal, Servicio
 from datetime import datetime, timedelta
@@ -86,6 +86,7 @@ class Cita(models.Model):
     sucursal = models.ForeignKey(Sucursal, on_delete=models.CASCADE, related_name='citas_scheduling')
     servicio = models.ForeignKey(Servicio, on_delete=models.CASCADE, related_name='citas_scheduling')
     fecha_hora = models.DateTimeField(db_index=True)
+    fecha_hora_fin = models.DateTimeField(null=True, blank=True, editable=False, help_text="fecha_hora + duración del servicio")
     estado = models.CharField(max_length=20, choices=Estado.choices, default=Estado.PENDIENTE, db_index=True)
     precio = models.DecimalField(max_digits=10, decimal_places=2)
     notas = models.TextField(blank=True)
@@ -121,6 +122,17 @@ class Cita(models.Model):
 
     def __str__(self):
         return f"Cita {self.id} - {self.cliente.nombre} con {self.barbero.nombre}"
+
+    def save(self, *args, **kwargs):
+        # Mantener el intervalo reservado [fecha_hora, fecha_hora_fin)
+        update_fields = kwargs.get('update_fields')
+        if self.servicio_id and self.fecha_hora and (
+            update_fields is None or {'fecha_hora', 'servicio'} & set(update_fields)
+        ):
+            self.fecha_hora_fin = self.fecha_hora + timedelta(minutes=self.servicio.duracion_minutos)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'fecha_hora_fin'}
+        super().save(*args, **kwargs)
     def debe_enviar_recordatorio(self):
         """HU1: Verifica si debe enviarse recordatorio (24h antes)"""
         ahora = timezone.now()
@@ -179,8 +191,11 @@ class Cita(models.Model):
         if not puede:
             raise ValidationError(mensaje)
         
-        self.estado = self.Estado.CANCELADA
-        self.save(update_fields=['estado'])
+        # El email de confirmación se encola en la misma transacción
+        with transaction.atomic():
+            self.estado = self.Estado.CANCELADA
+            self.save(update_fields=['estado'])
+            self._enviar_email_cancelacion()
         
         # Registrar en log de actividad
         from core.models import LogActividad
@@ -189,15 +204,12 @@ class Cita(models.Model):
             accion=f"Canceló cita #{self.id}",
             detalles=f"Cliente: {self.cliente.nombre}, Fecha: {self.fecha_hora}, Barbero: {self.barbero.nombre}"
         )
-        
-        # Enviar email de confirmación
-        self._enviar_email_cancelacion()
     
     def _enviar_email_cancelacion(self):
-        """HU2: Envía email confirmando la cancelación"""
-        from django.core.mail import send_mail
+        """HU2: Encola el email que confirma la cancelación"""
         from django.template.loader import render_to_string
         from django.conf import settings
+        from core.correos import encolar_email
         from core.models import NotificacionEmail
         
         context = {
@@ -210,35 +222,15 @@ class Cita(models.Model):
             'cita_id': self.id
         }
         
-        try:
-            html_message = render_to_string('emails/cancelacion_cita.html', context)
-            plain_message = render_to_string('emails/cancelacion_cita.txt', context)
-            
-            send_mail(
-                subject=f'Cancelación confirmada - Cita #{self.id}',
-                message=plain_message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[self.cliente.email],
-                html_message=html_message,
-                fail_silently=False,
-            )
-            
-            NotificacionEmail.objects.create(
-                destinatario=self.cliente,
-                cita=self,
-                tipo=NotificacionEmail.TipoNotificacion.CANCELACION_CITA,
-                asunto=f'Cancelación confirmada - Cita #{self.id}',
-                exitoso=True
-            )
-        except Exception as e:
-            NotificacionEmail.objects.create(
-                destinatario=self.cliente,
-                cita=self,
-                tipo=NotificacionEmail.TipoNotificacion.CANCELACION_CITA,
-                asunto=f'Cancelación confirmada - Cita #{self.id}',
-                exitoso=False,
-                error=str(e)
-            )
+        encolar_email(
+            self.cliente,
+            NotificacionEmail.TipoNotificacion.CANCELACION_CITA,
+            f'Cancelación confirmada - Cita #{self.id}',
+            render_to_string('emails/cancelacion_cita.txt', context),
+            cita=self,
+            cuerpo_html=render_to_string('emails/cancelacion_cita.html', context),
+            remitente=settings.DEFAULT_FROM_EMAIL,
+        )
 
     def marcar_confirmada(self):
         if self.estado == self.Estado.PENDIENTE:
@@ -302,4 +294,24 @@ class WaitlistEntry(models.Model):
         return self.activo and self.notificado_en and timezone.now() < self.expiracion_notificacion
 
     def __str__(self):
-        return f"WL {self.id} {self.cliente} {self.fecha_dia}"
\ No newline at end of file
+        return f"WL {self.id} {self.cliente} {self.fecha_dia}"
+
+
+class OcupacionDia(models.Model):
+    """Agenda precalculada de un barbero para un día: un bit cada 5 minutos"""
+    barbero = models.ForeignKey(Barbero, on_delete=models.CASCADE, related_name='ocupacion_dias')
+    fecha = models.DateField()
+    horario = models.BinaryField(help_text="Bits de tiempo laborable")
+    ocupado = models.BinaryField(help_text="Bits cubiertos por citas bloqueantes")
+    version_agenda = models.PositiveIntegerField(help_text="Barbero.version_agenda con la que se calculó la fila")
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'scheduling_ocupacion_dia'
+        unique_together = ('barbero', 'fecha')
+        indexes = [
+            models.Index(fields=['fecha', 'barbero']),
+        ]
+
+    def __str__(self):
+        return f"Ocupación {self.barbero_id} {self.fecha}"
@@ -0,0 +1,284 @@
+"""
+Bitmaps de agenda por barbero y día (OcupacionDia).
+
+Cada día se divide en ticks de RESOLUCION_MIN minutos; el bit i
+representa el intervalo [i * 5, (i + 1) * 5) minutos desde la medianoche
+local. Por fila se guardan dos máscaras:
+
+- horario: tiempo laborable (horario semanal o día excepcional)
+- ocupado: ticks cubiertos por [fecha_hora, fecha_hora_fin) de las citas
+  bloqueantes, también la parte que cae en el día siguiente
+
+buscar_proximos_slots (disponibilidad.py) las lee para responder varios
+días de una sucursal sin tocar scheduling_cita. Las filas se materializan
+bajo demanda y guardan la Barbero.version_agenda con la que se
+calcularon. Desde las señales (ver signals.py):
+
+- un cambio de Cita rehace solo los ticks de su intervalo anterior y del
+  nuevo, una vez por transacción;
+- un cambio de HorarioDisponibilidad o de sucursal del barbero sube su
+  version_agenda, y sus filas se rematerializan al leerlas;
+- un DiaExcepcional descarta las filas de ese día en la sucursal.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import DiaExcepcional, HorarioDisponibilidad
+from . import disponibilidad
+from .models import OcupacionDia
+
+RESOLUCION_MIN = 5
+TICKS_DIA = 24 * 60 // RESOLUCION_MIN
+BYTES_DIA = TICKS_DIA // 8
+
+
+def a_bytes(bits):
+    return bits.to_bytes(BYTES_DIA, 'little')
+
+
+def a_bits(valor):
+    return int.from_bytes(bytes(valor or b''), 'little')
+
+
+def mascara(desde_tick, hasta_tick):
+    """Bits [desde_tick, hasta_tick) encendidos, recortados al día"""
+    desde_tick = max(desde_tick, 0)
+    hasta_tick = min(hasta_tick, TICKS_DIA)
+    if hasta_tick <= desde_tick:
+        return 0
+    return ((1 << (hasta_tick - desde_tick)) - 1) << desde_tick
+
+
+def _minutos(hora):
+    return hora.hour * 60 + hora.minute
+
+
+def _ticks_techo(minutos):
+    return -(-minutos // RESOLUCION_MIN)
+
+
+def _tick_fin(momento):
+    """Primer tick libre tras `momento` (redondea hacia arriba los segundos)"""
+    segundos = momento.hour * 3600 + momento.minute * 60 + momento.second + (momento.microsecond > 0)
+    return -(-segundos // (RESOLUCION_MIN * 60))
+
+
+def bits_horario(franjas):
+    bits = 0
+    for hora_inicio, hora_fin in franjas:
+        bits |= mascara(_minutos(hora_inicio) // RESOLUCION_MIN, _ticks_techo(_minutos(hora_fin)))
+    return bits
+
+
+def dias_intervalo(inicio, fin):
+    """Fechas locales que toca [inicio, fin)"""
+    primero = timezone.localtime(inicio).date()
+    ultimo = timezone.localtime(fin - timedelta(microseconds=1)).date() if fin > inicio else primero
+    return [primero + timedelta(days=i) for i in range((ultimo - primero).days + 1)]
+
+
+def bits_intervalo(inicio, fin, fecha):
+    """Ticks de `fecha` cubiertos por [inicio, fin), en hora local"""
+    inicio = timezone.localtime(inicio)
+    fin = timezone.localtime(fin)
+    desde = 0 if inicio.date() < fecha else _minutos(inicio) // RESOLUCION_MIN
+    hasta = TICKS_DIA if fin.date() > fecha else _tick_fin(fin)
+    return mascara(desde, hasta)
+
+
+def bits_por_dia(intervalos_por_barbero):
+    """{(barbero_id, fecha): bits} a partir de {barbero_id: [(inicio, fin), ...]}"""
+    bits = defaultdict(int)
+    for barbero_id, intervalos in intervalos_por_barbero.items():
+        for inicio, fin in intervalos:
+            for fecha in dias_intervalo(inicio, fin):
+                bits[(barbero_id, fecha)] |= bits_intervalo(inicio, fin, fecha)
+    return bits
+
+
+def materializar(barberos, fechas):
+    """
+    Calcula y guarda las filas OcupacionDia para cada barbero × fecha.
+
+    Trabaja por conjuntos: una consulta de horarios, una de días
+    excepcionales y una de citas para todo el rango, y un solo upsert.
+    """
+    barberos = list(barberos)
+    fechas = sorted(set(fechas))
+    if not barberos or not fechas:
+        return []
+    barbero_ids = [b.id for b in barberos]
+
+    franjas_semana = defaultdict(list)
+    horarios = HorarioDisponibilidad.objects.filter(
+        barbero_id__in=barbero_ids,
+        activo=True
+    ).order_by('hora_inicio').values_list('barbero_id', 'dia_semana', 'hora_inicio', 'hora_fin')
+    for barbero_id, dia_semana, hora_inicio, hora_fin in horarios:
+        franjas_semana[(barbero_id, dia_semana)].append((hora_inicio, hora_fin))
+
+    excepciones = {
+        (exc.sucursal_id, exc.fecha): exc
+        for exc in DiaExcepcional.objects.filter(
+            sucursal_id__in={b.sucursal_principal_id for b in barberos},
+            fecha__in=fechas
+        )
+    }
+
+    inicio, _ = disponibilidad.rango_dia(fechas[0])
+    _, fin = disponibilidad.rango_dia(fechas[-1])
+    ocupado = bits_por_dia(disponibilidad.cargar_intervalos_bloqueantes(barbero_ids, inicio, fin))
+
+    filas = []
+    for barbero in barberos:
+        for fecha in fechas:
+            excepcion = excepciones.get((barbero.sucursal_principal_id, fecha))
+            if excepcion:
+                franjas = disponibilidad.franjas_excepcion(excepcion)
+            else:
+                franjas = franjas_semana[(barbero.id, fecha.weekday())]
+            filas.append(OcupacionDia(
+                barbero=barbero,
+                fecha=fecha,
+                horario=a_bytes(bits_horario(franjas)),
+                ocupado=a_bytes(ocupado[(barbero.id, fecha)]),
+                version_agenda=barbero.version_agenda,
+            ))
+
+    OcupacionDia.objects.bulk_create(
+        filas,
+        update_conflicts=True,
+        unique_fields=['barbero', 'fecha'],
+        update_fields=['horario', 'ocupado', 'version_agenda', 'actualizado_en'],
+    )
+    return filas
+
+
+def filas_vigentes(barberos, fechas):
+    """
+    {(barbero_id, fecha): OcupacionDia} para barberos × fechas. Una
+    lectura de OcupacionDia; las filas que faltan o cuya version_agenda
+    no es la del barbero recibido se materializan juntas en un único pase.
+    """
+    barberos = list(barberos)
+    fechas = sorted(set(fechas))
+    versiones = {b.id: b.version_agenda for b in barberos}
+    filas = {
+        (f.barbero_id, f.fecha): f
+        for f in OcupacionDia.objects.filter(
+            barbero__in=barberos,
+            fecha__gte=fechas[0],
+            fecha__lte=fechas[-1],
+        )
+        if f.version_agenda == versiones[f.barbero_id]
+    }
+    faltantes = [b for b in barberos if any((b.id, fecha) not in filas for fecha in fechas)]
+    for fila in materializar(faltantes, fechas):
+        filas[(fila.barbero.id, fila.fecha)] = fila
+    return filas
+
+
+def slots_libres(fila, fecha, duracion_minutos, ahora=None, retenido=0):
+    """
+    Slots libres de una fila OcupacionDia usando solo operaciones de bits.
+
+    Los candidatos arrancan al inicio de cada tramo laborable y avanzan
+    cada INTERVALO_SLOT_MIN; un candidato choca si [slot, slot + duración)
+    toca algún tick ocupado o `retenido`, igual que el motor de slots.
+    """
+    ahora = ahora or timezone.now()
+    horario = a_bits(fila.horario)
+    ocupado = a_bits(fila.ocupado) | retenido
+    paso = disponibilidad.INTERVALO_SLOT_MIN // RESOLUCION_MIN
+    adelante = _ticks_techo(duracion_minutos)
+    slots = []
+
+    tick = 0
+    while tick < TICKS_DIA:
+        if not horario >> tick & 1:
+            tick += 1
+            continue
+        fin_tramo = tick
+        while fin_tramo < TICKS_DIA and horario >> fin_tramo & 1:
+            fin_tramo += 1
+
+        candidato = tick
+        while candidato * RESOLUCION_MIN + duracion_minutos <= fin_tramo * RESOLUCION_MIN:
+            if not ocupado & mascara(candidato, candidato + adelante):
+                minutos = candidato * RESOLUCION_MIN
+                slot = time(minutos // 60, minutos % 60)
+                if timezone.make_aware(datetime.combine(fecha, slot)) >= ahora:
+                    slots.append(slot)
+            candidato += paso
+        tick = fin_tramo
+
+    return slots
+
+
+def actualizar_por_cita(ventanas):
+    """
+    Rehace en las filas ya materializadas solo los ticks tocados por
+    cambios de citas.
+
+    `ventanas` es un iterable de (barbero_id, inicio, fin): el intervalo
+    anterior y el actual de cada cita cambiada. Los ticks de cada ventana
+    se apagan y se vuelven a encender con las citas bloqueantes que los
+    cubren, así una cita contigua que comparte un tick no queda libre.
+    Los días que nadie ha consultado todavía se dejan para la
+    materialización bajo demanda. Se llama una vez por transacción
+    (efectos.acumular_tras_commit).
+    """
+    ventanas = [(b_id, inicio, fin or inicio) for b_id, inicio, fin in ventanas if b_id and inicio]
+    tramos = defaultdict(int)
+    for barbero_id, inicio, fin in ventanas:
+        for fecha in dias_intervalo(inicio, fin):
+            tramos[(barbero_id, fecha)] |= bits_intervalo(inicio, fin, fecha)
+    if not tramos:
+        return
+
+    with transaction.atomic():
+        # Bloquea las filas antes de leer las citas: dos commits que tocan
+        # el mismo día no pisan los bits del otro
+        filas = [
+            f for f in OcupacionDia.objects.select_for_update().filter(
+                barbero_id__in={b_id for b_id, _ in tramos},
+                fecha__in={fecha for _, fecha in tramos}
+            )
+            if (f.barbero_id, f.fecha) in tramos
+        ]
+        if not filas:
+            return
+        margen = timedelta(minutes=RESOLUCION_MIN)
+        afectadas = [
+            (inicio, fin) for barbero_id, inicio, fin in ventanas
+            if any((barbero_id, fecha) in tramos for fecha in dias_intervalo(inicio, fin))
+        ]
+        ocupado = bits_por_dia(disponibilidad.cargar_intervalos_bloqueantes(
+            {f.barbero_id for f in filas},
+            min(inicio for inicio, _ in afectadas) - margen,
+            max(fin for _, fin in afectadas) + margen,
+        ))
+        ahora = timezone.now()
+        for fila in filas:
+            tramo = tramos[(fila.barbero_id, fila.fecha)]
+            bits = (a_bits(fila.ocupado) & ~tramo) | (ocupado[(fila.barbero_id, fila.fecha)] & tramo)
+            fila.ocupado = a_bytes(bits)
+            fila.actualizado_en = ahora
+        OcupacionDia.objects.bulk_update(filas, ['ocupado', 'actualizado_en'])
+
+
+def subir_version(barberos):
+    """Deja desfasadas las filas de los barberos (queryset) tras un cambio de horario"""
+    barberos.update(version_agenda=F('version_agenda') + 1)
+
+
+def invalidar_excepcion(sucursal_id, fecha):
+    """Descarta los días afectados por un día excepcional de la sucursal"""
+    OcupacionDia.objects.filter(
+        barbero__sucursal_principal_id=sucursal_id,
+        fecha=fecha
+    ).delete()
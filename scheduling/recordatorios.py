@@ -0,0 +1,131 @@
+"""
+Pipeline por lotes de los recordatorios de citas (2h y 24h).
+
+Cada lote reclama las citas vencidas con SELECT ... FOR UPDATE SKIP
+LOCKED (dos workers nunca toman la misma cita), arma todos los mensajes,
+los encola en la bandeja de salida con un solo INSERT y marca el flag con
+un único UPDATE ... WHERE id IN. Al terminar se drena la bandeja por una
+sola conexión SMTP (core.correos.drenar).
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core import correos
+from core.models import NotificacionEmail
+from .models import Cita
+from .utils import firmar
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 200
+ESTADOS_RECORDATORIO = [Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA]
+
+
+def mensaje_2h(cita):
+    token_confirmar = firmar(f"cita:{cita.id}:confirmar")
+    enlace = f"{settings.SITE_URL}/scheduling/confirmar/{token_confirmar}/"
+    return correos.nuevo_email(
+        cita.cliente,
+        NotificacionEmail.TipoNotificacion.RECORDATORIO_CITA,
+        "⏰ Recordatorio: Tu cita en 2 horas",
+        f"Hola {cita.cliente.nombre},\n\nEn 2 horas tienes cita con {cita.barbero.nombre} ({cita.servicio.nombre}) a las {cita.fecha_hora.strftime('%H:%M')}.\n\nConfirma aquí: {enlace}",
+        cita=cita,
+        remitente=settings.DEFAULT_FROM_EMAIL,
+    )
+
+
+def mensaje_24h(cita):
+    token_cancelar = firmar(f"cita:{cita.id}:cancelar")
+    enlace_cancelar = f"{settings.SITE_URL}/scheduling/cancelar/{token_cancelar}/"
+    return correos.nuevo_email(
+        cita.cliente,
+        NotificacionEmail.TipoNotificacion.RECORDATORIO_CITA,
+        "📅 Recordatorio: Tu cita mañana",
+        f"""Hola {cita.cliente.nombre},
+
+Te recordamos tu cita para mañana:
+📅 Fecha: {cita.fecha_hora.strftime('%d/%m/%Y')}
+🕐 Hora: {cita.fecha_hora.strftime('%H:%M')}
+💈 Barbero: {cita.barbero.nombre}
+📍 Sucursal: {cita.sucursal.nombre} - {cita.sucursal.direccion}
+✂️ Servicio: {cita.servicio.nombre}
+💰 Precio: ${cita.precio}
+
+Si necesitas cancelar: {enlace_cancelar}
+
+¡Te esperamos!
+BarberFlow
+""",
+        cita=cita,
+        remitente=settings.DEFAULT_FROM_EMAIL,
+    )
+
+
+def reclamar_lote(desde, hasta, flag, construir, tamano=TAMANO_LOTE):
+    """
+    Reclama hasta `tamano` citas de la ventana, encola sus recordatorios
+    y enciende `flag`. Devuelve cuántas citas procesó.
+    """
+    with transaction.atomic():
+        citas = list(
+            Cita.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                fecha_hora__gte=desde,
+                fecha_hora__lte=hasta,
+                estado__in=ESTADOS_RECORDATORIO,
+                **{flag: False},
+            ).select_related('cliente', 'barbero', 'servicio', 'sucursal').order_by('fecha_hora', 'id')[:tamano]
+        )
+        if not citas:
+            return 0
+        correos.encolar([construir(cita) for cita in citas], programar=False)
+        Cita.objects.filter(id__in=[c.id for c in citas]).update(**{flag: True})
+    return len(citas)
+
+
+def procesar_ventana(desde, hasta, flag, construir, tamano=TAMANO_LOTE):
+    """
+    Procesa la ventana completa por lotes y envía lo encolado.
+
+    Devuelve las métricas de la corrida: citas, lotes, enviados,
+    fallidos, segundos y citas_por_seg.
+    """
+    inicio = time.monotonic()
+    citas = lotes = 0
+    while True:
+        procesadas = reclamar_lote(desde, hasta, flag, construir, tamano)
+        if not procesadas:
+            break
+        citas += procesadas
+        lotes += 1
+        if procesadas < tamano:
+            break
+
+    enviados, fallidos = correos.drenar() if citas else (0, 0)
+    segundos = time.monotonic() - inicio
+    metricas = {
+        'citas': citas,
+        'lotes': lotes,
+        'enviados': enviados,
+        'fallidos': fallidos,
+        'segundos': round(segundos, 3),
+        'citas_por_seg': round(citas / segundos, 1) if segundos else 0,
+    }
+    logger.info("Recordatorios %s: %s", flag, metricas)
+    return metricas
+
+
+def recordatorios_2h(ahora=None, tamano=TAMANO_LOTE):
+    ahora = ahora or timezone.now()
+    inicio = ahora + timedelta(hours=2)
+    return procesar_ventana(inicio, inicio + timedelta(minutes=10), 'recordatorio_enviado', mensaje_2h, tamano)
+
+
+def recordatorios_24h(ahora=None, tamano=TAMANO_LOTE):
+    ahora = ahora or timezone.now()
+    inicio = ahora + timedelta(hours=24)
+    return procesar_ventana(inicio, inicio + timedelta(minutes=30), 'recordatorio_24h_enviado', mensaje_24h, tamano)
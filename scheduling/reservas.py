@@ -0,0 +1,148 @@
+import random
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import F
+
+from core.models import Barbero
+from .disponibilidad import ESTADOS_BLOQUEANTES
+from .models import Cita
+
+# Reintentos cuando el motor reporta la base bloqueada (SQLite)
+REINTENTOS_BLOQUEO = 10
+ESPERA_BLOQUEO_SEG = 0.05
+
+# exclusion_violation en PostgreSQL
+SQLSTATE_EXCLUSION = '23P01'
+
+
+class SlotOcupado(Exception):
+    """El intervalo pedido se solapa con otra cita del barbero"""
+
+
+def hay_solapamiento(barbero, inicio, fin, excluir_id=None):
+    """True si alguna cita bloqueante del barbero se cruza con [inicio, fin)"""
+    qs = Cita.objects.filter(
+        barbero=barbero,
+        estado__in=ESTADOS_BLOQUEANTES,
+        fecha_hora__lt=fin,
+        fecha_hora_fin__gt=inicio,
+    )
+    if excluir_id:
+        qs = qs.exclude(id=excluir_id)
+    return qs.exists()
+
+
+def bloquear_agenda(barbero):
+    """
+    Serializa las reservas de un barbero dentro de la transacción actual.
+
+    Con SELECT ... FOR UPDATE sobre la fila del barbero donde el motor lo
+    soporta; en SQLite se hace una escritura nula que toma el lock de
+    escritura de la base antes de validar el solapamiento.
+    """
+    if connection.features.has_select_for_update:
+        Barbero.objects.select_for_update().filter(id=barbero.id).exists()
+    else:
+        Barbero.objects.filter(id=barbero.id).update(activo=F('activo'))
+
+
+def _en_agenda_bloqueada(barbero, inicio, fin, operacion, excluir_id=None):
+    """
+    Ejecuta `operacion()` en una transacción con la agenda del barbero
+    bloqueada, si [inicio, fin) no se cruza con otra cita bloqueante.
+
+    En PostgreSQL la restricción de exclusión cita_sin_solapamiento es la
+    garantía final; en el resto de motores lo es el bloqueo de agenda.
+    Quien pierde una carrera recibe SlotOcupado. Si la base está
+    bloqueada (SQLite) se reintenta, salvo dentro de una transacción
+    externa, que ya no se puede repetir desde aquí.
+    """
+    for intento in range(REINTENTOS_BLOQUEO):
+        try:
+            with transaction.atomic():
+                bloquear_agenda(barbero)
+                if hay_solapamiento(barbero, inicio, fin, excluir_id=excluir_id):
+                    raise SlotOcupado()
+                return operacion()
+        except IntegrityError as e:
+            if getattr(e.__cause__, 'sqlstate', None) == SQLSTATE_EXCLUSION:
+                raise SlotOcupado() from e
+            raise
+        except OperationalError:
+            if intento == REINTENTOS_BLOQUEO - 1 or connection.in_atomic_block:
+                raise
+            time.sleep(ESPERA_BLOQUEO_SEG * (intento + 1) * random.uniform(0.5, 1.5))
+
+
+def reservar_cita(cliente, barbero, sucursal, servicio, fecha_hora, al_crear=None, **campos):
+    """
+    HU25: Crea la cita reservando [fecha_hora, fecha_hora + duración).
+
+    `al_crear(cita)` corre en la misma transacción, con la agenda aún
+    bloqueada (promociones, avisos): si falla no queda cita. Puede
+    ejecutarse más de una vez si la base pide reintentar.
+    """
+    fin = fecha_hora + timedelta(minutes=servicio.duracion_minutos)
+
+    def operacion():
+        cita = Cita.objects.create(
+            cliente=cliente,
+            barbero=barbero,
+            sucursal=sucursal,
+            servicio=servicio,
+            fecha_hora=fecha_hora,
+            precio=servicio.precio,
+            **campos
+        )
+        if al_crear is not None:
+            al_crear(cita)
+        return cita
+
+    return _en_agenda_bloqueada(barbero, fecha_hora, fin, operacion)
+
+
+def mover_cita(cita, fecha_hora, guardar=None):
+    """
+    HU11: Lleva la cita a [fecha_hora, fecha_hora + duración) por el mismo
+    camino que una reserva nueva (bloqueo, solapamiento, exclusión).
+
+    `guardar` persiste el cambio (por defecto, cita.reprogramar). Devuelve
+    la cita o lanza SlotOcupado.
+    """
+    fin = fecha_hora + timedelta(minutes=cita.servicio.duracion_minutos)
+
+    def operacion():
+        if guardar is None:
+            cita.reprogramar(fecha_hora)
+        else:
+            guardar()
+        return cita
+
+    return _en_agenda_bloqueada(cita.barbero, fecha_hora, fin, operacion, excluir_id=cita.id)
+
+
+def citas_solapadas():
+    """
+    Citas bloqueantes que se cruzan con otra más antigua (menor id) del
+    mismo barbero, como [(cita_id, conservada_id)]. Las ya conservadas
+    forman por barbero intervalos disjuntos, así cada cita se compara
+    solo con su vecina anterior.
+    """
+    conservadas = defaultdict(list)
+    solapadas = []
+    filas = Cita.objects.filter(
+        estado__in=ESTADOS_BLOQUEANTES,
+        fecha_hora_fin__isnull=False,
+    ).order_by('id').values_list('id', 'barbero_id', 'fecha_hora', 'fecha_hora_fin')
+    for cita_id, barbero_id, inicio, fin in filas.iterator():
+        intervalos = conservadas[barbero_id]
+        idx = bisect_left(intervalos, (fin,))
+        if idx and intervalos[idx - 1][1] > inicio:
+            solapadas.append((cita_id, intervalos[idx - 1][2]))
+            continue
+        insort(intervalos, (inicio, fin, cita_id))
+    return solapadas
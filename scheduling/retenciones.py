@@ -0,0 +1,164 @@
+"""
+Retenciones temporales de slots durante el checkout.
+
+Al elegir un horario el cliente lo retiene RETENCION_TTL_SEG segundos en
+la caché (Redis en producción). Mientras dure, el motor de disponibilidad
+lo muestra ocupado para los demás y confirmar_reserva lo rechaza a otros
+usuarios; al confirmar se convierte en Cita y se libera. Si nadie
+confirma, la caché lo expira sola.
+
+Claves:
+- retenciones:<barbero_id>:<fecha>        -> {usuario_id: retención} del día (autoritativa)
+- retenciones_bloqueo:<barbero_id>:<fecha> -> candado (cache.add) para modificar el índice
+- retencion_usuario:<usuario_id>          -> (barbero_id, fechas) retenidos por el usuario
+
+El índice solo se lee y escribe con su candado tomado, así dos retenciones
+simultáneas no se pisan, y cada retención nueva se compara por intervalo
+[inicio, fin) con las de otros usuarios, no solo por hora de inicio.
+"""
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+RETENCION_TTL_SEG = 5 * 60
+
+# El candado expira solo si un proceso muere con él tomado
+BLOQUEO_TTL_SEG = 5
+ESPERA_BLOQUEO_SEG = 2
+
+
+def _clave_dia(barbero_id, fecha):
+    return f"retenciones:{barbero_id}:{fecha.isoformat()}"
+
+
+def _clave_bloqueo(barbero_id, fecha):
+    return f"retenciones_bloqueo:{barbero_id}:{fecha.isoformat()}"
+
+
+def _clave_usuario(usuario_id):
+    return f"retencion_usuario:{usuario_id}"
+
+
+def _fechas(inicio, fin):
+    """Fechas locales que toca [inicio, fin)"""
+    primera = timezone.localtime(inicio).date()
+    ultima = timezone.localtime(fin - timedelta(microseconds=1)).date()
+    return [primera + timedelta(days=i) for i in range((ultima - primera).days + 1)]
+
+
+@contextmanager
+def _bloqueo(barbero_id, fechas):
+    """
+    Toma los candados de los índices del barbero para las fechas (en orden,
+    para no cruzarse con otro proceso). Entrega False si no lo logra en
+    ESPERA_BLOQUEO_SEG.
+    """
+    tomados = []
+    try:
+        for fecha in sorted(fechas):
+            clave = _clave_bloqueo(barbero_id, fecha)
+            limite = time.monotonic() + ESPERA_BLOQUEO_SEG
+            while not cache.add(clave, 1, BLOQUEO_TTL_SEG):
+                if time.monotonic() > limite:
+                    yield False
+                    return
+                time.sleep(0.01)
+            tomados.append(clave)
+        yield True
+    finally:
+        cache.delete_many(tomados)
+
+
+def _vigentes(indice, ahora):
+    return {usuario_id: r for usuario_id, r in (indice or {}).items() if r['expira'] > ahora}
+
+
+def retenciones_activas(barbero_ids, fechas, excluir_usuario_id=None):
+    """
+    Retenciones vigentes de los barberos en las fechas dadas.
+
+    Devuelve {barbero_id: [(inicio, fin), ...]} ordenado por inicio, sin
+    las del usuario `excluir_usuario_id`. Es una sola lectura a la caché
+    (los índices) sin importar cuántos barberos haya.
+    """
+    claves_dia = [_clave_dia(b_id, fecha) for b_id in barbero_ids for fecha in fechas]
+    if not claves_dia:
+        return {}
+    ahora = timezone.now()
+    retenidas = {}
+    for indice in cache.get_many(claves_dia).values():
+        for usuario_id, r in _vigentes(indice, ahora).items():
+            if usuario_id != excluir_usuario_id:
+                retenidas.setdefault(r['barbero_id'], set()).add((r['inicio'], r['fin']))
+    return {barbero_id: sorted(intervalos) for barbero_id, intervalos in retenidas.items()}
+
+
+def ocupado_por_otro(barbero_id, inicio, fin, usuario_id):
+    """True si otro usuario retiene un intervalo que se cruza con [inicio, fin)"""
+    for otro_inicio, otro_fin in retenciones_activas([barbero_id], _fechas(inicio, fin), usuario_id).get(barbero_id, []):
+        if otro_inicio < fin and otro_fin > inicio:
+            return True
+    return False
+
+
+def retener_slot(barbero, servicio, inicio, usuario):
+    """
+    Retiene [inicio, inicio + duración) para el usuario.
+
+    Libera la retención anterior del mismo usuario. Devuelve la fecha de
+    expiración, o None si otra persona retiene un intervalo que se cruza.
+    """
+    fin = inicio + timedelta(minutes=servicio.duracion_minutos)
+    fechas = _fechas(inicio, fin)
+    expira = timezone.now() + timedelta(seconds=RETENCION_TTL_SEG)
+    retencion = {'barbero_id': barbero.id, 'inicio': inicio, 'fin': fin, 'expira': expira}
+
+    with _bloqueo(barbero.id, fechas) as tomado:
+        if not tomado:
+            return None
+        ahora = timezone.now()
+        claves = [_clave_dia(barbero.id, fecha) for fecha in fechas]
+        indices = {clave: _vigentes(cache.get(clave), ahora) for clave in claves}
+        for indice in indices.values():
+            for usuario_id, r in indice.items():
+                if usuario_id != usuario.id and r['inicio'] < fin and r['fin'] > inicio:
+                    return None
+        for indice in indices.values():
+            indice[usuario.id] = retencion
+        cache.set_many(indices, RETENCION_TTL_SEG)
+
+    anterior = cache.get(_clave_usuario(usuario.id))
+    if anterior:
+        barbero_anterior, fechas_anteriores = anterior
+        otras = [f for f in fechas_anteriores if barbero_anterior != barbero.id or f not in fechas]
+        _quitar(usuario.id, barbero_anterior, otras)
+    cache.set(_clave_usuario(usuario.id), (barbero.id, fechas), RETENCION_TTL_SEG)
+    return expira
+
+
+def _quitar(usuario_id, barbero_id, fechas):
+    """Borra la retención del usuario de los índices del barbero"""
+    if not fechas:
+        return
+    with _bloqueo(barbero_id, fechas) as tomado:
+        if not tomado:
+            # Queda hasta que expire; no bloquea al propio usuario
+            return
+        for fecha in fechas:
+            clave = _clave_dia(barbero_id, fecha)
+            indice = cache.get(clave)
+            if indice and usuario_id in indice:
+                del indice[usuario_id]
+                cache.set(clave, indice, RETENCION_TTL_SEG)
+
+
+def liberar(usuario_id):
+    """Libera la retención del usuario (al confirmar la reserva)"""
+    clave_usuario = _clave_usuario(usuario_id)
+    anterior = cache.get(clave_usuario)
+    if anterior:
+        _quitar(usuario_id, *anterior)
+    cache.delete(clave_usuario)
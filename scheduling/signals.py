@@ -1,28 +1,105 @@
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import Signal, receiver
 from .models import Cita
 from .tasks import enviar_email_confirmacion
-from core.models import ProgramaFidelidad
+from . import ocupacion
+from .efectos import acumular_tras_commit, lote_de
+from core.models import Barbero, DiaExcepcional, HorarioDisponibilidad, ProgramaFidelidad
+
+# Cambios masivos hechos con UPDATE (sin post_save por fila); envía
+# ids=[...] y estado=<nuevo estado> una vez por lote
+citas_actualizadas_en_bloque = Signal()
+
 
 @receiver(post_save, sender=Cita)
 def cita_post_save(sender, instance: Cita, created, **kwargs):
+    # El email se encola recién tras el COMMIT para que el worker vea la cita
     if created:
-        enviar_email_confirmacion.delay(instance.id)
+        lote_de(instance).agregar(enviar_email_confirmacion.delay, instance.id)
     else:
         if instance.estado == Cita.Estado.CONFIRMADA and not instance.confirmada_email:
-            enviar_email_confirmacion.delay(instance.id)
+            lote_de(instance).agregar(enviar_email_confirmacion.delay, instance.id)
         if instance.reprogramado_count > 0 and instance.recordatorio_enviado:
             instance.recordatorio_enviado = False
             instance.save(update_fields=["recordatorio_enviado"])
+
+
+def otorgar_puntos_cita(cita):
+    """HU42: Suma los puntos del programa de fidelidad de la barbería"""
+    barberia = cita.sucursal.barberia
+    try:
+        programa = ProgramaFidelidad.objects.get(barberia=barberia, activo=True)
+        puntos = programa.puntos_por_cita
+        if puntos > 0:
+            cita.cliente.agregar_puntos(barberia.id, puntos, cita)
+    except ProgramaFidelidad.DoesNotExist:
+        pass
+
+
 @receiver(post_save, sender=Cita)
 def otorgar_puntos_fidelidad(sender, instance, created, **kwargs):
     """HU42: Otorgar puntos al completar cita"""
     if instance.estado == Cita.Estado.COMPLETADA and not created:
-        barberia = instance.sucursal.barberia
-        try:
-            programa = ProgramaFidelidad.objects.get(barberia=barberia, activo=True)
-            puntos = programa.puntos_por_cita
-            if puntos > 0:
-                instance.cliente.agregar_puntos(barberia.id, puntos, instance)
-        except ProgramaFidelidad.DoesNotExist:
-            pass
\ No newline at end of file
+        lote_de(instance).agregar(otorgar_puntos_cita, instance)
+
+def _intervalo_agenda(instance):
+    """(barbero_id, inicio, fin) de la cita tal como está en memoria, o None"""
+    barbero_id = instance.__dict__.get('barbero_id')
+    inicio = instance.__dict__.get('fecha_hora')
+    if barbero_id is None or inicio is None:
+        return None
+    return barbero_id, inicio, instance.__dict__.get('fecha_hora_fin') or inicio
+
+
+@receiver(post_init, sender=Cita)
+def recordar_intervalo_agenda(sender, instance, **kwargs):
+    """Guarda el intervalo original para rehacer también sus ticks al reprogramar"""
+    instance._intervalo_agenda_previo = _intervalo_agenda(instance)
+
+
+@receiver(post_save, sender=Cita)
+@receiver(post_delete, sender=Cita)
+def actualizar_ocupacion_cita(sender, instance, **kwargs):
+    """
+    Mantiene al día los bitmaps OcupacionDia afectados por la cita. Los
+    intervalos se juntan y se aplican una sola vez al COMMIT, así un
+    borrado en cascada no paga una actualización por cita.
+    """
+    actual = _intervalo_agenda(instance)
+    ventanas = {actual, getattr(instance, '_intervalo_agenda_previo', None)} - {None}
+    acumular_tras_commit(ocupacion.actualizar_por_cita, ventanas)
+    instance._intervalo_agenda_previo = actual
+
+
+@receiver(post_save, sender=HorarioDisponibilidad)
+@receiver(post_delete, sender=HorarioDisponibilidad)
+def invalidar_ocupacion_horario(sender, instance, **kwargs):
+    ocupacion.subir_version(Barbero.objects.filter(id=instance.barbero_id))
+
+
+@receiver(post_init, sender=Barbero)
+def recordar_sucursal_barbero(sender, instance, **kwargs):
+    instance._sucursal_previa_id = instance.__dict__.get('sucursal_principal_id')
+
+
+@receiver(post_save, sender=Barbero)
+def versionar_cambio_sucursal(sender, instance, created, **kwargs):
+    """Con otra sucursal cambian los días excepcionales que aplican a su agenda"""
+    if not created and instance.sucursal_principal_id != instance._sucursal_previa_id:
+        ocupacion.subir_version(Barbero.objects.filter(id=instance.id))
+        instance.version_agenda += 1
+    instance._sucursal_previa_id = instance.sucursal_principal_id
+
+
+@receiver(post_save, sender=DiaExcepcional)
+@receiver(post_delete, sender=DiaExcepcional)
+def invalidar_ocupacion_excepcion(sender, instance, **kwargs):
+    ocupacion.invalidar_excepcion(instance.sucursal_id, instance.fecha)
+
+
+@receiver(citas_actualizadas_en_bloque, sender=Cita)
+def actualizar_ocupacion_en_bloque(sender, ids, **kwargs):
+    ventanas = set(
+        Cita.objects.filter(id__in=ids).values_list('barbero_id', 'fecha_hora', 'fecha_hora_fin')
+    )
+    acumular_tras_commit(ocupacion.actualizar_por_cita, ventanas)
@@ -1,28 +1,30 @@
 from celery import shared_task
-from django.core.mail import send_mail
 from django.utils import timezone
 from datetime import datetime, timedelta
 from django.conf import settings
 from django.urls import reverse
-from django.db import transaction
+from django.db import connection, transaction
 from .models import Cita
 from .utils import generar_token_waitlist
 
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
 def enviar_email_confirmacion(self, cita_id: int):
+    from core.correos import encolar_email
+    from core.models import NotificacionEmail
     try:
-        cita = Cita.objects.get(id=cita_id)
-        if cita.confirmada_email:
-            return "skip"
-        send_mail(
-            subject="Confirmación de tu cita",
-            message=f"Tu cita con {cita.barbero.nombre} el {cita.fecha_hora.strftime('%d/%m %H:%M')} está registrada.",
-            from_email=None,
-            recipient_list=[cita.cliente.email],
-            fail_silently=True,
-        )
-        cita.confirmada_email = True
-        cita.save(update_fields=["confirmada_email"])
+        with transaction.atomic():
+            cita = Cita.objects.select_for_update().select_related('cliente', 'barbero').get(id=cita_id)
+            if cita.confirmada_email:
+                return "skip"
+            encolar_email(
+                cita.cliente,
+                NotificacionEmail.TipoNotificacion.CONFIRMACION_CITA,
+                "Confirmación de tu cita",
+                f"Tu cita con {cita.barbero.nombre} el {cita.fecha_hora.strftime('%d/%m %H:%M')} está registrada.",
+                cita=cita,
+            )
+            cita.confirmada_email = True
+            cita.save(update_fields=["confirmada_email"])
         return "ok"
     except Cita.DoesNotExist:
         return "no_existe"
@@ -31,38 +33,12 @@ def enviar_email_confirmacion(self, cita_id: int):
 
 @shared_task
 def enviar_recordatorios():
-    from django.core.mail import send_mail
-    from django.conf import settings
-    from .utils import firmar
-    
-    ahora = timezone.now()
-    inicio = ahora + timedelta(hours=2)
-    fin = inicio + timedelta(minutes=10)
-    
-    qs = Cita.objects.filter(
-        fecha_hora__gte=inicio,
-        fecha_hora__lte=fin,
-        recordatorio_enviado=False,
-        estado__in=[Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA],
-    ).select_related('cliente', 'barbero', 'servicio')
-    
-    enviados = 0
-    for cita in qs:
-        token_confirmar = firmar(f"cita:{cita.id}:confirmar")
-        enlace = f"{settings.SITE_URL}/scheduling/confirmar/{token_confirmar}/"
-        
-        send_mail(
-            subject="⏰ Recordatorio: Tu cita en 2 horas",
-            message=f"Hola {cita.cliente.nombre},\n\nEn 2 horas tienes cita con {cita.barbero.nombre} ({cita.servicio.nombre}) a las {cita.fecha_hora.strftime('%H:%M')}.\n\nConfirma aquí: {enlace}",
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[cita.cliente.email],
-            fail_silently=True,
-        )
-        cita.recordatorio_enviado = True
-        cita.save(update_fields=["recordatorio_enviado"])
-        enviados += 1
-    
-    return f"recordatorios={enviados}"
+    from .recordatorios import recordatorios_2h
+    m = recordatorios_2h()
+    return (
+        f"recordatorios={m['citas']} lotes={m['lotes']} enviados={m['enviados']} "
+        f"fallidos={m['fallidos']} seg={m['segundos']} citas_por_seg={m['citas_por_seg']}"
+    )
 
 @shared_task
 def limpiar_waitlist_expirada():
@@ -79,6 +55,8 @@ def limpiar_waitlist_expirada():
 
 @shared_task(bind=True, max_retries=2, default_retry_delay=30)
 def notificar_primer_waitlist(self, barbero_id, servicio_id, fecha_dia_iso):
+    from core.correos import encolar_email
+    from core.models import NotificacionEmail
     from .models import WaitlistEntry
     fecha_dia = datetime.fromisoformat(fecha_dia_iso).date()
     entry = WaitlistEntry.objects.filter(
@@ -91,9 +69,6 @@ def notificar_primer_waitlist(self, barbero_id, servicio_id, fecha_dia_iso):
     ).order_by('creado_en').first()
     if not entry:
         return "sin_entry"
-    entry.notificado_en = timezone.now()
-    entry.expiracion_notificacion = entry.notificado_en + timedelta(minutes=15)
-    entry.save(update_fields=['notificado_en', 'expiracion_notificacion'])
     token = generar_token_waitlist(entry.id)
     path = reverse('scheduling:waitlist_reclamar', args=[token])
     base = getattr(settings, 'SITE_URL', 'http://localhost:8000')
@@ -102,79 +77,81 @@ def notificar_primer_waitlist(self, barbero_id, servicio_id, fecha_dia_iso):
         f"Se liberó un turno para {entry.servicio.nombre} con {entry.barbero.nombre} el {fecha_dia}.\n"
         f"Reserva antes de 15 minutos:\n{link}"
     )
-    send_mail(
-        subject="Slot disponible",
-        message=mensaje,
-        from_email=None,
-        recipient_list=[entry.cliente.email],
-        fail_silently=True,
-    )
+    with transaction.atomic():
+        entry.notificado_en = timezone.now()
+        entry.expiracion_notificacion = entry.notificado_en + timedelta(minutes=15)
+        entry.save(update_fields=['notificado_en', 'expiracion_notificacion'])
+        encolar_email(
+            entry.cliente,
+            NotificacionEmail.TipoNotificacion.LISTA_ESPERA,
+            "Slot disponible",
+            mensaje,
+        )
     return f"notificado_entry={entry.id}"
 
 GRACIA_NO_SHOW_MIN = 15  # minutos
+LOTE_NO_SHOW = 500
 
-@shared_task
-def marcar_no_show_citas():
+def _marcar_no_show_lote(limite, tamano):
+    """
+    Pasa a NO_SHOW hasta `tamano` citas vencidas con un solo
+    UPDATE ... RETURNING id. Igual que Cita.marcar_no_show, solo cambian
+    las CONFIRMADAS y EN_PROCESO. Devuelve los ids actualizados.
+    """
+    q = connection.ops.quote_name
+    tabla = q(Cita._meta.db_table)
+    bloqueo = " FOR UPDATE SKIP LOCKED" if connection.features.has_select_for_update_skip_locked else ""
     ahora = timezone.now()
-    limite = ahora - timedelta(minutes=GRACIA_NO_SHOW_MIN)
-    qs = Cita.objects.filter(
-        fecha_hora__lt=limite,
-        estado__in=[Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA, Cita.Estado.EN_PROCESO]
-    )
-    total = qs.count()
-    if not total:
-        return "no_show=0"
-    with transaction.atomic():
-        for cita in qs.select_for_update():
-            cita.marcar_no_show()
-    return f"no_show={total}"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {tabla} SET {q('estado')} = %s, {q('actualizada_en')} = %s, {q('fecha_modificacion')} = %s "
+            f"WHERE {q('id')} IN ("
+            f"SELECT {q('id')} FROM {tabla} WHERE {q('estado')} IN (%s, %s) AND {q('fecha_hora')} < %s "
+            f"ORDER BY {q('id')} LIMIT %s{bloqueo}"
+            f") RETURNING {q('id')}",
+            [
+                Cita.Estado.NO_SHOW, ahora, ahora,
+                Cita.Estado.CONFIRMADA, Cita.Estado.EN_PROCESO, limite, tamano,
+            ],
+        )
+        return [fila[0] for fila in cursor.fetchall()]
+
+@shared_task
+def marcar_no_show_citas(tamano=LOTE_NO_SHOW):
+    import logging
+    import time
+    from .signals import citas_actualizadas_en_bloque
+    logger = logging.getLogger(__name__)
+
+    limite = timezone.now() - timedelta(minutes=GRACIA_NO_SHOW_MIN)
+    total = 0
+    tiempos = []
+    while True:
+        inicio = time.monotonic()
+        ids = _marcar_no_show_lote(limite, tamano)
+        if ids:
+            # Un solo despacho de hooks por lote en vez de post_save por cita
+            citas_actualizadas_en_bloque.send(sender=Cita, ids=ids, estado=Cita.Estado.NO_SHOW)
+        tiempos.append(round((time.monotonic() - inicio) * 1000))
+        total += len(ids)
+        if ids:
+            logger.info("no_show lote %s: %s citas en %sms", len(tiempos), len(ids), tiempos[-1])
+        if len(ids) < tamano:
+            break
+    return f"no_show={total} lotes={len(tiempos)} ms_por_lote={tiempos}"
 @shared_task
 def enviar_recordatorios_24h():
     """HU35: Recordatorios 24 horas antes"""
-    from django.core.mail import send_mail
-    from django.conf import settings
-    
-    ahora = timezone.now()
-    inicio = ahora + timedelta(hours=24)
-    fin = inicio + timedelta(minutes=30)
-    
-    citas = Cita.objects.filter(
-        fecha_hora__gte=inicio,
-        fecha_hora__lte=fin,
-        recordatorio_24h_enviado=False,
-        estado__in=[Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA],
-    ).select_related('cliente', 'barbero', 'servicio', 'sucursal')
-    
-    enviados = 0
-    for cita in citas:
-        from .utils import firmar
-        token_cancelar = firmar(f"cita:{cita.id}:cancelar")
-        enlace_cancelar = f"{settings.SITE_URL}/scheduling/cancelar/{token_cancelar}/"
-        
-        send_mail(
-            subject="📅 Recordatorio: Tu cita mañana",
-            message=f"""Hola {cita.cliente.nombre},
-
-Te recordamos tu cita para mañana:
-📅 Fecha: {cita.fecha_hora.strftime('%d/%m/%Y')}
-🕐 Hora: {cita.fecha_hora.strftime('%H:%M')}
-💈 Barbero: {cita.barbero.nombre}
-📍 Sucursal: {cita.sucursal.nombre} - {cita.sucursal.direccion}
-✂️ Servicio: {cita.servicio.nombre}
-💰 Precio: ${cita.precio}
-
-Si necesitas cancelar: {enlace_cancelar}
+    from .recordatorios import recordatorios_24h
+    m = recordatorios_24h()
+    return (
+        f"recordatorios_24h={m['citas']} lotes={m['lotes']} enviados={m['enviados']} "
+        f"fallidos={m['fallidos']} seg={m['segundos']} citas_por_seg={m['citas_por_seg']}"
+    )
 
-¡Te esperamos!
-BarberFlow
-""",
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[cita.cliente.email],
-            fail_silently=True,
-        )
-        
-        cita.recordatorio_24h_enviado = True
-        cita.save(update_fields=['recordatorio_24h_enviado'])
-        enviados += 1
-    
-    return f"recordatorios_24h={enviados}"
\ No newline at end of file
+@shared_task
+def enviar_emails_pendientes():
+    """Drena la bandeja de salida (EmailSaliente) por lotes"""
+    from core.correos import drenar
+    enviados, fallidos = drenar()
+    return f"emails_enviados={enviados} fallidos={fallidos}"
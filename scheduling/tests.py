@@ -34,7 +34,7 @@ class ValoracionTest(TestCase):
         self.assertTrue(hasattr(self.cita, 'valoracion'))
 
 # Create your tests here.
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta
@@ -125,4 +125,810 @@ class CitaTestCase(TestCase):
         self.assertEqual(WaitlistEntry.objects.count(), 1)
         entry = WaitlistEntry.objects.first()
         self.assertTrue(entry.activo)
-        self.assertFalse(entry.utilizado)
\ No newline at end of file
+        self.assertFalse(entry.utilizado)
+
+class SlotsBaseTestCase(TestCase):
+    """Sucursal con tres barberos que atienden de 9 a 13 en `self.fecha`"""
+
+    def setUp(self):
+        from datetime import time
+        from core.models import HorarioDisponibilidad
+        self.nosotros = Nosotros.objects.create(nombre='Slots', activo=True)
+        self.barberia = Barberia.objects.create(nosotros=self.nosotros, nombre='Slots', activa=True)
+        self.sucursal = Sucursal.objects.create(barberia=self.barberia, nombre='Suc', activo=True)
+        self.servicio = Servicio.objects.create(
+            barberia=self.barberia, nombre='Corte', precio=10000, duracion_minutos=30
+        )
+        self.cliente = User.objects.create_user(email='slots@test.com', password='x', nombre='Cliente')
+        self.fecha = (timezone.now() + timedelta(days=2)).date()
+        self.barberos = []
+        for i in range(3):
+            u = User.objects.create_user(
+                email=f'slots{i}@test.com', password='x', nombre=f'B{i}', rol=User.Roles.BARBERO
+            )
+            b = Barbero.objects.create(
+                nosotros=self.nosotros, user=u, nombre=f'B{i}', sucursal_principal=self.sucursal
+            )
+            HorarioDisponibilidad.objects.create(
+                barbero=b, dia_semana=self.fecha.weekday(), hora_inicio=time(9, 0), hora_fin=time(13, 0)
+            )
+            self.barberos.append(b)
+
+    def _crear_cita(self, barbero, hora, minuto=0, estado=Cita.Estado.PENDIENTE):
+        from datetime import datetime, time
+        return Cita.objects.create(
+            cliente=self.cliente, barbero=barbero, sucursal=self.sucursal, servicio=self.servicio,
+            fecha_hora=timezone.make_aware(datetime.combine(self.fecha, time(hora, minuto))),
+            precio=self.servicio.precio, estado=estado
+        )
+
+
+
+class SlotEngineTest(SlotsBaseTestCase):
+    """Motor de slots: mismo resultado que la versión por-slot y consultas constantes"""
+
+    def test_slots_excluyen_citas_bloqueantes(self):
+        from datetime import time
+        from scheduling.disponibilidad import obtener_slots_disponibles
+        barbero = self.barberos[0]
+        self._crear_cita(barbero, 10)
+        self._crear_cita(barbero, 11, 30, estado=Cita.Estado.CANCELADA_CLIENTE)
+        slots = obtener_slots_disponibles(barbero, self.fecha.isoformat(), 30)
+        # Misma regla que hay_solapamiento: solo choca [10:00, 10:30)
+        esperados = [time(9, 0), time(9, 30), time(10, 30), time(11, 0), time(11, 30), time(12, 0), time(12, 30)]
+        self.assertEqual(slots, esperados)
+
+    def test_slots_respetan_el_fin_de_citas_largas(self):
+        from datetime import datetime, time
+        from scheduling.disponibilidad import obtener_slots_disponibles
+        from scheduling.reservas import hay_solapamiento
+        barbero = self.barberos[0]
+        largo = Servicio.objects.create(
+            barberia=self.servicio.barberia, nombre='Color', precio=30000, duracion_minutos=90
+        )
+        Cita.objects.create(
+            cliente=self.cliente, barbero=barbero, sucursal=self.sucursal, servicio=largo,
+            fecha_hora=timezone.make_aware(datetime.combine(self.fecha, time(10, 0))), precio=largo.precio
+        )
+        slots = obtener_slots_disponibles(barbero, self.fecha, 30)
+        self.assertEqual(slots, [time(9, 0), time(9, 30), time(11, 30), time(12, 0), time(12, 30)])
+        for hora in (time(9, 0), time(11, 0), time(11, 30)):
+            inicio = timezone.make_aware(datetime.combine(self.fecha, hora))
+            self.assertEqual(
+                hora in slots, not hay_solapamiento(barbero, inicio, inicio + timedelta(minutes=30))
+            )
+
+    def test_consultas_constantes_por_llamada(self):
+        """Benchmark: las consultas no crecen con los slots ni con las citas del día"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from scheduling.disponibilidad import obtener_slots_disponibles
+        barbero = self.barberos[0]
+        conteos = []
+        for hora in (9, 10, 11, 12):
+            with CaptureQueriesContext(connection) as ctx:
+                obtener_slots_disponibles(barbero, self.fecha, 30)
+            conteos.append(len(ctx))
+            self._crear_cita(barbero, hora)
+        self.assertEqual(set(conteos), {3})
+
+    def test_sucursal_carga_citas_en_una_consulta(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from scheduling import disponibilidad
+        for b in self.barberos:
+            self._crear_cita(b, 9)
+        inicio, fin = disponibilidad.rango_dia(self.fecha)
+        with CaptureQueriesContext(connection) as ctx:
+            ocupados = disponibilidad.cargar_intervalos_bloqueantes([b.id for b in self.barberos], inicio, fin)
+        self.assertEqual(len(ctx), 1)
+        for b in self.barberos:
+            self.assertEqual(len(ocupados[b.id]), 1)
+
+    def test_matriz_sucursal_consultas_constantes(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from scheduling.disponibilidad import matriz_disponibilidad_sucursal
+        self._crear_cita(self.barberos[1], 9)
+        with CaptureQueriesContext(connection) as ctx:
+            matriz = matriz_disponibilidad_sucursal(self.sucursal, self.servicio, self.fecha)
+        # barberos, día excepcional, horarios, citas y valoraciones agrupadas
+        self.assertEqual(len(ctx), 5)
+        self.assertEqual(len(matriz['barberos']), 3)
+        fila = next(f for f in matriz['barberos'] if f['barbero'] == self.barberos[1])
+        self.assertEqual(len(fila['disponible']), len(matriz['slots']))
+        self.assertFalse(fila['disponible'][0])
+
+    def test_endpoint_json_matriz(self):
+        self.client.force_login(self.cliente)
+        url = reverse('scheduling:disponibilidad_sucursal_json', args=[self.sucursal.id, self.servicio.id])
+        response = self.client.get(url, {'fecha': self.fecha.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['fecha'], self.fecha.isoformat())
+        self.assertEqual(data['slots'][0], '09:00')
+        self.assertEqual(len(data['barberos']), 3)
+        pagina = self.client.get(
+            reverse('scheduling:seleccionar_barbero_fecha', args=[self.sucursal.id, self.servicio.id]),
+            {'fecha': self.fecha.isoformat()}
+        )
+        self.assertContains(pagina, '09:00')
+
+    def test_buscar_proximos_slots_corta_al_llegar_al_limite(self):
+        from datetime import datetime, time
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from scheduling.disponibilidad import buscar_proximos_slots
+        self._crear_cita(self.barberos[0], 9)
+        with CaptureQueriesContext(connection) as ctx:
+            slots = buscar_proximos_slots(self.servicio, self.sucursal, limite=3, horizonte_dias=30)
+        # barberos, una ventana de OcupacionDia y su materialización
+        # (horarios, días excepcionales, citas y upsert)
+        self.assertEqual(len(ctx), 6)
+        nueve = timezone.make_aware(datetime.combine(self.fecha, time(9, 0)))
+        self.assertEqual([s['fecha_hora'] for s in slots], [nueve, nueve, nueve + timedelta(minutes=30)])
+        self.assertEqual([s['barbero'] for s in slots], [self.barberos[1], self.barberos[2], self.barberos[0]])
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(buscar_proximos_slots(self.servicio, self.sucursal, limite=3, horizonte_dias=30), slots)
+        self.assertEqual(len(ctx), 2)
+        self.assertFalse(any('scheduling_cita' in q['sql'] for q in ctx.captured_queries))
+
+    def test_buscar_proximos_slots_de_un_barbero(self):
+        self.client.force_login(self.cliente)
+        url = reverse('scheduling:proximos_slots_json', args=[self.sucursal.id, self.servicio.id])
+        response = self.client.get(url, {'barbero': self.barberos[2].id, 'limite': 10, 'horizonte': 21})
+        data = response.json()['slots']
+        self.assertEqual(len(data), 10)
+        self.assertTrue(all(s['barbero_id'] == self.barberos[2].id for s in data))
+        self.assertEqual(data[0]['fecha_hora'], f'{self.fecha.isoformat()}T09:00:00')
+
+    def _slots_bitmap(self, barbero):
+        from scheduling.disponibilidad import buscar_proximos_slots
+        slots = buscar_proximos_slots(
+            self.servicio, self.sucursal, desde=self.fecha.isoformat(), limite=50, horizonte_dias=1, barbero=barbero
+        )
+        return [timezone.localtime(s['fecha_hora']).time() for s in slots]
+
+    def test_bitmap_coincide_con_motor(self):
+        from datetime import datetime, time
+        from scheduling.disponibilidad import obtener_slots_disponibles
+        largo = Servicio.objects.create(barberia=self.barberia, nombre='Color', precio=30000, duracion_minutos=95)
+        self._crear_cita(self.barberos[0], 10)
+        Cita.objects.create(
+            cliente=self.cliente, barbero=self.barberos[1], sucursal=self.sucursal, servicio=largo,
+            fecha_hora=timezone.make_aware(datetime.combine(self.fecha, time(9, 40))), precio=largo.precio
+        )
+        for b in self.barberos:
+            self.assertEqual(self._slots_bitmap(b), obtener_slots_disponibles(b, self.fecha, 30))
+        self.assertEqual(self._slots_bitmap(self.barberos[1])[:2], [time(9, 0), time(11, 30)])
+
+    def test_bitmap_cubre_citas_que_pasan_la_medianoche(self):
+        from datetime import datetime, time
+        from scheduling import ocupacion
+        inicio = timezone.make_aware(datetime.combine(self.fecha, time(23, 30)))
+        bits = ocupacion.bits_por_dia({7: [(inicio, inicio + timedelta(hours=1))]})
+        self.assertEqual(bits[(7, self.fecha)], ocupacion.mascara(282, 288))
+        self.assertEqual(bits[(7, self.fecha + timedelta(days=1))], ocupacion.mascara(0, 6))
+
+    def test_bitmap_se_actualiza_desde_senales(self):
+        from datetime import time
+        from scheduling.models import OcupacionDia
+        barbero = self.barberos[0]
+        self._slots_bitmap(barbero)
+        with self.captureOnCommitCallbacks(execute=True):
+            cita = self._crear_cita(barbero, 11)
+        self.assertNotIn(time(11, 0), self._slots_bitmap(barbero))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.estado = Cita.Estado.CANCELADA_CLIENTE
+            cita.save()
+        self.assertIn(time(11, 0), self._slots_bitmap(barbero))
+
+        # Un cambio de horario no borra filas: sube la versión y se rehacen al leer
+        barbero.horarios.update(activo=False)
+        barbero.horarios.first().save()
+        self.assertTrue(OcupacionDia.objects.filter(barbero=barbero).exists())
+        barbero.refresh_from_db()
+        self.assertEqual(self._slots_bitmap(barbero), [])
+
+    def test_bitmap_no_caduca_por_antiguedad(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from scheduling.models import OcupacionDia
+        barbero = self.barberos[0]
+        slots = self._slots_bitmap(barbero)
+        OcupacionDia.objects.update(actualizado_en=timezone.now() - timedelta(days=2))
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._slots_bitmap(barbero), slots)
+        self.assertEqual(len(ctx), 1)
+
+    def test_cambio_de_sucursal_rematerializa(self):
+        from scheduling.models import OcupacionDia
+        barbero = self.barberos[0]
+        self._slots_bitmap(barbero)
+        version = barbero.version_agenda
+        barbero.sucursal_principal = Sucursal.objects.create(barberia=self.barberia, nombre='Otra', activo=True)
+        barbero.save()
+        barbero.refresh_from_db()
+        self.assertEqual(barbero.version_agenda, version + 1)
+        self._slots_bitmap(barbero)
+        self.assertEqual(OcupacionDia.objects.get(barbero=barbero, fecha=self.fecha).version_agenda, version + 1)
+
+    def test_cancelar_respeta_el_tick_compartido_con_la_cita_contigua(self):
+        from datetime import datetime, time
+        from scheduling import ocupacion
+        from scheduling.models import OcupacionDia
+        barbero = self.barberos[0]
+        corto = Servicio.objects.create(barberia=self.barberia, nombre='Perfilado', precio=5000, duracion_minutos=33)
+        self._slots_bitmap(barbero)
+        with self.captureOnCommitCallbacks(execute=True):
+            primera = Cita.objects.create(
+                cliente=self.cliente, barbero=barbero, sucursal=self.sucursal, servicio=corto,
+                fecha_hora=timezone.make_aware(datetime.combine(self.fecha, time(9, 0))), precio=corto.precio
+            )
+            Cita.objects.create(
+                cliente=self.cliente, barbero=barbero, sucursal=self.sucursal, servicio=corto,
+                fecha_hora=timezone.make_aware(datetime.combine(self.fecha, time(9, 33))), precio=corto.precio
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            primera.estado = Cita.Estado.CANCELADA_CLIENTE
+            primera.save()
+
+        incremental = OcupacionDia.objects.get(barbero=barbero, fecha=self.fecha)
+        desde_cero = ocupacion.materializar([barbero], [self.fecha])[0]
+        self.assertEqual(bytes(incremental.ocupado), bytes(desde_cero.ocupado))
+        self.assertTrue(ocupacion.a_bits(incremental.ocupado) >> (9 * 60 + 30) // 5 & 1)
+
+    def test_borrado_en_cascada_recalcula_una_vez(self):
+        from datetime import time
+        from unittest import mock
+        from scheduling import ocupacion
+        barbero = self.barberos[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            for hora in (9, 10, 11, 12):
+                self._crear_cita(barbero, hora)
+        self.assertEqual(self._slots_bitmap(barbero), [time(9, 30), time(10, 30), time(11, 30), time(12, 30)])
+
+        with mock.patch.object(ocupacion, 'actualizar_por_cita', wraps=ocupacion.actualizar_por_cita) as actualizar, \
+                mock.patch.object(ocupacion, 'materializar') as materializar:
+            with self.captureOnCommitCallbacks(execute=True):
+                Cita.objects.filter(barbero=barbero).delete()
+        actualizar.assert_called_once()
+        materializar.assert_not_called()
+        self.assertEqual(len(self._slots_bitmap(barbero)), 8)
+
+
+class ReservaConcurrenteTest(TransactionTestCase):
+    """HU25: reservas paralelas sobre el mismo slot producen una sola cita"""
+
+    def setUp(self):
+        nosotros = Nosotros.objects.create(nombre='Carrera', activo=True)
+        barberia = Barberia.objects.create(nosotros=nosotros, nombre='Carrera', activa=True)
+        self.sucursal = Sucursal.objects.create(barberia=barberia, nombre='Suc', activo=True)
+        self.servicio = Servicio.objects.create(barberia=barberia, nombre='Corte', precio=10000, duracion_minutos=45)
+        u = User.objects.create_user(email='carrera_b@test.com', password='x', nombre='B', rol=User.Roles.BARBERO)
+        self.barbero = Barbero.objects.create(nosotros=nosotros, user=u, nombre='B', sucursal_principal=self.sucursal)
+        self.clientes = [
+            User.objects.create_user(email=f'carrera{i}@test.com', password='x', nombre=f'C{i}')
+            for i in range(8)
+        ]
+        self.inicio = (timezone.now() + timedelta(days=3)).replace(hour=10, minute=0, second=0, microsecond=0)
+
+    def test_solapamiento_por_duracion(self):
+        from scheduling.reservas import SlotOcupado, reservar_cita
+        reservar_cita(self.clientes[0], self.barbero, self.sucursal, self.servicio, self.inicio)
+        with self.assertRaises(SlotOcupado):
+            reservar_cita(self.clientes[1], self.barbero, self.sucursal, self.servicio,
+                          self.inicio + timedelta(minutes=30))
+        reservar_cita(self.clientes[1], self.barbero, self.sucursal, self.servicio,
+                      self.inicio + timedelta(minutes=45))
+        self.assertEqual(Cita.objects.count(), 2)
+
+    def test_reservas_paralelas_mismo_slot(self):
+        import threading
+        from django.db import connection
+        from scheduling.reservas import SlotOcupado, reservar_cita
+        resultados = []
+        barrera = threading.Barrier(len(self.clientes))
+
+        def reservar(cliente):
+            try:
+                barrera.wait()
+                reservar_cita(cliente, self.barbero, self.sucursal, self.servicio, self.inicio)
+                resultados.append('ok')
+            except SlotOcupado:
+                resultados.append('ocupado')
+            except Exception as e:
+                resultados.append(repr(e))
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=reservar, args=(c,)) for c in self.clientes]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+
+        self.assertEqual(resultados.count('ok'), 1, resultados)
+        self.assertEqual(resultados.count('ocupado'), len(self.clientes) - 1, resultados)
+        self.assertEqual(Cita.objects.filter(barbero=self.barbero).count(), 1)
+
+    def test_reprogramar_usa_el_bloqueo_de_reserva(self):
+        from scheduling.reservas import SlotOcupado, mover_cita, reservar_cita
+        primera = reservar_cita(self.clientes[0], self.barbero, self.sucursal, self.servicio, self.inicio)
+        segunda = reservar_cita(self.clientes[1], self.barbero, self.sucursal, self.servicio,
+                                self.inicio + timedelta(hours=2))
+        with self.assertRaises(SlotOcupado):
+            mover_cita(segunda, self.inicio + timedelta(minutes=30))
+        segunda.refresh_from_db()
+        self.assertEqual(segunda.reprogramado_count, 0)
+
+        # Puede solaparse consigo misma
+        mover_cita(primera, self.inicio + timedelta(minutes=15))
+        primera.refresh_from_db()
+        self.assertEqual(primera.fecha_hora, self.inicio + timedelta(minutes=15))
+
+    def test_vista_reprogramar_rechaza_solapamiento(self):
+        from scheduling.reservas import reservar_cita
+        reservar_cita(self.clientes[0], self.barbero, self.sucursal, self.servicio, self.inicio)
+        propia = reservar_cita(self.clientes[1], self.barbero, self.sucursal, self.servicio,
+                               self.inicio + timedelta(hours=2))
+        self.client.force_login(self.clientes[1])
+        destino = timezone.localtime(self.inicio + timedelta(minutes=30))
+        respuesta = self.client.post(
+            reverse('scheduling:reprogramar_cita', args=[propia.id]),
+            {'fecha_hora': destino.strftime('%Y-%m-%dT%H:%M:%S')}
+        )
+        self.assertRedirects(respuesta, reverse('scheduling:reprogramar_cita', args=[propia.id]),
+                             fetch_redirect_response=False)
+        propia.refresh_from_db()
+        self.assertEqual(propia.fecha_hora, self.inicio + timedelta(hours=2))
+
+
+class MigracionSolapamientosTest(TransactionTestCase):
+    """0011 no toca las citas existentes; resolver_solapamientos las cancela avisando"""
+
+    def setUp(self):
+        from django.db import connection
+        from django.db.migrations.executor import MigrationExecutor
+        self.executor = MigrationExecutor(connection)
+        self.final = self.executor.loader.graph.leaf_nodes()
+
+    def tearDown(self):
+        self.executor.loader.build_graph()
+        self.executor.migrate(self.final)
+
+    def test_migrar_conserva_las_citas_y_el_comando_las_resuelve(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from core.models import EmailSaliente
+
+        destino = [('scheduling', '0010_ocupaciondia')]
+        self.executor.migrate(destino)
+        apps = self.executor.loader.project_state(destino).apps
+
+        nosotros = apps.get_model('core', 'Nosotros').objects.create(nombre='Migra', activo=True)
+        barberia = apps.get_model('core', 'Barberia').objects.create(nosotros=nosotros, nombre='Migra', activa=True)
+        sucursal = apps.get_model('core', 'Sucursal').objects.create(barberia=barberia, nombre='Suc', activo=True)
+        servicio = apps.get_model('core', 'Servicio').objects.create(
+            barberia=barberia, nombre='Corte', precio=10000, duracion_minutos=60
+        )
+        Usuario = apps.get_model('core', 'User')
+        cliente = Usuario.objects.create(email='migra_c@test.com', nombre='C')
+        barbero = apps.get_model('core', 'Barbero').objects.create(
+            nosotros=nosotros, user=Usuario.objects.create(email='migra_b@test.com', nombre='B'),
+            nombre='B', sucursal_principal=sucursal
+        )
+        Historica = apps.get_model('scheduling', 'Cita')
+        inicio = timezone.now().replace(microsecond=0) + timedelta(days=2)
+
+        def crear(desplazamiento, estado='pendiente'):
+            return Historica.objects.create(
+                cliente=cliente, barbero=barbero, sucursal=sucursal, servicio=servicio,
+                fecha_hora=inicio + timedelta(minutes=desplazamiento), precio=10000, estado=estado
+            ).id
+
+        antigua = crear(30)
+        nueva = crear(0, estado='confirmada')
+        contigua = crear(90)
+        cancelada = crear(45, estado='cancelada_cliente')
+
+        self.executor.loader.build_graph()
+        self.executor.migrate(self.final)
+        estados = dict(Cita.objects.values_list('id', 'estado'))
+        self.assertEqual(estados[nueva], Cita.Estado.CONFIRMADA)
+
+        salida = StringIO()
+        call_command('resolver_solapamientos', stdout=salida)
+        self.assertIn(f'#{nueva}', salida.getvalue())
+        self.assertEqual(Cita.objects.get(id=nueva).estado, Cita.Estado.CONFIRMADA)
+
+        call_command('resolver_solapamientos', '--aplicar', stdout=StringIO())
+        estados = dict(Cita.objects.values_list('id', 'estado'))
+        self.assertEqual(estados[antigua], Cita.Estado.PENDIENTE)
+        self.assertEqual(estados[nueva], Cita.Estado.CANCELADA_ADMIN)
+        self.assertEqual(estados[contigua], Cita.Estado.PENDIENTE)
+        self.assertEqual(estados[cancelada], Cita.Estado.CANCELADA_CLIENTE)
+        self.assertIn(f'#{antigua}', Cita.objects.get(id=nueva).motivo_cancelacion)
+        self.assertEqual(list(EmailSaliente.objects.values_list('cita_id', 'para')), [(nueva, 'migra_c@test.com')])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RetencionSlotTest(SlotsBaseTestCase):
+    """Retenciones de checkout: ocultan el slot a otros y se convierten en cita"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        super().setUp()
+        cache.clear()
+        self.otro = User.objects.create_user(email='otro@test.com', password='x', nombre='Otro')
+        self.barbero = self.barberos[0]
+        self.hora = f'{self.fecha.isoformat()}T10:00:00'
+
+    def _retener(self, usuario):
+        self.client.force_login(usuario)
+        url = reverse('scheduling:retener_slot', args=[self.sucursal.id, self.servicio.id, self.barbero.id])
+        return self.client.post(url, {'fecha_hora': self.hora})
+
+    def test_retencion_bloquea_a_otros_usuarios(self):
+        from datetime import time
+        from scheduling.disponibilidad import obtener_slots_disponibles
+        self.assertEqual(self._retener(self.cliente).status_code, 200)
+        self.assertEqual(self._retener(self.otro).status_code, 409)
+        self.assertNotIn(time(10, 0), obtener_slots_disponibles(self.barbero, self.fecha, 30, usuario=self.otro))
+        self.assertIn(time(10, 0), obtener_slots_disponibles(self.barbero, self.fecha, 30, usuario=self.cliente))
+
+        confirmar = reverse('scheduling:confirmar_reserva', args=[self.sucursal.id, self.servicio.id, self.barbero.id])
+        self.client.post(confirmar, {'fecha_hora': self.hora})
+        self.assertFalse(Cita.objects.filter(cliente=self.otro).exists())
+
+    def test_confirmar_convierte_retencion_en_cita(self):
+        from scheduling import retenciones
+        self._retener(self.cliente)
+        confirmar = reverse('scheduling:confirmar_reserva', args=[self.sucursal.id, self.servicio.id, self.barbero.id])
+        self.client.post(confirmar, {'fecha_hora': self.hora})
+        self.assertTrue(Cita.objects.filter(cliente=self.cliente, barbero=self.barbero).exists())
+        self.assertEqual(retenciones.retenciones_activas([self.barbero.id], [self.fecha]), {})
+
+    def test_retenciones_solapadas_con_otro_inicio(self):
+        from datetime import datetime, time
+        from scheduling import retenciones
+        diez = timezone.make_aware(datetime.combine(self.fecha, time(10, 0)))
+        self.assertIsNotNone(retenciones.retener_slot(self.barbero, self.servicio, diez, self.cliente))
+        self.assertIsNone(retenciones.retener_slot(
+            self.barbero, self.servicio, diez + timedelta(minutes=15), self.otro
+        ))
+        self.assertIsNotNone(retenciones.retener_slot(
+            self.barbero, self.servicio, diez + timedelta(minutes=30), self.otro
+        ))
+        # Cambiar de horario libera el anterior
+        self.assertIsNotNone(retenciones.retener_slot(
+            self.barbero, self.servicio, diez + timedelta(hours=2), self.cliente
+        ))
+        self.assertEqual(
+            retenciones.retenciones_activas([self.barbero.id], [self.fecha]),
+            {self.barbero.id: [(diez + timedelta(minutes=30), diez + timedelta(minutes=60)),
+                               (diez + timedelta(hours=2), diez + timedelta(hours=2, minutes=30))]}
+        )
+
+    def test_retenciones_paralelas_no_se_pisan(self):
+        import threading
+        from datetime import datetime, time
+        from types import SimpleNamespace
+        from scheduling import retenciones
+        diez = timezone.make_aware(datetime.combine(self.fecha, time(10, 0)))
+        usuarios = [SimpleNamespace(id=1000 + i) for i in range(8)]
+        resultados = []
+        barrera = threading.Barrier(len(usuarios))
+
+        def retener(i, usuario):
+            barrera.wait()
+            inicio = diez + timedelta(minutes=5 * (i % 3))
+            resultados.append(retenciones.retener_slot(self.barbero, self.servicio, inicio, usuario))
+
+        hilos = [threading.Thread(target=retener, args=(i, u)) for i, u in enumerate(usuarios)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+
+        self.assertEqual(len([r for r in resultados if r is not None]), 1)
+        self.assertEqual(len(retenciones.retenciones_activas([self.barbero.id], [self.fecha])[self.barbero.id]), 1)
+
+
+class EfectosPostCommitTest(SlotsBaseTestCase):
+    """Los efectos de una reserva se disparan una sola vez tras el COMMIT"""
+
+    def test_reserva_despacha_efectos_tras_commit(self):
+        from unittest import mock
+        barbero = self.barberos[0]
+        confirmar = reverse('scheduling:confirmar_reserva', args=[self.sucursal.id, self.servicio.id, barbero.id])
+        self.client.force_login(self.cliente)
+        with mock.patch('scheduling.views.enviar_notificacion') as notificar, \
+                mock.patch('scheduling.signals.enviar_email_confirmacion') as email:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                self.client.post(confirmar, {'fecha_hora': f'{self.fecha.isoformat()}T10:00:00'})
+                notificar.assert_not_called()
+                email.delay.assert_not_called()
+            for callback in callbacks:
+                callback()
+
+        cita = Cita.objects.get(cliente=self.cliente)
+        email.delay.assert_called_once_with(cita.id)
+        notificar.assert_called_once()
+        self.assertEqual(notificar.call_args.kwargs['data']['cita_id'], cita.id)
+
+    def test_fallo_de_la_promocion_no_deja_cita_ni_efectos(self):
+        from unittest import mock
+        from scheduling.models import Promocion
+        barbero = self.barberos[0]
+        Promocion.objects.create(
+            barberia=self.sucursal.barberia, nombre='P', codigo='P10', tipo_descuento='porcentaje', valor=10,
+            fecha_inicio=timezone.localdate() - timedelta(days=1), fecha_fin=self.fecha + timedelta(days=1),
+        )
+        confirmar = reverse('scheduling:confirmar_reserva', args=[self.sucursal.id, self.servicio.id, barbero.id])
+        self.client.force_login(self.cliente)
+        with mock.patch('scheduling.views.enviar_notificacion') as notificar, \
+                mock.patch('scheduling.signals.enviar_email_confirmacion') as email, \
+                mock.patch.object(Promocion, 'es_valida', side_effect=RuntimeError('fallo')), \
+                self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post(
+                confirmar, {'fecha_hora': f'{self.fecha.isoformat()}T10:00:00', 'codigo_promocion': 'P10'}
+            )
+        self.assertRedirects(respuesta, reverse('scheduling:seleccionar_barberia'), fetch_redirect_response=False)
+        self.assertFalse(Cita.objects.exists())
+        notificar.assert_not_called()
+        email.delay.assert_not_called()
+
+    def test_promocion_se_aplica_antes_del_commit(self):
+        from unittest import mock
+        from scheduling.models import Promocion
+        barbero = self.barberos[0]
+        promocion = Promocion.objects.create(
+            barberia=self.sucursal.barberia, nombre='P', codigo='P10', tipo_descuento='porcentaje', valor=10,
+            fecha_inicio=timezone.localdate() - timedelta(days=1), fecha_fin=self.fecha + timedelta(days=1),
+        )
+        confirmar = reverse('scheduling:confirmar_reserva', args=[self.sucursal.id, self.servicio.id, barbero.id])
+        self.client.force_login(self.cliente)
+        precios = []
+        with mock.patch('scheduling.views.enviar_notificacion'), \
+                mock.patch('scheduling.signals.enviar_email_confirmacion') as email:
+            # El email lee la cita tras el COMMIT: ya con el descuento
+            email.delay.side_effect = lambda cita_id: precios.append(Cita.objects.get(id=cita_id).precio)
+            with self.captureOnCommitCallbacks(execute=True):
+                respuesta = self.client.post(
+                    confirmar, {'fecha_hora': f'{self.fecha.isoformat()}T10:00:00', 'codigo_promocion': 'P10'}
+                )
+        self.assertRedirects(respuesta, reverse('scheduling:mis_citas'), fetch_redirect_response=False)
+        cita = Cita.objects.get()
+        self.assertEqual(cita.promocion, promocion)
+        self.assertEqual(precios, [cita.precio])
+        self.assertLess(cita.precio, self.servicio.precio)
+        promocion.refresh_from_db()
+        self.assertEqual(promocion.usos_actuales, 1)
+
+    def test_efecto_fallido_no_detiene_al_resto(self):
+        from scheduling.efectos import LoteEfectos
+        ejecutados = []
+
+        def falla():
+            raise RuntimeError('fallo')
+
+        lote = LoteEfectos()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            lote.agregar(falla)
+            lote.agregar(ejecutados.append, 'puntos')
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(ejecutados, ['puntos'])
+
+
+class NoShowEnBloqueTest(SlotsBaseTestCase):
+    """marcar_no_show_citas actualiza por lotes y despacha hooks una vez por lote"""
+
+    def test_marca_no_show_por_lotes(self):
+        from scheduling.signals import citas_actualizadas_en_bloque
+        from scheduling.tasks import marcar_no_show_citas
+
+        ayer = timezone.now() - timedelta(days=1)
+        vencidas = [
+            Cita.objects.create(
+                cliente=self.cliente, barbero=self.barberos[i], sucursal=self.sucursal, servicio=self.servicio,
+                fecha_hora=ayer, precio=self.servicio.precio, estado=Cita.Estado.CONFIRMADA,
+            )
+            for i in range(3)
+        ]
+        pendiente = Cita.objects.create(
+            cliente=self.cliente, barbero=self.barberos[0], sucursal=self.sucursal, servicio=self.servicio,
+            fecha_hora=ayer + timedelta(hours=2), precio=self.servicio.precio, estado=Cita.Estado.PENDIENTE,
+        )
+        reciente = Cita.objects.create(
+            cliente=self.cliente, barbero=self.barberos[1], sucursal=self.sucursal, servicio=self.servicio,
+            fecha_hora=timezone.now() - timedelta(minutes=5), precio=self.servicio.precio, estado=Cita.Estado.CONFIRMADA,
+        )
+
+        lotes = []
+
+        def receptor(sender, ids, **kwargs):
+            lotes.append(sorted(ids))
+
+        citas_actualizadas_en_bloque.connect(receptor, sender=Cita)
+        try:
+            resultado = marcar_no_show_citas(tamano=2)
+        finally:
+            citas_actualizadas_en_bloque.disconnect(receptor, sender=Cita)
+
+        self.assertTrue(resultado.startswith('no_show=3 lotes=2'))
+        self.assertEqual(sorted(i for lote in lotes for i in lote), sorted(c.id for c in vencidas))
+        self.assertEqual(len(lotes), 2)
+        self.assertEqual(Cita.objects.filter(estado=Cita.Estado.NO_SHOW).count(), 3)
+        pendiente.refresh_from_db()
+        reciente.refresh_from_db()
+        self.assertEqual(pendiente.estado, Cita.Estado.PENDIENTE)
+        self.assertEqual(reciente.estado, Cita.Estado.CONFIRMADA)
+
+
+class BandejaEmailsTest(SlotsBaseTestCase):
+    """Los emails se encolan con el cambio de estado y se envían por lotes"""
+
+    def _citas_manana(self, n):
+        from datetime import timedelta
+        inicio = timezone.now() + timedelta(hours=24, minutes=5)
+        citas = []
+        for i in range(n):
+            cliente = User.objects.create_user(email=f'c{i}@test.com', password='x', nombre=f'C{i}')
+            citas.append(Cita.objects.create(
+                cliente=cliente, barbero=self.barberos[i % 3], sucursal=self.sucursal,
+                servicio=self.servicio, fecha_hora=inicio, precio=self.servicio.precio,
+            ))
+        return citas
+
+    @override_settings(SITE_URL='http://testserver')
+    def test_recordatorios_se_envian_en_lote_por_una_conexion(self):
+        from unittest import mock
+        from django.core import mail
+        from core import correos
+        from core.models import EmailSaliente, NotificacionEmail
+        from scheduling.tasks import enviar_recordatorios_24h
+
+        citas = self._citas_manana(4)
+        with mock.patch('core.correos.get_connection', wraps=correos.get_connection) as conexion:
+            resultado = enviar_recordatorios_24h()
+        self.assertTrue(resultado.startswith('recordatorios_24h=4 lotes=1 enviados=4 fallidos=0'))
+        conexion.assert_called_once()
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertFalse(EmailSaliente.objects.filter(estado=EmailSaliente.Estado.PENDIENTE).exists())
+        self.assertFalse(Cita.objects.filter(id__in=[c.id for c in citas], recordatorio_24h_enviado=False).exists())
+        self.assertEqual(NotificacionEmail.objects.filter(exitoso=True).count(), 4)
+        self.assertTrue(enviar_recordatorios_24h().startswith('recordatorios_24h=0'))
+
+    @override_settings(SITE_URL='http://testserver')
+    def test_recordatorios_por_lotes_un_update_por_lote(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from scheduling.recordatorios import recordatorios_24h
+
+        self._citas_manana(5)
+        with CaptureQueriesContext(connection) as ctx:
+            metricas = recordatorios_24h(tamano=2)
+        self.assertEqual((metricas['citas'], metricas['lotes'], metricas['enviados']), (5, 3, 5))
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "scheduling_cita"')]
+        self.assertEqual(len(updates), 3)
+
+    def test_fallo_reintenta_solo_el_mensaje_afectado(self):
+        from unittest import mock
+        from django.core import mail
+        from django.core.mail.backends.locmem import EmailBackend
+        from core import correos
+        from core.models import EmailSaliente, NotificacionEmail
+
+        enviar = EmailBackend.send_messages
+
+        def falla_uno(backend, mensajes):
+            if mensajes[0].to == ['c1@test.com']:
+                raise OSError('buzón lleno')
+            return enviar(backend, mensajes)
+
+        for cita in self._citas_manana(3):
+            correos.encolar_email(cita.cliente, NotificacionEmail.TipoNotificacion.PROMOCION, 'Hola', 'x')
+        with mock.patch.object(EmailBackend, 'send_messages', falla_uno):
+            self.assertEqual(correos.drenar(), (2, 1))
+
+        fallido = EmailSaliente.objects.get(para='c1@test.com')
+        self.assertEqual(fallido.estado, EmailSaliente.Estado.PENDIENTE)
+        self.assertEqual(fallido.intentos, 1)
+        self.assertGreater(fallido.proximo_intento, timezone.now())
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_lote_se_envia_sin_transaccion_abierta(self):
+        from unittest import mock
+        from django.db import connection
+        from core import correos
+        from core.models import EmailSaliente, NotificacionEmail
+
+        for cita in self._citas_manana(2):
+            correos.encolar_email(cita.cliente, NotificacionEmail.TipoNotificacion.PROMOCION, 'Hola', 'x')
+        profundidad = len(connection.atomic_blocks)
+        enviar = correos.enviar
+
+        def enviar_sin_locks(emails):
+            self.assertEqual(len(connection.atomic_blocks), profundidad)
+            estados = set(EmailSaliente.objects.filter(id__in=[e.id for e in emails]).values_list('estado', flat=True))
+            self.assertEqual(estados, {EmailSaliente.Estado.ENVIANDO})
+            return enviar(emails)
+
+        with mock.patch('core.correos.enviar', side_effect=enviar_sin_locks):
+            self.assertEqual(correos.enviar_lote(), (2, 0))
+        self.assertEqual(EmailSaliente.objects.filter(estado=EmailSaliente.Estado.ENVIADO).count(), 2)
+
+    def test_reclamo_vencido_se_vuelve_a_enviar(self):
+        from core import correos
+        from core.models import EmailSaliente, NotificacionEmail
+
+        for cita in self._citas_manana(2):
+            correos.encolar_email(cita.cliente, NotificacionEmail.TipoNotificacion.PROMOCION, 'Hola', 'x')
+        vigente, vencido = EmailSaliente.objects.order_by('id')
+        EmailSaliente.objects.filter(id=vigente.id).update(
+            estado=EmailSaliente.Estado.ENVIANDO, proximo_intento=timezone.now() + timedelta(minutes=5)
+        )
+        EmailSaliente.objects.filter(id=vencido.id).update(
+            estado=EmailSaliente.Estado.ENVIANDO, proximo_intento=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual([e.id for e in correos.reclamar()], [vencido.id])
+        self.assertEqual(correos.reclamar(), [])
+
+    def test_rollback_descarta_el_email(self):
+        from django.db import transaction
+        from core import correos
+        from core.models import EmailSaliente, NotificacionEmail
+
+        try:
+            with transaction.atomic():
+                correos.encolar_email(self.cliente, NotificacionEmail.TipoNotificacion.PROMOCION, 'Hola', 'x')
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(EmailSaliente.objects.exists())
+
+    def test_comando_recordatorios_solo_ventana_pendiente(self):
+        from io import StringIO
+        from django.core import mail
+        from django.core.management import call_command
+        from core.models import NotificacionEmail
+
+        citas = self._citas_manana(3)
+        lejana = Cita.objects.create(
+            cliente=self.cliente, barbero=self.barberos[0], sucursal=self.sucursal,
+            servicio=self.servicio, fecha_hora=timezone.now() + timedelta(days=5), precio=self.servicio.precio,
+        )
+        NotificacionEmail.objects.create(
+            destinatario=citas[0].cliente, cita=citas[0],
+            tipo=NotificacionEmail.TipoNotificacion.RECORDATORIO_CITA, asunto='ya enviado',
+        )
+
+        salida = StringIO()
+        call_command('enviar_recordatorios', '--batch-size', '1', '--concurrency', '2', stdout=salida)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['c1@test.com', 'c2@test.com'])
+        self.assertIn('Citas en ventana: 2 (2 lotes', salida.getvalue())
+        self.assertFalse(NotificacionEmail.objects.filter(cita=lejana).exists())
+
+        call_command('enviar_recordatorios', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_drenado_no_toma_recordatorios_del_comando(self):
+        from io import StringIO
+        from unittest import mock
+        from django.core import mail
+        from django.core.management import call_command
+        from core import correos
+        from core.models import EmailSaliente
+
+        self._citas_manana(2)
+        # El comando queda "enviando": sus filas ya están reclamadas
+        with mock.patch('core.correos.enviar', return_value=([], [])):
+            call_command('enviar_recordatorios', stdout=StringIO())
+        self.assertEqual(
+            set(EmailSaliente.objects.values_list('estado', flat=True)), {EmailSaliente.Estado.ENVIANDO}
+        )
+        self.assertEqual(correos.drenar(), (0, 0))
+        self.assertEqual(len(mail.outbox), 0)
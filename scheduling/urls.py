@@ -11,6 +11,9 @@ urlpatterns = [
     path('sucursal/<int:barberia_id>/', views.seleccionar_sucursal, name='seleccionar_sucursal'),
     path('servicio/<int:sucursal_id>/', views.seleccionar_servicio, name='seleccionar_servicio'),
     path('barbero/<int:sucursal_id>/<int:servicio_id>/', views.seleccionar_barbero_fecha, name='seleccionar_barbero_fecha'),
+    path('barbero/<int:sucursal_id>/<int:servicio_id>/disponibilidad.json', views.disponibilidad_sucursal_json, name='disponibilidad_sucursal_json'),
+    path('proximos/<int:sucursal_id>/<int:servicio_id>/', views.proximos_slots_json, name='proximos_slots_json'),
+    path('retener/<int:sucursal_id>/<int:servicio_id>/<int:barbero_id>/', views.retener_slot, name='retener_slot'),
     path('confirmar/<int:sucursal_id>/<int:servicio_id>/<int:barbero_id>/', views.confirmar_reserva, name='confirmar_reserva'),
     path('mis-citas/', views.mis_citas, name='mis_citas'),
     path('cita/<int:cita_id>/cancelar/', views.cancelar_cita, name='cancelar_cita'),  # ← NUEVA
@@ -21,5 +24,6 @@ urlpatterns = [
     path('historial/', views.historial_citas, name='historial_citas'),
     path('reprogramar/<int:cita_id>/', views.reprogramar_cita, name='reprogramar_cita'),
     path('buscar/', views.buscar_barberos, name='buscar_barberos'),
+    path('puntos/<int:barberia_id>/canjear/', views.canjear_puntos, name='canjear_puntos'),
     path('cita/<int:cita_id>/atender/', views.marcar_cita_atendida, name='marcar_cita_atendida'),
 ]
\ No newline at end of file
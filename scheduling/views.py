@@ -1,4 +1,5 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
@@ -9,8 +10,10 @@ from .models import Cita, Valoracion, WaitlistEntry
 from .forms import ValoracionForm, WaitlistForm
 from .utils import verificar_firma
 from .utils import enviar_notificacion
+from .efectos import lote_de
+from . import disponibilidad, reservas, retenciones
 from django.db import transaction
-from django.db.models import Avg, Count, Sum, Q
+from django.db.models import Avg, Count, F, Sum, Q
 from django.contrib import messages
 from core.models import ProgramaFidelidad, HistorialPuntos
 from django.core.mail import send_mail
@@ -37,90 +40,98 @@ def seleccionar_servicio(request, sucursal_id):
 def seleccionar_barbero_fecha(request, sucursal_id, servicio_id):
     sucursal = get_object_or_404(Sucursal, id=sucursal_id)
     servicio = get_object_or_404(Servicio, id=servicio_id)
-    barberos = Barbero.objects.filter(sucursal_principal=sucursal, user__is_active=True)
     fecha_seleccionada = request.GET.get('fecha', timezone.now().date().isoformat())
-    disponibilidad = {}
-    barberos_info = []
-    for barbero in barberos:
-        slots = obtener_slots_disponibles(barbero, fecha_seleccionada, servicio.duracion_minutos)
-        promedio = barbero.valoraciones.aggregate(models.Avg('puntuacion'))['puntuacion__avg']
-        total_valoraciones = barbero.valoraciones.count()
-        barberos_info.append({
-            'barbero': barbero,
-            'promedio': round(promedio, 1) if promedio else 0,
-            'total': total_valoraciones,
-            'slots': slots
-        })
-        if slots:
-            disponibilidad[barbero.id] = slots
+    matriz = disponibilidad.matriz_disponibilidad_sucursal(
+        sucursal, servicio, fecha_seleccionada, usuario=request.user
+    )
     return render(request, 'scheduling/seleccionar_barbero_fecha.html', {
         'sucursal': sucursal,
         'servicio': servicio,
-        'barberos_info': barberos_info,
-        'disponibilidad': disponibilidad,
+        'barberos_info': matriz['barberos'],
+        'disponibilidad': {fila['barbero'].id: fila['slots'] for fila in matriz['barberos'] if fila['slots']},
+        'slots_sucursal': matriz['slots'],
         'fecha_seleccionada': fecha_seleccionada
     })
 
-def obtener_slots_disponibles(barbero, fecha_str, duracion_minutos):
-    """HU24 + HU40: Slots dinámicos, sin solapamiento y con días excepcionales"""
-    from core.models import DiaExcepcional, HorarioDisponibilidad
-    from datetime import datetime, timedelta
-    from django.utils import timezone
-
-    fecha = datetime.fromisoformat(fecha_str).date()
-    dia_semana = fecha.weekday()
-
-    # Validar que no sea una fecha pasada
-    if fecha < timezone.now().date():
-        return []
-
-    # Verificar si hay excepción para ese día
-    excepcion = DiaExcepcional.objects.filter(
-        sucursal=barbero.sucursal_principal,
-        fecha=fecha
-    ).first()
-
-    if excepcion:
-        if excepcion.tipo == DiaExcepcional.TipoExcepcion.CERRADO:
-            return []  # No hay slots disponibles
-        # Usar horario especial
-        disponibilidades = [
-            type('obj', (object,), {
-                'hora_inicio': excepcion.hora_apertura,
-                'hora_fin': excepcion.hora_cierre
-            })
-        ]
-    else:
-        # Horario normal
-        disponibilidades = HorarioDisponibilidad.objects.filter(
-            barbero=barbero,
-            dia_semana=dia_semana,
-            activo=True
-        ).order_by('hora_inicio')
+@login_required
+def disponibilidad_sucursal_json(request, sucursal_id, servicio_id):
+    """Matriz barbero × slot en JSON para refrescar la página de reserva"""
+    sucursal = get_object_or_404(Sucursal, id=sucursal_id)
+    servicio = get_object_or_404(Servicio, id=servicio_id)
+    fecha_seleccionada = request.GET.get('fecha', timezone.now().date().isoformat())
+    try:
+        matriz = disponibilidad.matriz_disponibilidad_sucursal(
+            sucursal, servicio, fecha_seleccionada, usuario=request.user
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Formato de fecha inválido'}, status=400)
+    return JsonResponse(disponibilidad.matriz_a_json(matriz))
 
-    if not disponibilidades:
-        return []
+@login_required
+def proximos_slots_json(request, sucursal_id, servicio_id):
+    """Próximos horarios libres de la sucursal (opcionalmente de un barbero) en JSON"""
+    sucursal = get_object_or_404(Sucursal, id=sucursal_id)
+    servicio = get_object_or_404(Servicio, id=servicio_id)
+    barbero = None
+    barbero_id = request.GET.get('barbero')
+    if barbero_id and barbero_id.isdigit():
+        barbero = get_object_or_404(Barbero, id=barbero_id, sucursal_principal=sucursal)
 
-    slots = []
-    intervalo = timedelta(minutes=30)  # Slots cada 30 min
+    try:
+        limite = min(int(request.GET.get('limite', 10)), 50)
+        horizonte = min(int(request.GET.get('horizonte', 14)), 60)
+        desde = request.GET.get('desde') or None
+        slots = disponibilidad.buscar_proximos_slots(
+            servicio, sucursal, desde=desde, limite=limite, horizonte_dias=horizonte,
+            barbero=barbero, usuario=request.user
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+
+    return JsonResponse({
+        'slots': [
+            {
+                'fecha_hora': timezone.localtime(s['fecha_hora']).strftime('%Y-%m-%dT%H:%M:%S'),
+                'barbero_id': s['barbero'].id,
+                'barbero': s['barbero'].nombre,
+            }
+            for s in slots
+        ]
+    })
 
-    for disp in disponibilidades:
-        hora_actual = timezone.make_aware(datetime.combine(fecha, disp.hora_inicio))
-        hora_fin = timezone.make_aware(datetime.combine(fecha, disp.hora_fin))
+def obtener_slots_disponibles(barbero, fecha_str, duracion_minutos):
+    """HU24 + HU40: Slots dinámicos, sin solapamiento y con días excepcionales"""
+    return disponibilidad.obtener_slots_disponibles(barbero, fecha_str, duracion_minutos)
 
-        while hora_actual + timedelta(minutes=duracion_minutos) <= hora_fin:
-            hora_fin_servicio = hora_actual + timedelta(minutes=duracion_minutos)
-            conflicto = Cita.objects.filter(
-                barbero=barbero,
-                estado__in=[Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA],
-                fecha_hora__lt=hora_fin_servicio,
-                fecha_hora__gte=hora_actual - timedelta(minutes=duracion_minutos)
-            ).exists()
-            if not conflicto and hora_actual >= timezone.now():
-                slots.append(hora_actual.time())
-            hora_actual += intervalo
+@login_required
+def retener_slot(request, sucursal_id, servicio_id, barbero_id):
+    """Retiene el slot elegido mientras el cliente completa la reserva"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
 
-    return slots
+    try:
+        fecha_hora = datetime.strptime(request.POST.get('fecha_hora', ''), '%Y-%m-%dT%H:%M:%S')
+        fecha_hora = timezone.make_aware(fecha_hora)
+    except ValueError:
+        return JsonResponse({'error': 'Formato de fecha inválido'}, status=400)
+    if fecha_hora < timezone.now():
+        return JsonResponse({'error': 'No puedes reservar en el pasado'}, status=400)
+
+    barbero = get_object_or_404(Barbero, id=barbero_id, sucursal_principal_id=sucursal_id)
+    servicio = get_object_or_404(Servicio, id=servicio_id)
+    fin = fecha_hora + timedelta(minutes=servicio.duracion_minutos)
+
+    expira = None
+    if not reservas.hay_solapamiento(barbero, fecha_hora, fin):
+        expira = retenciones.retener_slot(barbero, servicio, fecha_hora, request.user)
+    if expira is None:
+        return JsonResponse({'error': 'Ese horario ya no está disponible'}, status=409)
+
+    return JsonResponse({
+        'fecha_hora': fecha_hora.strftime('%Y-%m-%dT%H:%M:%S'),
+        'expira_en': expira.isoformat(),
+        'ttl': retenciones.RETENCION_TTL_SEG,
+    })
 
 @login_required
 def confirmar_reserva(request, sucursal_id, servicio_id, barbero_id):
@@ -150,96 +161,98 @@ def confirmar_reserva(request, sucursal_id, servicio_id, barbero_id):
         messages.error(request, "No puedes reservar en el pasado")
         return redirect('scheduling:seleccionar_barberia')
 
-    conflicto = Cita.objects.filter(
-        barbero=barbero,
-        fecha_hora=fecha_hora,
-        estado__in=[Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA]
-    ).exists()
-    if conflicto:
+    fin = fecha_hora + timedelta(minutes=servicio.duracion_minutos)
+    if retenciones.ocupado_por_otro(barbero.id, fecha_hora, fin, request.user.id):
         messages.error(request, "Ese horario ya no está disponible")
         return redirect('scheduling:seleccionar_barberia')
 
-    try:
-        with transaction.atomic():
-            cita = Cita.objects.create(
-                cliente=request.user,
-                barbero=barbero,
-                sucursal=sucursal,
-                servicio=servicio,
-                fecha_hora=fecha_hora,
-                estado=Cita.Estado.PENDIENTE,
-                precio=servicio.precio
-            )
-
-            descuento_aplicado = 0
-            if codigo_promocion:
-                try:
-                    from core.models import Promocion
-                    
-                    promocion = Promocion.objects.get(
-                        codigo=codigo_promocion,
-                        barberia=sucursal.barberia,
-                        activa=True
-                    )
-                    
-                    valida, msg = promocion.es_valida(
-                        cliente=request.user,
-                        servicio=servicio,
-                        monto=cita.precio
-                    )
-                    
-                    if valida:
-                        descuento = promocion.calcular_descuento(cita.precio)
-                        cita.descuento_aplicado = descuento
-                        cita.precio = max(0, cita.precio - descuento)
-                        cita.promocion = promocion
-                        cita.save(update_fields=['descuento_aplicado', 'precio', 'promocion'])
-                        
-                        promocion.usos_actuales += 1
-                        promocion.save(update_fields=['usos_actuales'])
-                        
-                        descuento_aplicado = descuento
-                        messages.success(
-                            request, 
-                            f"✓ Descuento aplicado: ${descuento:,.0f} ({promocion.nombre})"
-                        )
-                    else:
-                        messages.warning(request, f"⚠️ Promoción no válida: {msg}")
-                        
-                except Promocion.DoesNotExist:
-                    messages.error(request, "❌ Código de promoción no encontrado")
-
-            # HU25: Notificación tiempo real al barbero
-            enviar_notificacion(
-                user_id=barbero.user_id,
-                tipo='nueva_cita',
-                mensaje=f'Nueva cita {servicio.nombre} con {request.user.nombre} el {fecha_hora.strftime("%d/%m %H:%M")}',
-                data={'cita_id': cita.id, 'fecha': fecha_hora.isoformat()}
-            )
-            precio_final = cita.precio
-            if descuento_aplicado > 0:
-                messages.success(
-                    request, 
-                    f'✅ Cita reservada para {fecha_hora.strftime("%d/%m/%Y %H:%M")}. '
-                    f'Precio final: ${precio_final:,.0f} (Descuento: ${descuento_aplicado:,.0f})'
+    # Mensajes de la promoción: se muestran solo si la reserva se confirma
+    avisos = []
+
+    def aplicar_promocion_y_notificar(cita):
+        """Corre dentro de la transacción de la reserva (ver reservar_cita)"""
+        avisos.clear()
+        if codigo_promocion:
+            # La de scheduling (la que referencia Cita.promocion), no core.Promocion
+            from .models import Promocion
+            try:
+                promocion = Promocion.objects.get(
+                    codigo=codigo_promocion,
+                    barberia=sucursal.barberia,
+                    activo=True
                 )
+            except Promocion.DoesNotExist:
+                avisos.append((messages.error, "❌ Código de promoción no encontrado"))
             else:
-                messages.success(
-                    request, 
-                    f'✅ Cita reservada para {fecha_hora.strftime("%d/%m/%Y %H:%M")}. '
-                    f'Precio: ${precio_final:,.0f}'
+                valida, msg = promocion.es_valida(
+                    cliente=request.user,
+                    servicio=servicio,
+                    monto=cita.precio
                 )
+                if valida:
+                    descuento = promocion.calcular_descuento(cita.precio)
+                    cita.descuento_aplicado = descuento
+                    cita.precio = max(0, cita.precio - descuento)
+                    cita.promocion = promocion
+                    cita.save(update_fields=['descuento_aplicado', 'precio', 'promocion'])
+
+                    promocion.usos_actuales = F('usos_actuales') + 1
+                    promocion.save(update_fields=['usos_actuales'])
+
+                    avisos.append((messages.success, f"✓ Descuento aplicado: ${descuento:,.0f} ({promocion.nombre})"))
+                else:
+                    avisos.append((messages.warning, f"⚠️ Promoción no válida: {msg}"))
+
+        # HU25: Notificación tiempo real al barbero (tras el COMMIT)
+        lote_de(cita).agregar(
+            enviar_notificacion,
+            user_id=barbero.user_id,
+            tipo='nueva_cita',
+            mensaje=f'Nueva cita {servicio.nombre} con {request.user.nombre} el {fecha_hora.strftime("%d/%m %H:%M")}',
+            data={'cita_id': cita.id, 'fecha': fecha_hora.isoformat()}
+        )
 
-        
+    try:
+        # Fuera de transacciones externas para que reservar_cita pueda
+        # reintentar si la base está bloqueada; la promoción y el aviso
+        # van en la misma transacción que la cita
+        cita = reservas.reservar_cita(
+            cliente=request.user,
+            barbero=barbero,
+            sucursal=sucursal,
+            servicio=servicio,
+            fecha_hora=fecha_hora,
+            estado=Cita.Estado.PENDIENTE,
+            al_crear=aplicar_promocion_y_notificar,
+        )
+    except reservas.SlotOcupado:
+        messages.error(request, "Ese horario ya no está disponible")
+        return redirect('scheduling:seleccionar_barberia')
     except Exception as e:
-         messages.error(request, f'❌ Error al reservar: {str(e)}')
+        messages.error(request, f'❌ Error al reservar: {str(e)}')
+        return redirect('scheduling:seleccionar_barberia')
 
+    for nivel, texto in avisos:
+        nivel(request, texto)
+    if cita.descuento_aplicado:
+        messages.success(
+            request,
+            f'✅ Cita reservada para {fecha_hora.strftime("%d/%m/%Y %H:%M")}. '
+            f'Precio final: ${cita.precio:,.0f} (Descuento: ${cita.descuento_aplicado:,.0f})'
+        )
+    else:
+        messages.success(
+            request,
+            f'✅ Cita reservada para {fecha_hora.strftime("%d/%m/%Y %H:%M")}. '
+            f'Precio: ${cita.precio:,.0f}'
+        )
+    retenciones.liberar(request.user.id)
 
     return redirect('scheduling:mis_citas')
 
 @login_required
 def mis_citas(request):
-    citas = Cita.objects.filter(cliente=request.user).select_related('sucursal','barbero','servicio','promocion').order_by('-fecha_hora')
+    citas = Cita.objects.filter(cliente=request.user).select_related('sucursal','barbero','servicio','promocion','valoracion').order_by('-fecha_hora')
     sucursales = {}
     for c in citas:
         sucursales[c.sucursal_id] = c.sucursal
@@ -295,13 +308,13 @@ def valorar_cita(request, cita_id):
 @login_required
 def ver_valoraciones_barbero(request, barbero_id):
     barbero = get_object_or_404(Barbero, id=barbero_id)
-    valoraciones = Valoracion.objects.filter(barbero=barbero).select_related('cliente', 'cita')
-    promedio = valoraciones.aggregate(models.Avg('puntuacion'))['puntuacion__avg'] or 0
+    valoraciones = Valoracion.objects.filter(barbero=barbero).select_related('cliente', 'cita__servicio')
+    stats = valoraciones.aggregate(promedio=Avg('puntuacion'), total=Count('id'))
     return render(request, 'scheduling/valoraciones_barbero.html', {
         'barbero': barbero,
         'valoraciones': valoraciones,
-        'promedio': round(promedio, 1),
-        'total': valoraciones.count()
+        'promedio': round(stats['promedio'] or 0, 1),
+        'total': stats['total']
     })
 
 @login_required
@@ -407,18 +420,13 @@ def reprogramar_cita(request, cita_id):
             nueva_fecha = datetime.strptime(nueva_fecha_str, '%Y-%m-%dT%H:%M:%S')
             nueva_fecha = timezone.make_aware(nueva_fecha)
             
-            # Validar que el slot esté disponible
-            conflicto = Cita.objects.filter(
-                barbero=cita.barbero,
-                fecha_hora=nueva_fecha,
-                estado__in=[Cita.Estado.PENDIENTE, Cita.Estado.CONFIRMADA]
-            ).exclude(id=cita.id).exists()
-            
-            if conflicto:
+            # Mismo camino que una reserva: bloqueo de agenda + solapamiento
+            try:
+                reservas.mover_cita(cita, nueva_fecha)
+            except reservas.SlotOcupado:
                 messages.error(request, "Ese horario ya no está disponible")
                 return redirect('scheduling:reprogramar_cita', cita_id)
             
-            cita.reprogramar(nueva_fecha)
             messages.success(request, f"Cita reprogramada para {nueva_fecha.strftime('%d/%m/%Y %H:%M')}")
             return redirect('scheduling:mis_citas')
             
@@ -456,21 +464,24 @@ def buscar_barberos(request):
     if servicio_id:
         barberos = barberos.filter(servicios__id=servicio_id)
 
+    # Promedio y total de valoraciones en la misma consulta que los barberos
+    barberos = barberos.annotate(
+        promedio_valoracion=Avg('valoraciones__puntuacion'),
+        total_valoraciones=Count('valoraciones', distinct=True)
+    )
     if min_valoracion is not None:
-        barberos = barberos.annotate(
-            promedio_valoracion=Avg('valoraciones__puntuacion')
-        ).filter(promedio_valoracion__gte=min_valoracion)
+        barberos = barberos.filter(promedio_valoracion__gte=min_valoracion)
 
     barberos = barberos.distinct().select_related('user', 'sucursal_principal')
 
-    barberos_data = []
-    for b in barberos:
-        stats = b.valoraciones.aggregate(promedio=Avg('puntuacion'), total=Count('id'))
-        barberos_data.append({
+    barberos_data = [
+        {
             'barbero': b,
-            'promedio': round(stats['promedio'] or 0, 1),
-            'total_valoraciones': stats['total']
-        })
+            'promedio': round(b.promedio_valoracion or 0, 1),
+            'total_valoraciones': b.total_valoraciones
+        }
+        for b in barberos
+    ]
 
     context = {
         'barberos_data': barberos_data,
@@ -489,7 +500,7 @@ def buscar_barberos(request):
 def canjear_puntos(request, barberia_id):
     """HU42: Canjear puntos por descuento"""
     try:
-        programa = ProgramaFidelidad.objects.get(barberia_id=barberia_id, activo=True)
+        programa = ProgramaFidelidad.objects.select_related('barberia').get(barberia_id=barberia_id, activo=True)
     except ProgramaFidelidad.DoesNotExist:
         messages.error(request, "Esta barbería no tiene programa de fidelidad")
         return redirect('panel_cliente')